@@ -1,4 +1,4 @@
-from fastapi import FastAPI, Depends, HTTPException, Request, Response
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, Query
 from fastapi import Request
 from fastapi import FastAPI, Depends, HTTPException, Request
 from pydantic import BaseModel
@@ -10,16 +10,36 @@ from datetime import date
 from fastapi.responses import FileResponse
 import os
 import shutil
+import subprocess
 from fastapi import UploadFile, File, Form
 from fastapi.staticfiles import StaticFiles
 from datetime import datetime
 from fastapi import FastAPI, Depends, HTTPException, Request, Response
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
 import re  
+import uuid
+from email.utils import formatdate, parsedate_to_datetime
+from urllib.parse import quote, unquote
 from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 import json
+import threading
+import time
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from starlette.concurrency import run_in_threadpool
+import anyio.to_thread
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import string
+from functools import lru_cache
+import asyncio
+import base64
+import hashlib
 app = FastAPI()
 
 # Create uploads directory
@@ -41,6 +61,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Count"],
 )
 
 # Add this model class (put it near the top with other models)
@@ -54,8 +75,15 @@ class LoginRequest(BaseModel):
 
 # Replace your entire users.php GET endpoint with this:
 @app.get("/users.php")
-async def get_users_php(request: Request):
-    """PHP compatible endpoint for getting users"""
+def get_users_php(
+    request: Request,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
+    """PHP compatible endpoint for getting users (role/all lists are keyset-paged on id)"""
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
@@ -74,12 +102,13 @@ async def get_users_php(request: Request):
             result = cursor.fetchone()
             if result:
                 result = [result]
-        elif role:
-            cursor.execute("SELECT * FROM users WHERE role = %s", (role,))
-            result = cursor.fetchall()
         else:
-            cursor.execute("SELECT * FROM users")
-            result = cursor.fetchall()
+            result, next_cursor, total = fetch_list_page(
+                cursor, "users", "u", "id", ascending=True,
+                where=["u.role = %s"] if role else [], params=[role] if role else [],
+                fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
+            )
+            set_page_headers(response, next_cursor, total)
         
         cursor.close()
         db.close()
@@ -96,6 +125,8 @@ async def get_users_php(request: Request):
         
         return result if result else []
         
+    except HTTPException:
+        raise
     except Exception as e:
         return {"error": str(e), "success": False}
 
@@ -105,7 +136,13 @@ async def create_user_php(request: Request):
     """PHP compatible endpoint for creating user"""
     try:
         data = await request.json()
-        
+        return await run_in_threadpool(_create_user_php, data)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def _create_user_php(data: dict):
+    try:
         db = get_db()
         cursor = db.cursor()
         
@@ -130,9 +167,11 @@ async def create_user_php(request: Request):
         """, (userid, password, fullName, dob, phone, email, education,
               qualification, subject, address, current_year, role))
         
-        db.commit()
         inserted_id = cursor.lastrowid
+        update_student_enrollment(db, inserted_id)
+        db.commit()
         cursor.close()
+        refresh_subject_teacher_index(db, inserted_id)
         db.close()
         
         return {"success": True, "insert_id": inserted_id}
@@ -146,7 +185,13 @@ async def update_user_php(request: Request):
     """PHP compatible endpoint for updating user"""
     try:
         data = await request.json()
-        
+        return await run_in_threadpool(_update_user_php, data)
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+def _update_user_php(data: dict):
+    try:
         db = get_db()
         cursor = db.cursor()
         
@@ -167,9 +212,11 @@ async def update_user_php(request: Request):
             user_id
         ))
         
-        db.commit()
         affected = cursor.rowcount
+        update_student_enrollment(db, user_id)
+        db.commit()
         cursor.close()
+        refresh_subject_teacher_index(db, user_id)
         db.close()
         
         return {"success": True, "affected_rows": affected}
@@ -179,7 +226,7 @@ async def update_user_php(request: Request):
 
 # Replace your DELETE endpoint with this:
 @app.delete("/users.php")
-async def delete_user_php(request: Request):
+def delete_user_php(request: Request):
     """PHP compatible endpoint for deleting user"""
     try:
         user_id = request.query_params.get("id")
@@ -190,9 +237,11 @@ async def delete_user_php(request: Request):
         db = get_db()
         cursor = db.cursor()
         cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
-        db.commit()
         affected = cursor.rowcount
+        update_student_enrollment(db, user_id)
+        db.commit()
         cursor.close()
+        refresh_subject_teacher_index(db, user_id)
         db.close()
         
         return {"success": True, "affected_rows": affected}
@@ -226,19 +275,1000 @@ def login(login_data: LoginRequest):
     except Exception as e:
         return {"success": False, "message": str(e)}
 
-# ✅ Database connection function
+# ------------------- LOGGING -------------------
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()                  # DEBUG / INFO / WARNING / ERROR
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")                         # "text" or "json"
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1.0"))         # share of DEBUG/INFO records kept
+RESPONSE_DEBUG = os.getenv("RESPONSE_DEBUG", "0") == "1"             # include "debug" blocks in API responses
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps every WARNING and above; keeps DEBUG/INFO records with probability `rate`"""
+
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or self.rate >= 1.0:
+            return True
+        return random.random() < self.rate
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line; extra={"fields": {...}} is merged into the object"""
+
+    def format(self, record):
+        entry = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """
+    Route the app logger through a QueueHandler so request threads only enqueue records;
+    a QueueListener thread does the formatting and the stdout writes.
+    """
+    log_queue = queue.SimpleQueue()
+    
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_RATE))
+    
+    stream_handler = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonLogFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    
+    app_logger = logging.getLogger("islamiccenter")
+    app_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    app_logger.handlers = [queue_handler]
+    app_logger.propagate = False
+    
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    return app_logger, listener
+
+
+logger, log_listener = setup_logging()
+
+
+def debug_block(info):
+    """`{"debug": info}` when RESPONSE_DEBUG is on, else `{}`; spread into a response dict"""
+    return {"debug": info} if RESPONSE_DEBUG else {}
+
+
+# ✅ Database connection settings (override with environment variables)
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", ""),           # your MySQL password if any
+    "database": os.getenv("DB_NAME", "islamiccenter"),
+}
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))                      # connections kept open
+DB_POOL_MAX_OVERFLOW = int(os.getenv("DB_POOL_MAX_OVERFLOW", "10"))      # extra connections allowed at peak
+DB_POOL_RECYCLE_SECONDS = int(os.getenv("DB_POOL_RECYCLE_SECONDS", "1800"))  # reconnect connections older than this
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"             # ping idle connections before reuse
+DB_POOL_TIMEOUT_SECONDS = float(os.getenv("DB_POOL_TIMEOUT_SECONDS", "10"))  # wait for a free connection
+
+# Blocking work (plain `def` endpoints, run_in_threadpool calls, file reads) runs on
+# anyio's default thread pool instead of the event loop; this bounds its size
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", "40"))
+
+
+class DBPoolTimeout(Exception):
+    """Raised when no pooled connection becomes free within DB_POOL_TIMEOUT_SECONDS"""
+
+
+class DBConnectionPool:
+    """Thread-safe MySQL connection pool with overflow, recycling and pre-ping"""
+
+    def __init__(self, config, size, max_overflow, recycle_seconds, pre_ping, timeout):
+        self.config = config
+        self.size = size
+        self.max_overflow = max_overflow
+        self.recycle_seconds = recycle_seconds
+        self.pre_ping = pre_ping
+        self.timeout = timeout
+        self._idle = deque()          # (raw connection, created_at)
+        self._checked_out = 0
+        self._created_total = 0
+        self._cond = threading.Condition()
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.config)
+        self._created_total += 1
+        return conn, time.monotonic()
+
+    def _discard(self, raw):
+        try:
+            raw.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, raw, created_at):
+        if self.recycle_seconds and time.monotonic() - created_at > self.recycle_seconds:
+            return False
+        if self.pre_ping:
+            try:
+                raw.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def acquire(self):
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            while True:
+                if self._idle:
+                    raw, created_at = self._idle.pop()
+                    self._checked_out += 1
+                    break
+                if self._checked_out < self.size + self.max_overflow:
+                    raw, created_at = None, None
+                    self._checked_out += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DBPoolTimeout(
+                        f"No database connection available within {self.timeout}s "
+                        f"(pool size {self.size}, overflow {self.max_overflow})"
+                    )
+                self._cond.wait(remaining)
+
+        # Connect / validate outside the lock so slow handshakes don't block other threads
+        try:
+            if raw is not None and not self._is_usable(raw, created_at):
+                self._discard(raw)
+                raw = None
+            if raw is None:
+                raw, created_at = self._connect()
+        except Exception:
+            with self._cond:
+                self._checked_out -= 1
+                self._cond.notify()
+            raise
+
+        return PooledConnection(self, raw, created_at)
+
+    def release(self, raw, created_at):
+        reusable = True
+        try:
+            # Drop anything a handler left behind (unread rows, uncommitted writes)
+            if raw.unread_result:
+                raw.consume_results()
+            raw.rollback()
+        except Exception:
+            reusable = False
+
+        with self._cond:
+            self._checked_out -= 1
+            if reusable and len(self._idle) < self.size:
+                self._idle.append((raw, created_at))
+                raw = None
+            self._cond.notify()
+
+        if raw is not None:
+            self._discard(raw)
+
+    def status(self):
+        with self._cond:
+            return {
+                "pool_size": self.size,
+                "max_overflow": self.max_overflow,
+                "recycle_seconds": self.recycle_seconds,
+                "pre_ping": self.pre_ping,
+                "idle": len(self._idle),
+                "checked_out": self._checked_out,
+                "connections_created": self._created_total,
+            }
+
+
+class PooledConnection:
+    """Wraps a raw connection so that close() hands it back to the pool"""
+
+    def __init__(self, pool, raw, created_at):
+        self._pool = pool
+        self._raw = raw
+        self._created_at = created_at
+
+    def __getattr__(self, name):
+        raw = self.__dict__.get("_raw")
+        if raw is None:
+            raise AttributeError(f"Connection already returned to pool (accessing '{name}')")
+        return getattr(raw, name)
+
+    @property
+    def closed(self):
+        return self._raw is None
+
+    def cursor(self, *args, **kwargs):
+        """Cursors are instrumented so every query shows up in /metrics"""
+        if self._raw is None:
+            raise AttributeError("Connection already returned to pool (accessing 'cursor')")
+        return InstrumentedCursor(self._raw.cursor(*args, **kwargs))
+
+    def close(self):
+        raw, self._raw = self._raw, None
+        if raw is not None:
+            self._pool.release(raw, self._created_at)
+
+
+_db_pool = None
+_db_pool_lock = threading.Lock()
+
+# Connections checked out during the current request (set by DBSessionMiddleware)
+_request_connections: ContextVar[Optional[list]] = ContextVar("_request_connections", default=None)
+
+
+def get_db_pool():
+    global _db_pool
+    if _db_pool is None:
+        with _db_pool_lock:
+            if _db_pool is None:
+                _db_pool = DBConnectionPool(
+                    DB_CONFIG,
+                    size=DB_POOL_SIZE,
+                    max_overflow=DB_POOL_MAX_OVERFLOW,
+                    recycle_seconds=DB_POOL_RECYCLE_SECONDS,
+                    pre_ping=DB_POOL_PRE_PING,
+                    timeout=DB_POOL_TIMEOUT_SECONDS,
+                )
+    return _db_pool
+
+
+# ✅ Database connection function (draws from the pool; db.close() returns it)
 def get_db():
     try:
-        conn = mysql.connector.connect(
-            host="localhost",
-            user="root",
-            password="",           # your MySQL password if any
-            database="islamiccenter"
-        )
-        return conn
+        conn = get_db_pool().acquire()
+    except DBPoolTimeout as e:
+        raise HTTPException(status_code=503, detail=f"Database busy: {str(e)}")
     except mysql.connector.Error as e:
         raise HTTPException(status_code=500, detail=f"Database connection failed: {str(e)}")
 
+    request_connections = _request_connections.get()
+    if request_connections is not None:
+        request_connections.append(conn)
+    return conn
+
+
+def db_session():
+    """FastAPI dependency: checks out a pooled connection and always returns it, even if the handler raises"""
+    db = get_db()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+class DBSessionMiddleware:
+    """Per-request connection lifecycle: returns any connection a handler forgot to close"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        checked_out = []
+        token = _request_connections.set(checked_out)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _request_connections.reset(token)
+            leaked = [conn for conn in checked_out if not conn.closed]
+            if leaked:
+                await run_in_threadpool(lambda: [conn.close() for conn in leaked])
+
+
+app.add_middleware(DBSessionMiddleware)
+
+
+# ------------------- METRICS -------------------
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Label used for queries run outside a request (startup hooks, background threads)
+BACKGROUND_ROUTE = "(background)"
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus layout"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.total = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.total += 1
+        self.sum += value
+
+
+class MetricsRegistry:
+    """Per-route request and DB metrics, rendered in the Prometheus text format"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}          # (method, route, status) -> count
+        self.latency = {}           # (method, route) -> Histogram
+        self.queries_per_request = {}   # (method, route) -> Histogram
+        self.db_queries = {}        # route -> count
+        self.db_seconds = {}        # route -> seconds
+        self.collectors = []        # callables returning extra exposition lines (background jobs)
+
+    def register_collector(self, collect):
+        self.collectors.append(collect)
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, seconds, query_stats):
+        with self._lock:
+            self.in_flight -= 1
+            key = (method, route, status)
+            self.requests[key] = self.requests.get(key, 0) + 1
+            self.latency.setdefault((method, route), Histogram(LATENCY_BUCKETS)).observe(seconds)
+            self.queries_per_request.setdefault((method, route), Histogram(QUERY_COUNT_BUCKETS)).observe(query_stats.queries)
+            self.db_queries[route] = self.db_queries.get(route, 0) + query_stats.queries
+            self.db_seconds[route] = self.db_seconds.get(route, 0.0) + query_stats.seconds
+
+    def background_query(self, seconds):
+        with self._lock:
+            self.db_queries[BACKGROUND_ROUTE] = self.db_queries.get(BACKGROUND_ROUTE, 0) + 1
+            self.db_seconds[BACKGROUND_ROUTE] = self.db_seconds.get(BACKGROUND_ROUTE, 0.0) + seconds
+
+    @staticmethod
+    def _labels(**labels):
+        escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for v in labels.values())
+        return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+    def _histogram_lines(self, name, histograms):
+        lines = []
+        for (method, route), hist in sorted(histograms.items()):
+            for bound, count in zip(hist.buckets, hist.counts):
+                lines.append(f"{name}_bucket{self._labels(method=method, route=route, le=bound)} {count}")
+            lines.append(f"{name}_bucket{self._labels(method=method, route=route, le='+Inf')} {hist.total}")
+            lines.append(f"{name}_sum{self._labels(method=method, route=route)} {hist.sum}")
+            lines.append(f"{name}_count{self._labels(method=method, route=route)} {hist.total}")
+        return lines
+
+    def render(self):
+        with self._lock:
+            lines = [
+                "# HELP http_requests_in_flight Requests currently being served.",
+                "# TYPE http_requests_in_flight gauge",
+                f"http_requests_in_flight {self.in_flight}",
+                "# HELP http_requests_total Requests by route template and status code.",
+                "# TYPE http_requests_total counter",
+            ]
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f"http_requests_total{self._labels(method=method, route=route, status=status)} {count}")
+            
+            lines += [
+                "# HELP http_request_duration_seconds Request latency by route template.",
+                "# TYPE http_request_duration_seconds histogram",
+            ]
+            lines += self._histogram_lines("http_request_duration_seconds", self.latency)
+            
+            lines += [
+                "# HELP db_queries_per_request Queries executed per request by route template.",
+                "# TYPE db_queries_per_request histogram",
+            ]
+            lines += self._histogram_lines("db_queries_per_request", self.queries_per_request)
+            
+            lines += [
+                "# HELP db_queries_total Queries executed by route template.",
+                "# TYPE db_queries_total counter",
+            ]
+            for route, count in sorted(self.db_queries.items()):
+                lines.append(f"db_queries_total{self._labels(route=route)} {count}")
+            lines += [
+                "# HELP db_query_seconds_total Time spent in cursor.execute by route template.",
+                "# TYPE db_query_seconds_total counter",
+            ]
+            for route, seconds in sorted(self.db_seconds.items()):
+                lines.append(f"db_query_seconds_total{self._labels(route=route)} {round(seconds, 6)}")
+        
+        pool = get_db_pool().status()
+        lines += [
+            "# HELP db_pool_connections Pooled connections by state.",
+            "# TYPE db_pool_connections gauge",
+            f"db_pool_connections{self._labels(state='idle')} {pool['idle']}",
+            f"db_pool_connections{self._labels(state='checked_out')} {pool['checked_out']}",
+            "# HELP db_pool_connections_created_total Connections opened by the pool.",
+            "# TYPE db_pool_connections_created_total counter",
+            f"db_pool_connections_created_total {pool['connections_created']}",
+        ]
+        for collect in self.collectors:
+            try:
+                lines += collect()
+            except Exception as e:
+                logger.debug("Metrics collector failed: %s", e)
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+class RequestQueryStats:
+    """Queries run on behalf of the current request (shared with its worker threads)"""
+
+    __slots__ = ("queries", "seconds", "scope")
+
+    def __init__(self, scope=None):
+        self.queries = 0
+        self.seconds = 0.0
+        self.scope = scope
+
+
+_request_query_stats: ContextVar[Optional[RequestQueryStats]] = ContextVar("_request_query_stats", default=None)
+
+
+def record_query(seconds, operation, params, many=False):
+    stats = _request_query_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+    elif METRICS_ENABLED:
+        metrics.background_query(seconds)
+    
+    # The EXPLAIN runs through a cursor too: never feed it back into the log
+    if seconds * 1000 >= SLOW_QUERY_THRESHOLD_MS and not str(operation).lstrip().upper().startswith("EXPLAIN"):
+        try:
+            slow_query_log.record(operation, params, seconds, stats.scope if stats else None, many)
+        except Exception as e:
+            logger.debug("Could not record slow query: %s", e)
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute/executemany for the metrics"""
+
+    def __init__(self, raw):
+        self._raw = raw
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __iter__(self):
+        return iter(self._raw)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._raw.close()
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._raw.execute(operation, params, *args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - started, operation, params)
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return self._raw.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            record_query(time.perf_counter() - started, operation, seq_params, many=True)
+
+
+class MetricsMiddleware:
+    """Per-route latency, status and query counts; routes are labelled by template, not raw path"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        query_stats = RequestQueryStats(scope)
+        token = _request_query_stats.set(query_stats)
+        metrics.request_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            _request_query_stats.reset(token)
+            route = getattr(scope.get("route"), "path", None) or "(unmatched)"
+            metrics.request_finished(scope["method"], route, status, time.perf_counter() - started, query_stats)
+
+
+app.add_middleware(MetricsMiddleware)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus text exposition of the request and DB metrics for this worker"""
+    return Response(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+# ------------------- SLOW QUERY LOG -------------------
+
+SLOW_QUERY_THRESHOLD_MS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "1") == "1"
+SLOW_QUERY_EXPLAIN_TTL_SECONDS = 600    # re-EXPLAIN the same statement at most this often
+SLOW_QUERY_MAX_STATEMENTS = int(os.getenv("SLOW_QUERY_MAX_STATEMENTS", "500"))
+
+_SQL_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_SQL_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_SQL_PLACEHOLDER = re.compile(r"%(?:\([A-Za-z_][A-Za-z0-9_]*\))?s")
+_SQL_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_EXPLAINABLE = re.compile(r"^\(?\s*(SELECT|WITH)\b", re.IGNORECASE)
+
+
+def normalize_sql(operation):
+    """Statement fingerprint: literals and placeholders become ?, IN lists collapse, whitespace folds"""
+    sql = operation.decode() if isinstance(operation, (bytes, bytearray)) else str(operation)
+    sql = _SQL_STRING.sub("?", sql)
+    sql = _SQL_PLACEHOLDER.sub("?", sql)
+    sql = _SQL_NUMBER.sub("?", sql)
+    sql = _SQL_IN_LIST.sub("(?+)", sql)
+    return " ".join(sql.split())
+
+
+def params_shape(params):
+    """Types, never values: parameters can hold passwords and personal data"""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+class SlowQueryLog:
+    """
+    Ring buffer of queries slower than SLOW_QUERY_THRESHOLD_MS, plus per-statement
+    totals. SELECTs are EXPLAINed on a background thread with their original
+    parameters, at most once per statement every SLOW_QUERY_EXPLAIN_TTL_SECONDS.
+    Both per-statement maps keep only the `max_statements` most recently seen
+    fingerprints, since unparameterized SQL can produce any number of them.
+    """
+
+    def __init__(self, size, max_statements):
+        self._entries = deque(maxlen=size)
+        self._max_statements = max_statements
+        self._by_statement = OrderedDict()  # fingerprint -> {"count", "total_ms", "max_ms", "last_seen", "route"}
+        self._explained = OrderedDict()     # fingerprint -> (monotonic time, plan)
+        self._lock = threading.Lock()
+        self._explain_queue = queue.Queue(maxsize=100)
+        self._thread = None
+
+    def record(self, operation, params, seconds, scope, many=False):
+        fingerprint = normalize_sql(operation)
+        route = getattr(scope.get("route"), "path", None) if scope else BACKGROUND_ROUTE
+        endpoint = getattr(scope.get("endpoint"), "__name__", None) if scope else None
+        elapsed_ms = round(seconds * 1000, 1)
+        entry = {
+            "at": datetime.now().isoformat(),
+            "ms": elapsed_ms,
+            "sql": fingerprint,
+            "params": f"executemany x {len(params) if hasattr(params, '__len__') else '?'}" if many else params_shape(params),
+            "route": route,
+            "endpoint": endpoint,
+            "explain": None,
+        }
+        
+        with self._lock:
+            self._entries.append(entry)
+            totals = self._by_statement.setdefault(fingerprint, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+            self._by_statement.move_to_end(fingerprint)
+            while len(self._by_statement) > self._max_statements:
+                self._by_statement.popitem(last=False)
+            totals["count"] += 1
+            totals["total_ms"] = round(totals["total_ms"] + elapsed_ms, 1)
+            totals["max_ms"] = max(totals["max_ms"], elapsed_ms)
+            totals["last_seen"] = entry["at"]
+            totals["route"] = route
+            cached = self._explained.get(fingerprint)
+        
+        logger.warning("Slow query %.1f ms in %s (%s): %s", elapsed_ms, route, endpoint, fingerprint[:500])
+        
+        if not SLOW_QUERY_EXPLAIN or many or not _EXPLAINABLE.match(fingerprint):
+            return
+        if cached and time.monotonic() - cached[0] < SLOW_QUERY_EXPLAIN_TTL_SECONDS:
+            entry["explain"] = cached[1]
+            return
+        try:
+            self._explain_queue.put_nowait((entry, fingerprint, operation, params))
+            self._start()
+        except queue.Full:
+            pass
+
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="slow-query-explain", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            entry, fingerprint, operation, params = self._explain_queue.get()
+            with self._lock:
+                cached = self._explained.get(fingerprint)
+            if cached and time.monotonic() - cached[0] < SLOW_QUERY_EXPLAIN_TTL_SECONDS:
+                entry["explain"] = cached[1]
+                continue
+            try:
+                plan = self._explain(operation, params)
+            except Exception as e:
+                plan = {"error": str(e)}
+            with self._lock:
+                self._explained[fingerprint] = (time.monotonic(), plan)
+                self._explained.move_to_end(fingerprint)
+                while len(self._explained) > self._max_statements:
+                    self._explained.popitem(last=False)
+            entry["explain"] = plan
+
+    @staticmethod
+    def _explain(operation, params):
+        db = get_db()
+        try:
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(f"EXPLAIN {operation}", params)
+            plan = jsonable_encoder(cursor.fetchall())
+            cursor.close()
+            return plan
+        finally:
+            db.close()
+
+    def snapshot(self, limit):
+        with self._lock:
+            entries = list(self._entries)[-limit:][::-1]
+            statements = sorted(
+                ({"sql": sql, **totals} for sql, totals in self._by_statement.items()),
+                key=lambda s: s["total_ms"], reverse=True
+            )
+        return entries, statements
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_statement.clear()
+            self._explained.clear()
+
+
+slow_query_log = SlowQueryLog(SLOW_QUERY_LOG_SIZE, SLOW_QUERY_MAX_STATEMENTS)
+
+
+@app.get("/admin/slow-queries")
+def get_slow_queries(limit: int = 50):
+    """Recent slow queries (newest first) with their EXPLAIN, and totals per normalized statement"""
+    entries, statements = slow_query_log.snapshot(max(1, min(limit, SLOW_QUERY_LOG_SIZE)))
+    return {
+        "success": True,
+        "threshold_ms": SLOW_QUERY_THRESHOLD_MS,
+        "queries": entries,
+        "statements": statements,
+    }
+
+
+@app.delete("/admin/slow-queries")
+def clear_slow_queries():
+    slow_query_log.clear()
+    return {"success": True}
+
+
+@app.get("/admin/db-pool")
+def get_db_pool_status():
+    """Connection pool usage (idle / checked out / created)"""
+    return {"success": True, "pool": get_db_pool().status()}
+
+
+@app.on_event("startup")
+async def configure_worker_threads():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = WORKER_THREADS
+
+
+# ------------------- SCHEMA MIGRATIONS -------------------
+
+# Versioned, forward-only schema changes. Applied versions are recorded in
+# schema_migrations; pending ones run in order at startup (or via
+# POST /admin/schema/migrate), then the required indexes are verified.
+SCHEMA_MIGRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INT NOT NULL PRIMARY KEY,
+        name VARCHAR(255) NOT NULL,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+"""
+
+# (table, index name, columns) for the columns the hot queries filter and sort on.
+# An existing index with the same leading columns counts, whatever its name.
+SCHEMA_INDEXES = [
+    ("users", "idx_users_userid_role", ("userId", "role")),
+    ("users", "idx_users_role", ("role",)),
+    ("years", "idx_years_name", ("name",)),
+    ("subjects", "idx_subjects_year", ("year_id",)),
+    ("lectures", "idx_lectures_teacher_subject", ("teacher_id", "subject_name")),
+    ("lectures", "idx_lectures_subject_upload", ("subject_name", "upload_date")),
+    ("lectures", "idx_lectures_upload_date", ("upload_date",)),
+    ("assignments", "idx_assignments_teacher_subject", ("teacher_id", "subject_name")),
+    ("assignments", "idx_assignments_subject_due", ("subject_name", "due_date")),
+    ("assignments", "idx_assignments_created_date", ("created_date",)),
+    ("assignment_submissions", "idx_submissions_assignment_student", ("assignment_id", "student_id")),
+    ("assignment_submissions", "idx_submissions_student_date", ("student_id", "submission_date")),
+    ("notifications", "idx_notifications_subject_created", ("subject_name", "created_date")),
+    ("notifications", "idx_notifications_teacher_subject", ("teacher_id", "subject_name")),
+    ("notifications", "idx_notifications_created_date", ("created_date",)),
+    ("quizzes", "idx_quizzes_teacher_subject", ("teacher_id", "subject_name")),
+    ("quizzes", "idx_quizzes_published_end", ("is_published", "end_date")),
+    ("quizzes", "idx_quizzes_created_date", ("created_date",)),
+    ("questions", "idx_questions_quiz", ("quiz_id",)),
+    ("options", "idx_options_question", ("question_id",)),
+    ("student_attempts", "idx_attempts_student_quiz", ("student_id", "quiz_id")),
+    ("student_attempts", "idx_attempts_quiz", ("quiz_id",)),
+    ("student_answers", "idx_answers_attempt", ("attempt_id",)),
+    ("materials", "idx_materials_teacher_subject", ("teacher_id", "subject_name")),
+    ("materials", "idx_materials_upload_date", ("upload_date",)),
+    ("lectures", "idx_lectures_hls_status", ("hls_status",)),
+]
+
+
+def existing_indexes(cursor):
+    """{table: [column tuple of each index]} for the current database"""
+    cursor.execute("""
+        SELECT table_name AS table_name, index_name AS index_name, column_name AS column_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+        ORDER BY table_name, index_name, seq_in_index
+    """)
+    columns_by_index = {}
+    for row in cursor.fetchall():
+        columns_by_index.setdefault((row['table_name'], row['index_name']), []).append(row['column_name'])
+    indexes = {}
+    for (table, _), columns in columns_by_index.items():
+        indexes.setdefault(table, []).append(tuple(c.lower() for c in columns))
+    return indexes
+
+
+def index_covered(indexes, table, columns):
+    wanted = tuple(c.lower() for c in columns)
+    return any(index[:len(wanted)] == wanted for index in indexes.get(table, ()))
+
+
+def missing_indexes(indexes):
+    return [
+        {"table": table, "index": name, "columns": list(columns)}
+        for table, name, columns in SCHEMA_INDEXES
+        if not index_covered(indexes, table, columns)
+    ]
+
+
+class SchemaCache:
+    """
+    Columns and indexes of the current database, read from information_schema once
+    at startup and again after migrations, so handlers can check for optional
+    columns without a query.
+    """
+
+    def __init__(self):
+        self._columns = {}      # table -> {column: {"Field", "Type", "Null", "Key", "Default", "Extra"}}
+        self._indexes = {}      # table -> [column tuples]
+        self._lock = threading.Lock()
+        self.loaded_at = None
+
+    def load(self, cursor):
+        cursor.execute("""
+            SELECT table_name AS table_name, column_name AS column_name, column_type AS column_type,
+                   is_nullable AS is_nullable, column_key AS column_key,
+                   column_default AS column_default, extra AS extra
+            FROM information_schema.columns
+            WHERE table_schema = DATABASE()
+            ORDER BY table_name, ordinal_position
+        """)
+        columns = {}
+        for row in cursor.fetchall():
+            columns.setdefault(row['table_name'], {})[row['column_name']] = {
+                "Field": row['column_name'],
+                "Type": row['column_type'],
+                "Null": row['is_nullable'],
+                "Key": row['column_key'],
+                "Default": row['column_default'],
+                "Extra": row['extra'],
+            }
+        indexes = existing_indexes(cursor)
+        with self._lock:
+            self._columns = columns
+            self._indexes = indexes
+            self.loaded_at = datetime.now().isoformat()
+
+    def _ensure_loaded(self):
+        # Normally loaded by the startup migrations; this covers a failed startup load
+        if self.loaded_at is None:
+            db = get_db()
+            try:
+                cursor = db.cursor(dictionary=True)
+                self.load(cursor)
+                cursor.close()
+            finally:
+                db.close()
+
+    def has_table(self, table):
+        self._ensure_loaded()
+        return table in self._columns
+
+    def has_column(self, table, column):
+        self._ensure_loaded()
+        return column in self._columns.get(table, {})
+
+    def describe(self, table):
+        """DESCRIBE-shaped rows for a table"""
+        self._ensure_loaded()
+        return list(self._columns.get(table, {}).values())
+
+    def indexes(self):
+        self._ensure_loaded()
+        return self._indexes
+
+
+schema_cache = SchemaCache()
+
+
+def _migration_feature_tables(cursor):
+    """Tables added for the dashboards, enrollments and notification reads"""
+    for ddl in (STUDENT_DASHBOARD_ROLLUPS_DDL, TEACHER_SUBJECT_STATS_DDL, STUDENT_SUBJECT_ENROLLMENTS_DDL,
+                STUDENT_ENROLLMENT_YEARS_DDL, NOTIFICATION_READS_DDL):
+        cursor.execute(ddl)
+
+
+# CREATE INDEX errors meaning "not in this schema (yet)": no such table / no such column
+_INDEX_TARGET_MISSING = (1146, 1072)
+
+
+def _migration_hot_indexes(cursor):
+    """
+    Composite indexes for the hot filter columns. A table or column that doesn't exist
+    is skipped (a later migration that adds it re-runs this); any other failure aborts
+    the migration so it is retried instead of being recorded as applied.
+    """
+    indexes = existing_indexes(cursor)
+    for table, name, columns in SCHEMA_INDEXES:
+        if index_covered(indexes, table, columns):
+            continue
+        try:
+            cursor.execute(f"CREATE INDEX {name} ON {table} ({', '.join(columns)})")
+            indexes.setdefault(table, []).append(tuple(c.lower() for c in columns))
+            logger.info("Created index %s on %s(%s)", name, table, ", ".join(columns))
+        except mysql.connector.Error as e:
+            if e.errno not in _INDEX_TARGET_MISSING:
+                raise
+            logger.warning("Skipped index %s on %s: %s", name, table, e)
+
+
+def schema_migrations():
+    """
+    (version, name, apply(cursor)) in order; never edit or renumber an applied entry.
+    apply may return a callable to run once its transaction is committed (file cleanup).
+    """
+    return [
+        (1, "feature tables", _migration_feature_tables),
+        (2, "hot filter indexes", _migration_hot_indexes),
+        (3, "upload blobs", _migration_upload_blobs),
+        (4, "dedup uploads tree", _migration_dedup_uploads),
+        (5, "lecture hls status", _migration_lecture_hls),
+    ]
+
+
+schema_status = {"applied": [], "pending": [], "missing_indexes": [], "checked_at": None}
+SCHEMA_MIGRATIONS_LOCK_NAME = "islamiccenter_schema_migrations"
+SCHEMA_MIGRATIONS_LOCK_TIMEOUT = int(os.getenv("SCHEMA_MIGRATIONS_LOCK_TIMEOUT", "900"))  # data migrations can be slow
+
+
+def run_schema_migrations(apply=True):
+    """
+    Apply pending migrations (unless apply=False), then verify the indexes; returns schema_status.
+    A MySQL named lock serializes workers: the others wait, then find the versions applied.
+    """
+    db = get_db()
+    locked = False
+    try:
+        cursor = db.cursor(dictionary=True)
+        if apply:
+            cursor.execute("SELECT GET_LOCK(%s, %s) AS locked", (SCHEMA_MIGRATIONS_LOCK_NAME, SCHEMA_MIGRATIONS_LOCK_TIMEOUT))
+            locked = cursor.fetchone()['locked'] == 1
+            if not locked:
+                raise RuntimeError(f"Another worker held the migration lock for {SCHEMA_MIGRATIONS_LOCK_TIMEOUT}s")
+        
+        cursor.execute(SCHEMA_MIGRATIONS_DDL)
+        cursor.execute("SELECT version FROM schema_migrations")
+        applied = {row['version'] for row in cursor.fetchall()}
+        
+        for version, name, migrate in schema_migrations():
+            if version in applied or not apply:
+                continue
+            logger.info("Applying schema migration %d: %s", version, name)
+            after_commit = migrate(cursor)
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            db.commit()
+            applied.add(version)
+            if after_commit:
+                after_commit()
+        
+        # Migrations may have added columns or indexes: reload what handlers check against
+        schema_cache.load(cursor)
+        missing = missing_indexes(schema_cache.indexes())
+        cursor.close()
+    finally:
+        if locked:
+            try:
+                cursor = db.cursor()
+                cursor.execute("SELECT RELEASE_LOCK(%s)", (SCHEMA_MIGRATIONS_LOCK_NAME,))
+                cursor.fetchall()
+                cursor.close()
+            except Exception as e:
+                logger.warning("Could not release the migration lock: %s", e)
+        db.close()
+    
+    schema_status.update({
+        "applied": sorted(applied),
+        "pending": [version for version, _, _ in schema_migrations() if version not in applied],
+        "missing_indexes": missing,
+        "checked_at": datetime.now().isoformat(),
+    })
+    for index in missing:
+        logger.warning("Missing index on %s(%s)", index['table'], ", ".join(index['columns']))
+    return schema_status
+
+
+@app.on_event("startup")
+def apply_schema_migrations():
+    # Registered before the feature startup hooks so their tables exist when they run
+    try:
+        run_schema_migrations()
+    except Exception as e:
+        logger.warning("Schema migrations did not run: %s", e)
+
+
+@app.get("/admin/schema")
+def get_schema_status(verify: bool = False):
+    """Applied/pending migrations and required indexes that are missing (verify=true re-checks now)"""
+    try:
+        status = run_schema_migrations(apply=False) if verify else schema_status
+        return {"success": True, **status, "schema_cache_loaded_at": schema_cache.loaded_at}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/admin/schema/migrate")
+def migrate_schema():
+    try:
+        return {"success": True, **run_schema_migrations()}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 # ✅ Pydantic Schemas
 class Year(BaseModel):
     id: Optional[int] = None
@@ -326,15 +1356,7 @@ def get_predefined_subjects_by_year(year_id: int):
 @app.get("/all_subjects")
 def get_all_subjects():
     try:
-        # Use the existing predefined_subjects data
-        all_subjects_set = set()
-        for year_subjects in predefined_subjects.values():
-            for subject in year_subjects:
-                all_subjects_set.add(subject["subject_name"])
-        
-        # Convert to list and sort alphabetically
-        all_subjects_list = sorted(list(all_subjects_set))
-        return {"subjects": all_subjects_list}
+        return {"subjects": list(ALL_SUBJECTS)}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching subjects: {str(e)}")
 # Initialize Database with Predefined Data
@@ -365,6 +1387,7 @@ def initialize_data():
                         (year_ids[year_code], subject["subject_name"], subject["duration_months"])
                     )
         
+        invalidate_enrollments(cursor)
         db.commit()
         cursor.close()
         db.close()
@@ -397,6 +1420,7 @@ def add_year(year: Year):
         cursor = db.cursor()
         cursor.execute("INSERT INTO years (code, name, start_date) VALUES (%s, %s, %s)",
                        (year.code, year.name, year.start_date))
+        invalidate_enrollments(cursor, unresolved_only=True)
         db.commit()
         cursor.close()
         db.close()
@@ -441,6 +1465,7 @@ def add_subject(subject: Subject):
         
         cursor.execute("INSERT INTO subjects (year_id, subject_name, duration_months) VALUES (%s, %s, %s)",
                        (subject.year_id, subject.subject_name, subject.duration_months))
+        invalidate_enrollments(cursor, year_id=subject.year_id)
         db.commit()
         cursor.close()
         db.close()
@@ -451,19 +1476,62 @@ def add_subject(subject: Subject):
         raise HTTPException(status_code=500, detail=f"Error adding subject: {str(e)}")
 
 
-def is_subject_match(teacher_subject, available_subject):
-    """Strict subject matching (ignores punctuation & case, but not just words)"""
-    if not teacher_subject or not available_subject:
-        return False
-        
-    # Convert to lowercase and remove extra spaces/punctuation
-    teacher_subj = teacher_subject.lower().strip().replace('-', ' ').replace('&', 'and')
-    available_subj = available_subject.lower().strip().replace('-', ' ').replace('&', 'and')
+# ------------------- SUBJECT CATALOG -------------------
+
+# Every predefined subject name, built once
+ALL_SUBJECTS = sorted({subject["subject_name"] for year_subjects in predefined_subjects.values() for subject in year_subjects})
+
+_PUNCTUATION_TABLE = str.maketrans('', '', string.punctuation)
+
+# Common spelling variations mapping
+SUBJECT_SPELLING_VARIATIONS = {
+    "ilin": "ilm",
+    "agaid": "aqaid", 
+    "kalam": "kalām",
+    "fiqh": "fiqh",
+    "quran": "qur'an",
+    "ul": "ul",
+    "un": "un",
+    "us": "us",
+    "surf": "sarf",
+    "koraz": "kanz",
+    "hidaya": "hidāyah",
+    "ahkam": "aḥkām",
+    "sharia": "sharīʿah",
+    "ilm ul": "ilm-ul",
+    "ilm un": "ilm-un",
+    "ilm us": "ilm-us"
+}
+
+
+@lru_cache(maxsize=4096)
+def _normalized_subject(subject):
+    """Lowercase, '-' → ' ', '&' → 'and', punctuation removed"""
+    normalized = subject.lower().strip().replace('-', ' ').replace('&', 'and')
+    return normalized.translate(_PUNCTUATION_TABLE)
+
+
+@lru_cache(maxsize=4096)
+def _spelling_normalized_subject(subject):
+    normalized = _normalized_subject(subject)
+    for wrong, correct in SUBJECT_SPELLING_VARIATIONS.items():
+        normalized = normalized.replace(wrong, correct)
+    return normalized
+
+
+@lru_cache(maxsize=4096)
+def subject_key(subject):
+    """Exact-match key: lowercase, punctuation removed, whitespace collapsed"""
+    return ' '.join(subject.lower().strip().translate(_PUNCTUATION_TABLE).split())
+
+
+def is_subject_match(teacher_subject, available_subject):
+    """Strict subject matching (ignores punctuation & case, but not just words)"""
+    if not teacher_subject or not available_subject:
+        return False
     
-    # Remove common punctuation
-    import string
-    teacher_subj = teacher_subj.translate(str.maketrans('', '', string.punctuation))
-    available_subj = available_subj.translate(str.maketrans('', '', string.punctuation))
+    teacher_subj = _normalized_subject(teacher_subject)
+    available_subj = _normalized_subject(available_subject)
     
     # Exact match
     if teacher_subj == available_subj:
@@ -473,36 +1541,111 @@ def is_subject_match(teacher_subject, available_subject):
     if teacher_subj in available_subj or available_subj in teacher_subj:
         return True
     
-    # Common spelling variations mapping
-    variations = {
-        "ilin": "ilm",
-        "agaid": "aqaid", 
-        "kalam": "kalām",
-        "fiqh": "fiqh",
-        "quran": "qur'an",
-        "ul": "ul",
-        "un": "un",
-        "us": "us",
-        "surf": "sarf",
-        "koraz": "kanz",
-        "hidaya": "hidāyah",
-        "ahkam": "aḥkām",
-        "sharia": "sharīʿah",
-        "ilm ul": "ilm-ul",
-        "ilm un": "ilm-un",
-        "ilm us": "ilm-us"
-    }
-    
-    # Replace common variations
-    normalized_teacher = teacher_subj
-    normalized_available = available_subj
-    
-    for wrong, correct in variations.items():
-        normalized_teacher = normalized_teacher.replace(wrong, correct)
-        normalized_available = normalized_available.replace(wrong, correct)
-    
     # ✅ Strict match only (no "common words" fuzzy rule)
-    return normalized_teacher == normalized_available
+    return _spelling_normalized_subject(teacher_subject) == _spelling_normalized_subject(available_subject)
+
+
+@lru_cache(maxsize=1024)
+def catalog_matches(teacher_subject):
+    """Catalog subjects (sorted) matching one subject string"""
+    if not teacher_subject:
+        return ()
+    return tuple(subject for subject in ALL_SUBJECTS if is_subject_match(teacher_subject, subject))
+
+
+SUBJECT_TEACHER_INDEX_TTL_SECONDS = float(os.getenv("SUBJECT_TEACHER_INDEX_TTL_SECONDS", "300"))
+
+
+class SubjectTeacherIndex:
+    """
+    Inverted index: subject_key → teachers whose comma-separated `subject` field
+    names that subject. Kept in sync by this worker's /users.php write endpoints,
+    and rebuilt once it is older than `ttl` to pick up writes made by other workers.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._by_key = {}       # subject key -> {user id: teacher}
+        self._keys_by_user = {} # user id -> subject keys the teacher is indexed under
+        self._lock = threading.Lock()
+        self._built_at = 0.0
+        self.built = False
+
+    @property
+    def fresh(self):
+        return self.built and time.monotonic() - self._built_at < self.ttl
+
+    def _remove(self, user_id):
+        for key in self._keys_by_user.pop(user_id, ()):
+            teachers = self._by_key.get(key)
+            if teachers:
+                teachers.pop(user_id, None)
+                if not teachers:
+                    del self._by_key[key]
+
+    def _add(self, user):
+        teacher = {"userId": user["userId"], "fullName": user["fullName"], "subject": user["subject"]}
+        keys = {subject_key(part) for part in (user.get("subject") or "").split(',') if part.strip()}
+        for key in keys:
+            self._by_key.setdefault(key, {})[user["id"]] = teacher
+        self._keys_by_user[user["id"]] = keys
+
+    def build(self, db):
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT id, userId, fullName, subject FROM users WHERE role = 'teacher' ORDER BY id")
+        teachers = cursor.fetchall()
+        cursor.close()
+        with self._lock:
+            self._by_key.clear()
+            self._keys_by_user.clear()
+            for teacher in teachers:
+                self._add(teacher)
+            self._built_at = time.monotonic()
+            self.built = True
+
+    def refresh_user(self, db, user_id):
+        """Re-read one user after a create/update/delete and re-index them"""
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT id, userId, fullName, subject, role FROM users WHERE id = %s", (user_id,))
+        user = cursor.fetchone()
+        cursor.close()
+        with self._lock:
+            self._remove(int(user_id))
+            if user and user["role"] == 'teacher':
+                self._add(user)
+
+    def teachers_for(self, subject_name):
+        with self._lock:
+            teachers = self._by_key.get(subject_key(subject_name), {})
+            return [teachers[user_id] for user_id in sorted(teachers)]
+
+
+subject_teacher_index = SubjectTeacherIndex(SUBJECT_TEACHER_INDEX_TTL_SECONDS)
+
+
+def ensure_subject_teacher_index():
+    if not subject_teacher_index.fresh:
+        db = get_db()
+        try:
+            subject_teacher_index.build(db)
+        finally:
+            db.close()
+
+
+def refresh_subject_teacher_index(db, user_id):
+    try:
+        subject_teacher_index.refresh_user(db, user_id)
+    except Exception as e:
+        logger.warning("Could not refresh subject index for user %s: %s", user_id, e)
+        subject_teacher_index.built = False
+
+
+@app.on_event("startup")
+def build_subject_teacher_index():
+    try:
+        ensure_subject_teacher_index()
+    except Exception as e:
+        logger.warning("Subject index build deferred: %s", e)
 
 
 @app.get("/teacher_subjects/{user_id}")
@@ -511,36 +1654,19 @@ def get_teacher_subjects(user_id: str):
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"Looking for teacher with userID: {user_id}")  # Debug log
-        
         # Search by userId instead of id
         cursor.execute("SELECT * FROM users WHERE userId = %s AND role = 'teacher'", (user_id,))
         teacher = cursor.fetchone()
         
-        print(f"Query result: {teacher}")  # Debug log
-        
         if not teacher:
             cursor.close()
             db.close()
             raise HTTPException(status_code=404, detail=f"Teacher not found with userID: {user_id}")
         
         teacher_subject = teacher.get("subject")
-        print(f"Found teacher: {teacher['fullName']}, Subject: {teacher_subject}")  # Debug
-        
-        # Get all available subjects
-        all_subjects_set = set()
-        for year_subjects in predefined_subjects.values():
-            for subject in year_subjects:
-                all_subjects_set.add(subject["subject_name"])
-        
-        all_subjects_list = sorted(list(all_subjects_set))
         
         # Find matching subjects with flexible matching
-        matched_subjects = []
-        if teacher_subject:
-            for subject in all_subjects_list:
-                if is_subject_match(teacher_subject, subject):
-                    matched_subjects.append(subject)
+        matched_subjects = list(catalog_matches(teacher_subject))
         
         cursor.close()
         db.close()
@@ -556,7 +1682,7 @@ def get_teacher_subjects(user_id: str):
             },
             "teacher_subject": teacher_subject,
             "matched_subjects": matched_subjects,
-            "all_subjects": all_subjects_list,
+            "all_subjects": list(ALL_SUBJECTS),
             "success": True
         }
         
@@ -567,26 +1693,25 @@ def get_teacher_subjects(user_id: str):
 
 # Also update the other teacher endpoint
 @app.get("/teacher/{user_id}")
-def get_teacher_data(user_id: str):
+def get_teacher_data(user_id: str, db=Depends(db_session)):
     try:
-        db = get_db()
         cursor = db.cursor(dictionary=True)
         
         # Search by userId instead of id
         cursor.execute("SELECT * FROM users WHERE userId = %s AND role = 'teacher'", (user_id,))
         teacher = cursor.fetchone()
+        cursor.close()
         
         if not teacher:
             raise HTTPException(status_code=404, detail=f"Teacher not found with userID: {user_id}")
         
-        cursor.close()
-        db.close()
-        
         return {
             "teacher_data": teacher,
             "success": True
         }
         
+    except HTTPException:
+        raise
     except mysql.connector.Error as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except Exception as e:
@@ -623,8 +1748,7 @@ def debug_database_structure():
         cursor = db.cursor(dictionary=True)
         
         # Check users table structure
-        cursor.execute("DESCRIBE users")
-        users_structure = cursor.fetchall()
+        users_structure = schema_cache.describe("users")
         
         # Check if any teachers exist
         cursor.execute("SELECT id, userId, fullName, subject, role FROM users WHERE role = 'teacher'")
@@ -668,6 +1792,7 @@ def create_sample_teachers():
         
         db.commit()
         cursor.close()
+        subject_teacher_index.build(db)
         db.close()
         
         return {"message": "Sample teachers created successfully", "success": True}
@@ -678,18 +1803,568 @@ def create_sample_teachers():
 
 #teacher courses and materials endpoints will go here
 
+# ------------------- BLOB STORE -------------------
+
+# Lecture, material and assignment files are stored once per content, as
+# uploads/blobs/<sha256[:2]>/<sha256><ext>. Rows keep their own file_name (the
+# download name) and point file_path at the shared blob; upload_blobs counts the
+# rows referencing each blob, so a delete only unlinks the last copy.
+BLOB_TABLES = ("lectures", "materials", "assignments")
+
+UPLOAD_BLOBS_DDL = """
+    CREATE TABLE IF NOT EXISTS upload_blobs (
+        sha256 CHAR(64) NOT NULL PRIMARY KEY,
+        file_path VARCHAR(512) NOT NULL,
+        size BIGINT NOT NULL DEFAULT 0,
+        refcount INT NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE KEY uq_upload_blobs_path (file_path)
+    )
+"""
+
+
+def blob_location(sha256, file_extension):
+    """(file_path as stored in rows, path on disk) of the blob for a content hash"""
+    tail = os.path.join("blobs", sha256[:2], f"{sha256}{file_extension.lower()}")
+    return os.path.join("uploads", tail), os.path.join(UPLOAD_DIR, tail)
+
+
+def adopt_blob(cursor, source_path, sha256, size, keep_source=False):
+    """
+    Take a reference to the blob for `sha256` in the caller's transaction (dictionary cursor).
+    The first copy of some content is moved into the blob store; a copy of content that is
+    already stored is simply dropped. source_path=None references an existing blob without
+    any file (known-content uploads). keep_source links/copies instead of moving, for callers
+    that remove the source only after their commit. Returns (file_path, full_file_path).
+    """
+    file_path, full_file_path = blob_location(sha256, os.path.splitext(source_path or "")[1])
+    if source_path is None:
+        cursor.execute("UPDATE upload_blobs SET refcount = refcount + 1 WHERE sha256 = %s", (sha256,))
+        inserted = False
+        if cursor.rowcount == 0:
+            raise HTTPException(status_code=409, detail="That content is no longer stored; upload the file again")
+    else:
+        cursor.execute(
+            """INSERT INTO upload_blobs (sha256, file_path, size, refcount) VALUES (%s, %s, %s, 1)
+               ON DUPLICATE KEY UPDATE refcount = refcount + 1""",
+            (sha256, file_path, size)
+        )
+        inserted = cursor.rowcount == 1
+    if not inserted:
+        # The blob may have been stored under another extension
+        cursor.execute("SELECT file_path FROM upload_blobs WHERE sha256 = %s", (sha256,))
+        file_path = cursor.fetchone()['file_path']
+        full_file_path = os.path.join(UPLOAD_DIR, os.path.relpath(file_path, "uploads"))
+    
+    if source_path is None or os.path.abspath(source_path) == os.path.abspath(full_file_path):
+        return file_path, full_file_path
+    if os.path.isfile(full_file_path) and not inserted:
+        if not keep_source:
+            os.remove(source_path)
+    else:
+        # New content (even if a released blob's file is still on disk, about to be
+        # removed), or a blob whose file went missing: this copy becomes the blob
+        os.makedirs(os.path.dirname(full_file_path), exist_ok=True)
+        if not keep_source:
+            os.replace(source_path, full_file_path)
+        else:
+            try:
+                os.link(source_path, full_file_path)
+            except OSError:
+                shutil.copy2(source_path, full_file_path)
+    return file_path, full_file_path
+
+
+def release_blob(cursor, file_path):
+    """
+    Drop one row's reference to its file, in the caller's transaction (dictionary cursor).
+    Returns the file to unlink once that transaction has committed: the blob when this was
+    its last reference, the file itself when it is not a blob (uploads from before the
+    blob store), else None. Unlink it with remove_released_file after db.commit().
+    """
+    cursor.execute("SELECT sha256, refcount FROM upload_blobs WHERE file_path = %s FOR UPDATE", (file_path,))
+    blob = cursor.fetchone()
+    if blob and blob['refcount'] > 1:
+        cursor.execute("UPDATE upload_blobs SET refcount = refcount - 1 WHERE sha256 = %s", (blob['sha256'],))
+        return None
+    if blob:
+        cursor.execute("DELETE FROM upload_blobs WHERE sha256 = %s", (blob['sha256'],))
+    return os.path.join(os.getcwd(), file_path)
+
+
+def remove_released_file(full_file_path):
+    """
+    Unlink a file returned by release_blob, after the commit. An upload of the same
+    content that re-created its blob row keeps that file: the check and the unlink run
+    under a locking read on the row, so adopt_blob either commits its row first (and
+    the file stays) or waits for the unlink (and moves its own copy into place).
+    """
+    if not full_file_path or not os.path.exists(full_file_path):
+        return
+    if os.path.basename(os.path.dirname(os.path.dirname(full_file_path))) != "blobs":
+        try:
+            os.remove(full_file_path)
+        except OSError as e:
+            logger.warning("Could not remove %s: %s", full_file_path, e)
+        return
+    
+    db = get_db()
+    try:
+        cursor = db.cursor()
+        file_path = os.path.relpath(full_file_path, os.getcwd()).replace(os.sep, "/")
+        cursor.execute("SELECT 1 FROM upload_blobs WHERE file_path = %s FOR UPDATE", (file_path,))
+        if cursor.fetchone() is None:
+            try:
+                os.remove(full_file_path)
+            except OSError as e:
+                logger.warning("Could not remove %s: %s", full_file_path, e)
+        db.commit()
+        cursor.close()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Could not release %s: %s", full_file_path, e)
+    finally:
+        db.close()
+
+
+def known_blob(cursor, sha256, size):
+    """file_path of a stored blob with this hash and size, else None"""
+    cursor.execute("SELECT file_path, size FROM upload_blobs WHERE sha256 = %s AND refcount > 0", (sha256,))
+    blob = cursor.fetchone()
+    if blob and blob['size'] == size and os.path.isfile(blob['file_path']):
+        return blob['file_path']
+    return None
+
+
+def _migration_upload_blobs(cursor):
+    """Reference-counted blob table for deduplicated uploads"""
+    cursor.execute(UPLOAD_BLOBS_DDL)
+
+
+def _migration_dedup_uploads(cursor):
+    """
+    Point every lecture, material and assignment at a blob, one per distinct content.
+    Blobs are hard links (or copies) of the originals; the originals are removed only
+    after the row updates are committed, so an interrupted run leaves every row valid.
+    """
+    hashed = {}     # source path -> (sha256, size)
+    sources = set()
+    rows = deduplicated = 0
+    for table in BLOB_TABLES:
+        cursor.execute(
+            f"SELECT id, file_path FROM {table} "
+            f"WHERE file_path IS NOT NULL AND file_path NOT IN ('', 'NULL') AND file_path NOT LIKE 'uploads/blobs/%'"
+        )
+        for row in cursor.fetchall():
+            candidates = (row['file_path'], fix_file_path(row['file_path'], None))
+            source = next((path for path in candidates if path and os.path.isfile(path)), None)
+            if source is None:
+                logger.warning("Dedup: %s %s points at a missing file %s", table, row['id'], row['file_path'])
+                continue
+            
+            source = os.path.normpath(source)
+            if source not in hashed:
+                hashed[source] = (sha256_of_file(source).hexdigest(), os.path.getsize(source))
+            sha256, size = hashed[source]
+            file_path, _ = adopt_blob(cursor, source, sha256, size, keep_source=True)
+            cursor.execute(f"UPDATE {table} SET file_path = %s WHERE id = %s", (file_path, row['id']))
+            sources.add(source)
+            rows += 1
+    
+    distinct = len({sha256 for sha256, _ in hashed.values()})
+    deduplicated = len(hashed) - distinct
+    logger.info("Dedup: %d rows now share %d blobs (%d duplicate files)", rows, distinct, deduplicated)
+    
+    def remove_originals():
+        for source in sources:
+            try:
+                os.remove(source)
+            except OSError as e:
+                logger.warning("Dedup: could not remove %s: %s", source, e)
+    return remove_originals
+
+
+@app.get("/admin/blobs")
+def get_blob_store_status():
+    """How many blobs are stored and how much disk the shared references save"""
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT COUNT(*) AS blobs, COALESCE(SUM(size), 0) AS stored_bytes,
+                   COALESCE(SUM(refcount), 0) AS references,
+                   COALESCE(SUM(size * GREATEST(refcount - 1, 0)), 0) AS saved_bytes
+            FROM upload_blobs
+        """)
+        summary = cursor.fetchone()
+        cursor.close()
+        db.close()
+        return {"success": True, **{key: int(value) for key, value in summary.items()}}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# ------------------- CHUNKED UPLOADS -------------------
+
+# Large files (lecture videos especially) are sent as a resumable series of
+# chunks: POST /uploads announces the file, PUT /uploads/{id}?offset=N appends
+# one chunk, POST /uploads/{id}/complete verifies the SHA-256, and the upload id
+# is then passed to POST /lectures, /assignments or /materials in place of
+# `file`. Chunks are written straight into the teacher's upload directory (as
+# <name>.part), so the file is never spooled and copied a second time.
+UPLOAD_LIMITS = {
+    "lectures": int(os.getenv("UPLOAD_MAX_LECTURE_BYTES", str(4 * 1024 ** 3))),
+    "assignments": int(os.getenv("UPLOAD_MAX_ASSIGNMENT_BYTES", str(100 * 1024 ** 2))),
+    "materials": int(os.getenv("UPLOAD_MAX_MATERIAL_BYTES", str(512 * 1024 ** 2))),
+}
+UPLOAD_CHUNK_BYTES = int(os.getenv("UPLOAD_CHUNK_BYTES", str(8 * 1024 ** 2)))     # largest accepted PUT body
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(48 * 3600)))
+UPLOAD_SESSIONS_DIR = os.path.join(UPLOAD_DIR, ".incoming")
+os.makedirs(UPLOAD_SESSIONS_DIR, exist_ok=True)
+
+
+def upload_limit_error(kind, size):
+    limit = UPLOAD_LIMITS[kind]
+    return f"File is {size} bytes; the limit for {kind} is {limit} bytes ({limit // 1024 ** 2} MB)"
+
+
+def sha256_of_file(path, length=None):
+    """SHA-256 hasher fed with the first `length` bytes of `path` (the whole file when None)"""
+    hasher = hashlib.sha256()
+    remaining = length
+    with open(path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(1024 * 1024 if remaining is None else min(1024 * 1024, remaining))
+            if not block:
+                break
+            hasher.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return hasher
+
+
+def store_upload_file(upload, full_file_path, kind):
+    """
+    Copy a multipart UploadFile to its final path, counting and hashing on the way.
+    Returns (size, sha256 hex); raises 413 and removes the partial file past the limit.
+    """
+    limit = UPLOAD_LIMITS[kind]
+    hasher = hashlib.sha256()
+    size = 0
+    with open(full_file_path, "wb") as buffer:
+        while True:
+            block = upload.file.read(1024 * 1024)
+            if not block:
+                break
+            size += len(block)
+            if size > limit:
+                break
+            hasher.update(block)
+            buffer.write(block)
+    if size > limit:
+        os.remove(full_file_path)
+        raise HTTPException(status_code=413, detail=upload_limit_error(kind, size))
+    return size, hasher.hexdigest()
+
+
+class ChunkedUploads:
+    """
+    Upload sessions, each a sidecar JSON in uploads/.incoming plus the growing
+    .part file. The sidecar is the source of truth, so a session survives a
+    restart and can be resumed from any worker; the running SHA-256 is kept in
+    memory and rebuilt from the .part file when this process hasn't seen it.
+    """
+
+    def __init__(self, sessions_dir):
+        self.sessions_dir = sessions_dir
+        self._hashers = {}      # upload id -> (hasher, bytes hashed)
+        self._locks = {}        # upload id -> lock serializing its chunks
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+
+    def _sidecar(self, upload_id):
+        if not re.fullmatch(r"[0-9a-f]{32}", upload_id or ""):
+            raise HTTPException(status_code=404, detail="Upload not found")
+        return os.path.join(self.sessions_dir, f"{upload_id}.json")
+
+    def load(self, upload_id):
+        try:
+            with open(self._sidecar(upload_id)) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            raise HTTPException(status_code=404, detail="Upload not found or expired")
+
+    def _save(self, session):
+        path = self._sidecar(session["upload_id"])
+        with open(f"{path}.tmp", "w") as f:
+            json.dump(session, f)
+        os.replace(f"{path}.tmp", path)
+
+    def _session_lock(self, upload_id):
+        with self._lock:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _forget(self, upload_id):
+        with self._lock:
+            self._hashers.pop(upload_id, None)
+            self._locks.pop(upload_id, None)
+
+    @staticmethod
+    def status(session):
+        return {
+            "upload_id": session["upload_id"],
+            "kind": session["kind"],
+            "filename": session["filename"],
+            "size": session["size"],
+            "offset": session["received"],
+            "chunk_size": UPLOAD_CHUNK_BYTES,
+            "completed": session["completed"],
+            "sha256": session.get("digest"),
+            "deduplicated": session.get("deduplicated", False),
+        }
+
+    def create(self, kind, teacher_id, filename, size, sha256=None, known=False):
+        """known=True: the blob store already has this content, so the session starts completed"""
+        self.purge_expired()
+        upload_id = uuid.uuid4().hex
+        part_path = None
+        if not known:
+            teacher_dir = os.path.join(UPLOAD_DIR, kind, teacher_id)
+            os.makedirs(teacher_dir, exist_ok=True)
+            part_path = os.path.join(teacher_dir, f"{upload_id}.part")
+            open(part_path, "wb").close()
+        session = {
+            "upload_id": upload_id,
+            "kind": kind,
+            "teacher_id": teacher_id,
+            "filename": os.path.basename(filename),
+            "size": size,
+            "sha256": sha256.lower() if sha256 else None,
+            "received": size if known else 0,
+            "completed": known,
+            "digest": sha256.lower() if known else None,
+            "part_path": part_path,
+            "deduplicated": known,
+            "created": time.time(),
+        }
+        self._save(session)
+        return session
+
+    def _hasher(self, session):
+        upload_id, received = session["upload_id"], session["received"]
+        cached = self._hashers.get(upload_id)
+        if cached and cached[1] == received:
+            return cached[0]
+        # Resumed on another worker or after a restart: rehash what is already on disk
+        return sha256_of_file(session["part_path"], received)
+
+    def write_chunk(self, upload_id, offset, data):
+        with self._session_lock(upload_id):
+            session = self.load(upload_id)
+            if session["completed"]:
+                raise HTTPException(status_code=409, detail="Upload already completed")
+            if offset != session["received"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"error": "Offset does not match bytes received", "offset": session["received"]}
+                )
+            
+            hasher = self._hasher(session)
+            with open(session["part_path"], "r+b") as f:
+                # Drop any tail left by a chunk that died half-way through the write
+                f.truncate(offset)
+                f.seek(offset)
+                f.write(data)
+            hasher.update(data)
+            
+            session["received"] = offset + len(data)
+            self._save(session)
+            self._hashers[upload_id] = (hasher, session["received"])
+            return session
+
+    def complete(self, upload_id):
+        with self._session_lock(upload_id):
+            session = self.load(upload_id)
+            if session["completed"]:
+                return session
+            if session["received"] != session["size"]:
+                raise HTTPException(
+                    status_code=409,
+                    detail={"error": "Upload is incomplete", "offset": session["received"], "size": session["size"]}
+                )
+            digest = self._hasher(session).hexdigest()
+            if session["sha256"] and digest != session["sha256"]:
+                self.abort(upload_id)
+                raise HTTPException(status_code=422, detail=f"SHA-256 mismatch: expected {session['sha256']}, got {digest}")
+            session["digest"] = digest
+            session["completed"] = True
+            self._save(session)
+        self._hashers.pop(upload_id, None)
+        return session
+
+    def claim(self, cursor, upload_id, kind, teacher_id, title):
+        """
+        Hand a completed upload to the record being created: the .part file becomes
+        (or is deduplicated against) its blob, in the caller's transaction.
+        Returns (file_name, file_path, full_file_path, size).
+        """
+        with self._session_lock(upload_id):
+            session = self.load(upload_id)
+            if session["kind"] != kind or session["teacher_id"] != teacher_id:
+                raise HTTPException(status_code=400, detail=f"Upload {upload_id} does not belong to this {kind[:-1]}")
+            if not session["completed"]:
+                raise HTTPException(status_code=409, detail="Upload is not completed yet")
+            
+            file_extension = os.path.splitext(session["filename"])[1]
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            file_name = f"{timestamp}_{title.replace(' ', '_')}{file_extension}"
+            source_path = session["part_path"]
+            if source_path:
+                # Give the part file its real extension so the blob keeps it
+                source_path = os.path.join(os.path.dirname(source_path), f"{upload_id}{file_extension}")
+                os.replace(session["part_path"], source_path)
+            file_path, full_file_path = adopt_blob(cursor, source_path, session["digest"], session["size"])
+            os.remove(self._sidecar(upload_id))
+        self._forget(upload_id)
+        return file_name, file_path, full_file_path, session["size"]
+
+    def abort(self, upload_id):
+        session = self.load(upload_id)
+        for path in (session["part_path"], self._sidecar(upload_id)):
+            try:
+                if path:
+                    os.remove(path)
+            except FileNotFoundError:
+                pass
+        self._forget(upload_id)
+
+    def purge_expired(self):
+        """Drop sessions untouched for UPLOAD_SESSION_TTL_SECONDS (checked at most hourly)"""
+        now = time.time()
+        if now - self._last_purge < 3600:
+            return 0
+        self._last_purge = now
+        purged = 0
+        for name in os.listdir(self.sessions_dir):
+            path = os.path.join(self.sessions_dir, name)
+            if not name.endswith(".json"):
+                continue
+            try:
+                if now - os.path.getmtime(path) > UPLOAD_SESSION_TTL_SECONDS:
+                    self.abort(name[:-5])
+                    purged += 1
+            except (OSError, HTTPException):
+                continue
+        return purged
+
+
+chunked_uploads = ChunkedUploads(UPLOAD_SESSIONS_DIR)
+
+
+class UploadInit(BaseModel):
+    kind: str
+    teacher_id: str
+    filename: str
+    size: int
+    sha256: Optional[str] = None
+
+
+@app.post("/uploads")
+def start_chunked_upload(upload: UploadInit):
+    if upload.kind not in UPLOAD_LIMITS:
+        raise HTTPException(status_code=400, detail=f"kind must be one of {', '.join(UPLOAD_LIMITS)}")
+    if upload.size <= 0:
+        raise HTTPException(status_code=400, detail="size must be positive")
+    if upload.size > UPLOAD_LIMITS[upload.kind]:
+        raise HTTPException(status_code=413, detail=upload_limit_error(upload.kind, upload.size))
+    if upload.sha256 and not re.fullmatch(r"[0-9a-fA-F]{64}", upload.sha256):
+        raise HTTPException(status_code=400, detail="sha256 must be 64 hex characters")
+    
+    db = get_db()
+    try:
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT 1 FROM users WHERE userId = %s AND role = 'teacher'", (upload.teacher_id,))
+        teacher = cursor.fetchone()
+        # Content the blob store already has needs no bytes at all
+        known = bool(upload.sha256) and known_blob(cursor, upload.sha256.lower(), upload.size) is not None
+        cursor.close()
+    finally:
+        db.close()
+    if not teacher:
+        raise HTTPException(status_code=404, detail=f"Teacher not found with user ID: {upload.teacher_id}")
+    
+    session = chunked_uploads.create(upload.kind, upload.teacher_id, upload.filename, upload.size,
+                                     upload.sha256, known=known)
+    return {"success": True, **chunked_uploads.status(session)}
+
+
+@app.get("/uploads/{upload_id}")
+def get_chunked_upload(upload_id: str):
+    """Where to resume: `offset` is the number of bytes already stored"""
+    return {"success": True, **chunked_uploads.status(chunked_uploads.load(upload_id))}
+
+
+@app.put("/uploads/{upload_id}")
+async def put_upload_chunk(upload_id: str, request: Request, offset: int = Query(..., ge=0)):
+    # Everything is checked against Content-Length before a byte of the body is read
+    length = request.headers.get("content-length")
+    if length is None or not length.isdigit():
+        return JSONResponse(status_code=411, content={"success": False, "error": "Content-Length is required"})
+    length = int(length)
+    if length == 0 or length > UPLOAD_CHUNK_BYTES:
+        return JSONResponse(status_code=413, content={
+            "success": False, "error": f"Chunks must be 1..{UPLOAD_CHUNK_BYTES} bytes"
+        })
+    
+    session = await run_in_threadpool(chunked_uploads.load, upload_id)
+    if offset + length > session["size"]:
+        return JSONResponse(status_code=413, content={
+            "success": False, "error": f"Chunk ends past the announced size of {session['size']} bytes"
+        })
+    if offset != session["received"]:
+        return JSONResponse(status_code=409, content={
+            "success": False, "error": "Offset does not match bytes received", "offset": session["received"]
+        })
+    
+    data = bytearray()
+    async for piece in request.stream():
+        data += piece
+        if len(data) > length:
+            return JSONResponse(status_code=413, content={"success": False, "error": "Body exceeds Content-Length"})
+    if len(data) != length:
+        return JSONResponse(status_code=400, content={
+            "success": False, "error": "Chunk was cut short", "offset": session["received"]
+        })
+    
+    session = await run_in_threadpool(chunked_uploads.write_chunk, upload_id, offset, bytes(data))
+    return {"success": True, **chunked_uploads.status(session)}
+
+
+@app.post("/uploads/{upload_id}/complete")
+def complete_chunked_upload(upload_id: str):
+    session = chunked_uploads.complete(upload_id)
+    return {"success": True, **chunked_uploads.status(session)}
+
+
+@app.delete("/uploads/{upload_id}")
+def abort_chunked_upload(upload_id: str):
+    chunked_uploads.abort(upload_id)
+    return {"success": True, "message": "Upload discarded"}
+
+
 # ------------------- LECTURES ENDPOINTS -------------------
 
 @app.post("/lectures")
-async def create_lecture(
+def create_lecture(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
     description: str = Form(""),
-    file: UploadFile = File(None)
+    file: UploadFile = File(None),
+    upload_id: Optional[str] = Form(None),
+    db=Depends(db_session)
 ):
     try:
-        db = get_db()
         cursor = db.cursor(dictionary=True)
         
         # First, get the numeric ID from the users table using userId
@@ -718,10 +2393,10 @@ async def create_lecture(
             file_path = os.path.join("uploads", "lectures", teacher_id, file_name)
             full_file_path = os.path.join(UPLOAD_DIR, "lectures", teacher_id, file_name)
             
-            with open(full_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            file_size = os.path.getsize(full_file_path)
+            file_size, sha256 = store_upload_file(file, full_file_path, "lectures")
+            file_path, full_file_path = adopt_blob(cursor, full_file_path, sha256, file_size)
+        elif upload_id:
+            file_name, file_path, full_file_path, file_size = chunked_uploads.claim(cursor, upload_id, "lectures", teacher_id, title)
         
         # Insert using numeric teacher_id for foreign key
         cursor.execute(
@@ -730,17 +2405,27 @@ async def create_lecture(
             VALUES (%s, %s, %s, %s, %s, %s, %s)""",
             (numeric_teacher_id, subject_name, title, description, file_path, file_name, file_size)
         )
+        lecture_id = cursor.lastrowid
+        bump_teacher_stats(cursor, 'lectures', lecture_id, lectures=1)
+        if file_path and hls_source(file_name):
+            queue_hls_packaging(cursor, lecture_id)
         
         db.commit()
         cursor.close()
-        db.close()
+        
+        if file_path:
+            file_index.put('lecture', lecture_id, full_file_path, lecture_file_locator(lecture_id, teacher_id))
+            hls_packager.wake()
         
         return {
             "message": "Lecture created successfully", 
             "success": True,
+            "lecture_id": lecture_id,
             "teacher_name": teacher['fullName']
         }
         
+    except HTTPException:
+        raise
     except mysql.connector.Error as e:
         if e.errno == 1452:
             raise HTTPException(status_code=400, detail=f"Database constraint error. Please contact administrator.")
@@ -780,20 +2465,25 @@ def delete_lecture(lecture_id: int):
         cursor = db.cursor(dictionary=True)
         
         # Get file path before deleting
-        cursor.execute("SELECT file_path FROM lectures WHERE id = %s", (lecture_id,))
+        cursor.execute("SELECT file_path, teacher_id FROM lectures WHERE id = %s", (lecture_id,))
         lecture = cursor.fetchone()
         
-        # Delete file from filesystem
+        # Drop this lecture's reference to its file; the file goes once the delete has committed
+        released_file = None
         if lecture and lecture['file_path']:
-            full_file_path = os.path.join(os.getcwd(), lecture['file_path'])
-            if os.path.exists(full_file_path):
-                os.remove(full_file_path)
+            released_file = release_blob(cursor, lecture['file_path'])
         
         # Delete from database
         cursor.execute("DELETE FROM lectures WHERE id = %s", (lecture_id,))
         db.commit()
         cursor.close()
         db.close()
+        remove_released_file(released_file)
+        
+        file_index.remove('lecture', lecture_id)
+        shutil.rmtree(os.path.join(HLS_DIR, str(lecture_id)), ignore_errors=True)
+        if lecture:
+            teacher_stats.mark_dirty(lecture['teacher_id'])
         
         return {"message": "Lecture deleted successfully", "success": True}
         
@@ -803,17 +2493,7 @@ def delete_lecture(lecture_id: int):
 @app.post("/lectures/{lecture_id}/download")
 def increment_download_count(lecture_id: int):
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute(
-            "UPDATE lectures SET downloads = downloads + 1 WHERE id = %s",
-            (lecture_id,)
-        )
-        
-        db.commit()
-        cursor.close()
-        db.close()
+        download_counters.add('lectures', lecture_id)
         
         return {"message": "Download count updated", "success": True}
         
@@ -823,14 +2503,15 @@ def increment_download_count(lecture_id: int):
 # ------------------- ASSIGNMENTS ENDPOINTS -------------------
 
 @app.post("/assignments")
-async def create_assignment(
+def create_assignment(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
     description: str = Form(""),
     start_date: str = Form(...),
     due_date: str = Form(...),
-    file: UploadFile = File(None)
+    file: UploadFile = File(None),
+    upload_id: Optional[str] = Form(None)
 ):
     try:
         db = get_db()
@@ -858,8 +2539,10 @@ async def create_assignment(
             file_path = os.path.join("uploads", "assignments", teacher_id, file_name)
             full_file_path = os.path.join(UPLOAD_DIR, "assignments", teacher_id, file_name)
             
-            with open(full_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            file_size, sha256 = store_upload_file(file, full_file_path, "assignments")
+            file_path, _ = adopt_blob(cursor, full_file_path, sha256, file_size)
+        elif upload_id:
+            file_name, file_path, _, _ = chunked_uploads.claim(cursor, upload_id, "assignments", teacher_id, title)
         
         cursor.execute(
             """INSERT INTO assignments 
@@ -867,6 +2550,7 @@ async def create_assignment(
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
             (numeric_teacher_id, subject_name, title, description, file_path, file_name, start_date, due_date)
         )
+        bump_teacher_stats(cursor, 'assignments', cursor.lastrowid, assignments=1)
         
         db.commit()
         cursor.close()
@@ -878,6 +2562,8 @@ async def create_assignment(
             "teacher_name": teacher['fullName']
         }
         
+    except HTTPException:
+        raise
     except mysql.connector.Error as e:
         if e.errno == 1452:
             raise HTTPException(status_code=400, detail=f"Database constraint error. Please contact administrator.")
@@ -917,20 +2603,23 @@ def delete_assignment(assignment_id: int):
         cursor = db.cursor(dictionary=True)
         
         # Get file path before deleting
-        cursor.execute("SELECT file_path FROM assignments WHERE id = %s", (assignment_id,))
+        cursor.execute("SELECT file_path, teacher_id FROM assignments WHERE id = %s", (assignment_id,))
         assignment = cursor.fetchone()
         
-        # Delete file from filesystem
+        # Drop this assignment's reference to its file; the file goes once the delete has committed
+        released_file = None
         if assignment and assignment['file_path']:
-            full_file_path = os.path.join(os.getcwd(), assignment['file_path'])
-            if os.path.exists(full_file_path):
-                os.remove(full_file_path)
+            released_file = release_blob(cursor, assignment['file_path'])
         
         # Delete from database
         cursor.execute("DELETE FROM assignments WHERE id = %s", (assignment_id,))
         db.commit()
         cursor.close()
         db.close()
+        remove_released_file(released_file)
+        
+        if assignment:
+            teacher_stats.mark_dirty(assignment['teacher_id'])
         
         return {"message": "Assignment deleted successfully", "success": True}
         
@@ -939,8 +2628,69 @@ def delete_assignment(assignment_id: int):
 
 # ------------------- NOTIFICATIONS ENDPOINTS -------------------
 
+NOTIFICATION_COUNTS_TTL_SECONDS = float(os.getenv("NOTIFICATION_COUNTS_TTL_SECONDS", "300"))
+
+
+def subject_count_key(subject_name):
+    """
+    Key for per-subject counts that compares like the subject_name columns do
+    (case-insensitive collation, trailing spaces ignored), so a badge counts the
+    same notifications the list JOINs on.
+    """
+    return (subject_name or '').rstrip().lower()
+
+
+class NotificationCountCache:
+    """
+    Notification counts for every subject: {subject_count_key(subject_name): count}.
+    Loaded with one GROUP BY and dropped whenever a notification is created or deleted.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._counts = None
+        self._loaded_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def counts(self, cursor):
+        with self._lock:
+            if self._counts is not None and time.monotonic() - self._loaded_at < self.ttl:
+                return self._counts
+            generation = self._generation
+        
+        cursor.execute("""
+            SELECT subject_name, COUNT(*) AS count
+            FROM notifications
+            GROUP BY subject_name
+        """)
+        counts = {}
+        for row in cursor.fetchall():
+            key = subject_count_key(row['subject_name'])
+            counts[key] = counts.get(key, 0) + row['count']
+        
+        with self._lock:
+            # Don't keep counts that were read while a write invalidated them
+            if generation == self._generation:
+                self._counts = counts
+                self._loaded_at = time.monotonic()
+        return counts
+
+    def for_subjects(self, cursor, subject_names):
+        """{subject_name: count} for the given names, matched like the SQL JOINs match them"""
+        counts = self.counts(cursor)
+        return {subject: counts.get(subject_count_key(subject), 0) for subject in subject_names}
+
+    def invalidate(self):
+        with self._lock:
+            self._generation += 1
+            self._counts = None
+
+
+notification_counts = NotificationCountCache(NOTIFICATION_COUNTS_TTL_SECONDS)
+
 @app.post("/notifications")
-async def create_notification(
+def create_notification(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
@@ -966,10 +2716,13 @@ async def create_notification(
             VALUES (%s, %s, %s, %s, %s)""",
             (numeric_teacher_id, subject_name, title, message, priority)
         )
+        bump_teacher_stats(cursor, 'notifications', cursor.lastrowid, notifications=1)
         
         db.commit()
         cursor.close()
         db.close()
+        notification_counts.invalidate()
+        notification_broker.notify()
         
         return {
             "message": "Notification created successfully", 
@@ -1013,34 +2766,206 @@ def get_notifications(teacher_userId: str, subject_name: str):
 def delete_notification(notification_id: int):
     try:
         db = get_db()
-        cursor = db.cursor()
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute("SELECT teacher_id FROM notifications WHERE id = %s", (notification_id,))
+        notification = cursor.fetchone()
         
         cursor.execute("DELETE FROM notifications WHERE id = %s", (notification_id,))
+        cursor.execute("DELETE FROM notification_reads WHERE notification_id = %s", (notification_id,))
         db.commit()
         cursor.close()
         db.close()
+        notification_counts.invalidate()
+        
+        if notification:
+            teacher_stats.mark_dirty(notification['teacher_id'])
         
         return {"message": "Notification deleted successfully", "success": True}
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error deleting notification: {str(e)}")
 
-# Add this endpoint for students to get notifications
-@app.get("/student/{student_userId}/notifications")
-def get_student_notifications(student_userId: str, subject_name: str = None):
-    """Get notifications for a student, optionally filtered by subject"""
+# ------------------- STUDENT ENROLLMENTS -------------------
+
+# Explicit student -> subject mapping derived from users.current_year, shared by the
+# student-facing endpoints instead of `years.name LIKE %current_year%` lookups.
+# student_enrollment_years records which current_year each mapping was built from
+# (year_id NULL = the year could not be resolved), so stale rows re-sync on read.
+STUDENT_SUBJECT_ENROLLMENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS student_subject_enrollments (
+        student_id INT NOT NULL,
+        subject_name VARCHAR(255) NOT NULL,
+        subject_id INT NOT NULL,
+        year_id INT NOT NULL,
+        enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (student_id, subject_name),
+        KEY idx_enrollments_subject (subject_name, student_id)
+    )
+"""
+
+STUDENT_ENROLLMENT_YEARS_DDL = """
+    CREATE TABLE IF NOT EXISTS student_enrollment_years (
+        student_id INT NOT NULL PRIMARY KEY,
+        current_year VARCHAR(100) NULL,
+        year_id INT NULL,
+        synced_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        KEY idx_enrollment_years_year (year_id)
+    )
+"""
+
+
+def unresolved_year_error(current_year):
+    return (f"Could not match the student's year '{current_year or ''}' to a configured year; "
+            f"update the student's current year to one of the years in /years")
+
+
+def resolve_student_year_ids(cursor, current_year):
+    """years.id rows for a users.current_year value: exact name first, then the predefined year it maps to"""
+    if not current_year or not current_year.strip():
+        return []
+    names = [current_year.strip()]
+    year_index = student_year_index(current_year)
+    if year_index:
+        names.append(predefined_years[year_index - 1]["name"])
+    for name in names:
+        cursor.execute("SELECT id FROM years WHERE name = %s ORDER BY id", (name,))
+        year_ids = [row['id'] for row in cursor.fetchall()]
+        if year_ids:
+            return year_ids
+    return []
+
+
+def sync_student_enrollment(db, user_id):
+    """Rebuild one user's enrollment rows; call before committing the write that changed them. Returns year_id or None"""
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("SELECT current_year, role FROM users WHERE id = %s", (user_id,))
+    user = cursor.fetchone()
+    cursor.execute("DELETE FROM student_subject_enrollments WHERE student_id = %s", (user_id,))
+    
+    if not user or user['role'] != 'student':
+        cursor.execute("DELETE FROM student_enrollment_years WHERE student_id = %s", (user_id,))
+        cursor.close()
+        return None
+    
+    year_ids = resolve_student_year_ids(cursor, user['current_year'])
+    if year_ids:
+        # Duplicate year rows (initialize_data run twice) enroll each subject name once
+        placeholders = ', '.join(['%s'] * len(year_ids))
+        cursor.execute(f"""
+            INSERT IGNORE INTO student_subject_enrollments (student_id, subject_name, subject_id, year_id)
+            SELECT %s, subject_name, id, year_id
+            FROM subjects
+            WHERE year_id IN ({placeholders})
+            ORDER BY id
+        """, [user_id, *year_ids])
+    
+    year_id = year_ids[0] if year_ids else None
+    cursor.execute("""
+        INSERT INTO student_enrollment_years (student_id, current_year, year_id)
+        VALUES (%s, %s, %s)
+        ON DUPLICATE KEY UPDATE current_year = VALUES(current_year), year_id = VALUES(year_id)
+    """, (user_id, user['current_year'], year_id))
+    cursor.close()
+    
+    if year_id is None:
+        logger.warning("Student %s has unresolvable year %r; no subjects enrolled", user_id, user['current_year'])
+    return year_id
+
+
+def update_student_enrollment(db, user_id):
+    """sync_student_enrollment for write paths: a sync failure leaves the mapping stale, and it re-syncs on read"""
     try:
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        
-        print(f"DEBUG: Getting notifications for student {student_userId}, subject: {subject_name}")
-        
-        # Get student's current year
-        cursor.execute("""
-            SELECT id, current_year 
-            FROM users 
-            WHERE userId = %s AND role = 'student'
-        """, (student_userId,))
+        sync_student_enrollment(db, user_id)
+    except Exception as e:
+        logger.warning("Could not sync enrollment for user %s: %s", user_id, e)
+
+
+def invalidate_enrollments(cursor, unresolved_only=False, year_id=None):
+    """
+    Years or subjects changed: drop the sync markers so affected students re-sync on
+    their next read. With `year_id` only students enrolled in that year (or in a
+    duplicate year row of the same name, which they enroll in too) are dropped.
+    """
+    try:
+        if unresolved_only:
+            cursor.execute("DELETE FROM student_enrollment_years WHERE year_id IS NULL")
+        elif year_id is not None:
+            cursor.execute("""
+                DELETE sey FROM student_enrollment_years sey
+                JOIN years y ON sey.year_id = y.id
+                JOIN years changed ON changed.name = y.name
+                WHERE changed.id = %s
+            """, (year_id,))
+        else:
+            cursor.execute("DELETE FROM student_enrollment_years")
+    except Exception as e:
+        logger.warning("Could not invalidate enrollments: %s", e)
+
+
+def student_enrollment(db, student_id, current_year):
+    """(year_id, subject names) for a student, syncing first when the mapping is missing or stale"""
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("SELECT current_year, year_id FROM student_enrollment_years WHERE student_id = %s", (student_id,))
+    marker = cursor.fetchone()
+    
+    if not marker or marker['current_year'] != current_year:
+        year_id = sync_student_enrollment(db, student_id)
+        db.commit()
+    else:
+        year_id = marker['year_id']
+    
+    subject_names = []
+    if year_id is not None:
+        cursor.execute("""
+            SELECT subject_name FROM student_subject_enrollments
+            WHERE student_id = %s
+            ORDER BY subject_id
+        """, (student_id,))
+        subject_names = [row['subject_name'] for row in cursor.fetchall()]
+    cursor.close()
+    return year_id, subject_names
+
+
+@app.post("/admin/enrollments/rebuild")
+def rebuild_enrollments():
+    """Re-derive every student's subject enrollment and list the students whose year did not resolve"""
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute("SELECT id, userId, current_year FROM users WHERE role = 'student'")
+        students = cursor.fetchall()
+        
+        unresolved = []
+        for student in students:
+            if sync_student_enrollment(db, student['id']) is None:
+                unresolved.append({"userId": student['userId'], "current_year": student['current_year']})
+            db.commit()
+        
+        cursor.close()
+        db.close()
+        
+        return {"success": True, "rebuilt": len(students), "unresolved": unresolved}
+        
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# Add this endpoint for students to get notifications
+@app.get("/student/{student_userId}/notifications")
+def get_student_notifications(student_userId: str, subject_name: str = None):
+    """Get notifications for a student, optionally filtered by subject"""
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        # Get student's current year
+        cursor.execute("""
+            SELECT id, current_year 
+            FROM users 
+            WHERE userId = %s AND role = 'student'
+        """, (student_userId,))
         
         student = cursor.fetchone()
         
@@ -1059,27 +2984,29 @@ def get_student_notifications(student_userId: str, subject_name: str = None):
         if subject_name:
             # Get notifications for specific subject
             query = """
-                SELECT n.*, u.fullName as teacher_name, u.userId as teacher_userId
+                SELECT n.*, u.fullName as teacher_name, u.userId as teacher_userId,
+                       (r.notification_id IS NOT NULL) as is_read
                 FROM notifications n
                 JOIN users u ON n.teacher_id = u.id
+                LEFT JOIN notification_reads r ON r.notification_id = n.id AND r.student_id = %s
                 WHERE n.subject_name = %s
                 ORDER BY n.created_date DESC
             """
-            cursor.execute(query, (subject_name,))
+            cursor.execute(query, (student_id, subject_name))
         else:
-            # Get notifications for all subjects in student's year
-            # First, get all subjects for student's year
-            cursor.execute("""
-                SELECT subject_name 
-                FROM subjects 
-                WHERE year_id IN (
-                    SELECT id FROM years WHERE name LIKE %s
-                )
-            """, (f"%{current_year}%",))
+            # Get notifications for all subjects the student is enrolled in
+            year_id, subject_names = student_enrollment(db, student_id, current_year)
             
-            subjects = cursor.fetchall()
+            if year_id is None:
+                cursor.close()
+                db.close()
+                return {
+                    "success": False,
+                    "error": unresolved_year_error(current_year),
+                    "student_year": current_year
+                }
             
-            if not subjects:
+            if not subject_names:
                 cursor.close()
                 db.close()
                 return {
@@ -1088,18 +3015,17 @@ def get_student_notifications(student_userId: str, subject_name: str = None):
                     "message": "No subjects found for your year"
                 }
             
-            subject_names = [subject['subject_name'] for subject in subjects]
-            
-            # Get notifications for all these subjects
-            placeholders = ', '.join(['%s'] * len(subject_names))
-            query = f"""
-                SELECT n.*, u.fullName as teacher_name, u.userId as teacher_userId
-                FROM notifications n
+            query = """
+                SELECT n.*, u.fullName as teacher_name, u.userId as teacher_userId,
+                       (r.notification_id IS NOT NULL) as is_read
+                FROM student_subject_enrollments e
+                JOIN notifications n ON n.subject_name = e.subject_name
                 JOIN users u ON n.teacher_id = u.id
-                WHERE n.subject_name IN ({placeholders})
+                LEFT JOIN notification_reads r ON r.notification_id = n.id AND r.student_id = e.student_id
+                WHERE e.student_id = %s
                 ORDER BY n.created_date DESC
             """
-            cursor.execute(query, subject_names)
+            cursor.execute(query, (student_id,))
         
         notifications = cursor.fetchall()
         
@@ -1110,13 +3036,12 @@ def get_student_notifications(student_userId: str, subject_name: str = None):
             "success": True,
             "notifications": notifications,
             "total_notifications": len(notifications),
+            "unread_notifications": sum(1 for n in notifications if not n['is_read']),
             "student_year": current_year
         }
         
     except Exception as e:
-        print(f"Error in get_student_notifications: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_student_notifications for %s", student_userId)
         return {
             "success": False,
             "error": f"Error fetching notifications: {str(e)}"
@@ -1149,18 +3074,18 @@ def get_student_notifications_count(student_userId: str):
         
         current_year = student['current_year']
         
-        # Get all subjects for student's year
-        cursor.execute("""
-            SELECT subject_name 
-            FROM subjects 
-            WHERE year_id IN (
-                SELECT id FROM years WHERE name LIKE %s
-            )
-        """, (f"%{current_year}%",))
+        # Get all subjects the student is enrolled in
+        year_id, subject_names = student_enrollment(db, student['id'], current_year)
         
-        subjects = cursor.fetchall()
+        if year_id is None:
+            cursor.close()
+            db.close()
+            return {
+                "success": False,
+                "error": unresolved_year_error(current_year)
+            }
         
-        if not subjects:
+        if not subject_names:
             cursor.close()
             db.close()
             return {
@@ -1169,22 +3094,9 @@ def get_student_notifications_count(student_userId: str):
                 "subject_counts": {}
             }
         
-        subject_names = [subject['subject_name'] for subject in subjects]
-        
         # Get count of notifications for each subject
-        notifications_by_subject = {}
-        total_count = 0
-        
-        for subject in subject_names:
-            cursor.execute("""
-                SELECT COUNT(*) as count 
-                FROM notifications 
-                WHERE subject_name = %s
-            """, (subject,))
-            
-            count_result = cursor.fetchone()
-            notifications_by_subject[subject] = count_result['count']
-            total_count += count_result['count']
+        notifications_by_subject = notification_counts.for_subjects(cursor, subject_names)
+        total_count = sum(notifications_by_subject.values())
         
         cursor.close()
         db.close()
@@ -1196,16 +3108,349 @@ def get_student_notifications_count(student_userId: str):
         }
         
     except Exception as e:
-        print(f"Error in get_student_notifications_count: {str(e)}")
+        logger.exception("Error in get_student_notifications_count for %s", student_userId)
         return {
             "success": False,
             "error": f"Error counting notifications: {str(e)}"
         }
 
+# ------------------- NOTIFICATION READS & PUSH -------------------
+
+NOTIFICATION_READS_DDL = """
+    CREATE TABLE IF NOT EXISTS notification_reads (
+        student_id INT NOT NULL,
+        notification_id INT NOT NULL,
+        read_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (student_id, notification_id),
+        KEY idx_notification_reads_notification (notification_id)
+    )
+"""
+
+NOTIFICATION_STREAM_POLL_SECONDS = float(os.getenv("NOTIFICATION_STREAM_POLL_SECONDS", "5"))
+NOTIFICATION_STREAM_QUEUE_SIZE = int(os.getenv("NOTIFICATION_STREAM_QUEUE_SIZE", "100"))
+NOTIFICATION_STREAM_KEEPALIVE_SECONDS = 15
+# AUTO_INCREMENT ids are handed out before commit, so a notification can become visible
+# after one with a higher id; each poll re-reads this many ids below the highest seen.
+NOTIFICATION_STREAM_RESCAN_IDS = int(os.getenv("NOTIFICATION_STREAM_RESCAN_IDS", "200"))
+
+
+class NotificationBroker:
+    """
+    Fans new notifications out to open SSE streams.
+
+    One tail thread per worker reads notifications newer than the last id it
+    published (woken at once by local creates, polled for creates made on other
+    workers) and hands each batch to the event loop in a single callback. The loop
+    then puts every notification on the bounded queue of each stream subscribed to
+    its subject (matched by subject_count_key, like the list JOIN), so an open connection costs one queue and no thread or DB query.
+
+    Ids are not commit-ordered, so each poll re-reads NOTIFICATION_STREAM_RESCAN_IDS
+    ids below the highest one seen and publishes only ids it hasn't published yet.
+    """
+
+    def __init__(self, poll_seconds, queue_size):
+        self.poll_seconds = poll_seconds
+        self.queue_size = queue_size
+        self._subscribers = {}      # subject_count_key -> set of stream queues (event loop only)
+        self._loop = None
+        self._last_id = None
+        self._seen = set()          # published ids inside the rescan window
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.dropped = 0            # events discarded because a client fell behind
+
+    def subscribe(self, subject_names):
+        inbox = asyncio.Queue(maxsize=self.queue_size)
+        for subject_name in subject_names:
+            self._subscribers.setdefault(subject_count_key(subject_name), set()).add(inbox)
+        return inbox
+
+    def unsubscribe(self, inbox, subject_names):
+        for subject_name in subject_names:
+            key = subject_count_key(subject_name)
+            streams = self._subscribers.get(key)
+            if streams:
+                streams.discard(inbox)
+                if not streams:
+                    del self._subscribers[key]
+
+    def notify(self):
+        """A notification was committed on this worker: publish without waiting for the poll"""
+        self._wake.set()
+
+    def stats(self):
+        return {
+            "subjects": len(self._subscribers),
+            "streams": len({inbox for streams in self._subscribers.values() for inbox in streams}),
+            "last_id": self._last_id,
+            "dropped": self.dropped,
+        }
+
+    def _fan_out(self, notifications):
+        for notification in notifications:
+            payload = json.dumps(jsonable_encoder(notification))
+            for inbox in self._subscribers.get(subject_count_key(notification['subject_name']), ()):
+                if inbox.full():
+                    # Slow client: drop its oldest event rather than block everyone else
+                    inbox.get_nowait()
+                    self.dropped += 1
+                inbox.put_nowait(payload)
+
+    def _fetch_new(self):
+        db = get_db()
+        try:
+            cursor = db.cursor(dictionary=True)
+            if self._last_id is None:
+                # Start from now: what already exists counts as published
+                cursor.execute("SELECT COALESCE(MAX(id), 0) AS last_id FROM notifications")
+                self._last_id = cursor.fetchone()['last_id']
+                cursor.execute("SELECT id FROM notifications WHERE id > %s",
+                               (self._last_id - NOTIFICATION_STREAM_RESCAN_IDS,))
+                self._seen = {row['id'] for row in cursor.fetchall()}
+                cursor.close()
+                return []
+            cursor.execute("""
+                SELECT n.id, n.subject_name, n.title, n.message, n.priority, n.created_date,
+                       u.fullName AS teacher_name, u.userId AS teacher_userId
+                FROM notifications n
+                JOIN users u ON n.teacher_id = u.id
+                WHERE n.id > %s
+                ORDER BY n.id
+            """, (max(self._last_id - NOTIFICATION_STREAM_RESCAN_IDS, 0),))
+            notifications = [n for n in cursor.fetchall() if n['id'] not in self._seen]
+            cursor.close()
+        finally:
+            db.close()
+        if notifications:
+            self._seen.update(n['id'] for n in notifications)
+            self._last_id = max(self._last_id, notifications[-1]['id'])
+            floor = self._last_id - NOTIFICATION_STREAM_RESCAN_IDS
+            self._seen = {notification_id for notification_id in self._seen if notification_id > floor}
+        return notifications
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                notifications = self._fetch_new()
+                if notifications and self._subscribers:
+                    self._loop.call_soon_threadsafe(self._fan_out, notifications)
+            except Exception as e:
+                logger.warning("Notification stream poll failed: %s", e)
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self, loop):
+        if self._thread is None:
+            self._loop = loop
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="notification-broker", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+notification_broker = NotificationBroker(NOTIFICATION_STREAM_POLL_SECONDS, NOTIFICATION_STREAM_QUEUE_SIZE)
+
+
+@app.on_event("startup")
+async def start_notification_broker():
+    notification_broker.start(asyncio.get_running_loop())
+
+
+@app.on_event("shutdown")
+def stop_notification_broker():
+    notification_broker.stop()
+
+
+def _student_subjects(cursor, db, student_userId):
+    """(student row, enrolled subject names) or (None, error dict)"""
+    cursor.execute("""
+        SELECT id, current_year 
+        FROM users 
+        WHERE userId = %s AND role = 'student'
+    """, (student_userId,))
+    student = cursor.fetchone()
+    if not student:
+        return None, {"success": False, "error": "Student not found"}
+    
+    year_id, subject_names = student_enrollment(db, student['id'], student['current_year'])
+    if year_id is None:
+        return None, {"success": False, "error": unresolved_year_error(student['current_year'])}
+    return student, subject_names
+
+
+@app.get("/student/{student_userId}/notifications/unread-count")
+def get_student_unread_notifications_count(student_userId: str):
+    """Unread notifications per subject: cached subject totals minus this student's reads"""
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        student, subject_names = _student_subjects(cursor, db, student_userId)
+        if student is None:
+            cursor.close()
+            db.close()
+            return subject_names
+        
+        totals = notification_counts.for_subjects(cursor, subject_names)
+        cursor.execute("""
+            SELECT n.subject_name, COUNT(*) AS count
+            FROM notification_reads r
+            JOIN notifications n ON n.id = r.notification_id
+            WHERE r.student_id = %s
+            GROUP BY n.subject_name
+        """, (student['id'],))
+        read_counts = {}
+        for row in cursor.fetchall():
+            key = subject_count_key(row['subject_name'])
+            read_counts[key] = read_counts.get(key, 0) + row['count']
+        
+        cursor.close()
+        db.close()
+        
+        unread_by_subject = {
+            subject: max(totals[subject] - read_counts.get(subject_count_key(subject), 0), 0)
+            for subject in subject_names
+        }
+        
+        return {
+            "success": True,
+            "unread_count": sum(unread_by_subject.values()),
+            "subject_counts": unread_by_subject
+        }
+        
+    except Exception as e:
+        logger.exception("Error in get_student_unread_notifications_count for %s", student_userId)
+        return {"success": False, "error": f"Error counting unread notifications: {str(e)}"}
+
+
+@app.post("/student/{student_userId}/notifications/{notification_id}/read")
+def mark_notification_read(student_userId: str, notification_id: int):
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute("SELECT id FROM users WHERE userId = %s AND role = 'student'", (student_userId,))
+        student = cursor.fetchone()
+        if not student:
+            cursor.close()
+            db.close()
+            return {"success": False, "error": "Student not found"}
+        
+        cursor.execute("""
+            INSERT IGNORE INTO notification_reads (student_id, notification_id)
+            SELECT %s, id FROM notifications WHERE id = %s
+        """, (student['id'], notification_id))
+        marked = cursor.rowcount
+        
+        if not marked:
+            cursor.execute("SELECT id FROM notifications WHERE id = %s", (notification_id,))
+            if not cursor.fetchone():
+                cursor.close()
+                db.close()
+                return {"success": False, "error": "Notification not found"}
+        
+        db.commit()
+        cursor.close()
+        db.close()
+        
+        return {"success": True, "notification_id": notification_id, "newly_read": bool(marked)}
+        
+    except Exception as e:
+        return {"success": False, "error": f"Error marking notification read: {str(e)}"}
+
+
+@app.post("/student/{student_userId}/notifications/read-all")
+def mark_all_notifications_read(student_userId: str, subject_name: str = None):
+    """Mark every notification in the student's subjects (or one subject) as read"""
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        student, subject_names = _student_subjects(cursor, db, student_userId)
+        if student is None:
+            cursor.close()
+            db.close()
+            return subject_names
+        
+        query = """
+            INSERT IGNORE INTO notification_reads (student_id, notification_id)
+            SELECT e.student_id, n.id
+            FROM student_subject_enrollments e
+            JOIN notifications n ON n.subject_name = e.subject_name
+            WHERE e.student_id = %s
+        """
+        params = [student['id']]
+        if subject_name:
+            query += " AND e.subject_name = %s"
+            params.append(subject_name)
+        
+        cursor.execute(query, params)
+        marked = cursor.rowcount
+        db.commit()
+        cursor.close()
+        db.close()
+        
+        return {"success": True, "marked_read": marked}
+        
+    except Exception as e:
+        return {"success": False, "error": f"Error marking notifications read: {str(e)}"}
+
+
+@app.get("/student/{student_userId}/notifications/stream")
+async def stream_student_notifications(student_userId: str, request: Request):
+    """Server-Sent Events: one `notification` event per new notification in the student's subjects"""
+    def lookup():
+        db = get_db()
+        try:
+            cursor = db.cursor(dictionary=True)
+            result = _student_subjects(cursor, db, student_userId)
+            cursor.close()
+            return result
+        finally:
+            db.close()
+    
+    student, subject_names = await run_in_threadpool(lookup)
+    if student is None:
+        return JSONResponse(status_code=404, content=subject_names)
+    
+    inbox = notification_broker.subscribe(subject_names)
+    
+    async def events():
+        try:
+            yield f"retry: {int(NOTIFICATION_STREAM_POLL_SECONDS * 1000)}\n\n"
+            while True:
+                try:
+                    payload = await asyncio.wait_for(inbox.get(), NOTIFICATION_STREAM_KEEPALIVE_SECONDS)
+                    yield f"event: notification\ndata: {payload}\n\n"
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keepalive\n\n"
+        finally:
+            notification_broker.unsubscribe(inbox, subject_names)
+    
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.get("/admin/notification-streams")
+async def get_notification_stream_status():
+    """Open SSE streams on this worker and the broker's position in the notifications table"""
+    return {"success": True, "broker": notification_broker.stats()}
+
+
 # ------------------- QUIZZES ENDPOINTS -------------------
 
 @app.post("/quizzes")
-async def create_quiz(
+def create_quiz(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
@@ -1235,6 +3480,7 @@ async def create_quiz(
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)""",
             (numeric_teacher_id, subject_name, title, description, start_date, end_date, total_marks, questions_count, duration_minutes)
         )
+        bump_teacher_stats(cursor, 'quizzes', cursor.lastrowid, quizzes=1)
         
         db.commit()
         cursor.close()
@@ -1305,13 +3551,20 @@ def get_quiz(quiz_id: int):
 def delete_quiz(quiz_id: int):
     try:
         db = get_db()
-        cursor = db.cursor()
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute("SELECT teacher_id FROM quizzes WHERE id = %s", (quiz_id,))
+        quiz = cursor.fetchone()
         
         cursor.execute("DELETE FROM quizzes WHERE id = %s", (quiz_id,))
         db.commit()
         cursor.close()
         db.close()
         
+        answer_key_cache.invalidate(quiz_id)
+        if quiz:
+            teacher_stats.mark_dirty(quiz['teacher_id'])
+        
         return {"message": "Quiz deleted successfully", "success": True}
         
     except Exception as e:
@@ -1320,7 +3573,7 @@ def delete_quiz(quiz_id: int):
 # ------------------- FILE DOWNLOAD ENDPOINT -------------------
 
 @app.get("/download/{file_type}/{teacher_id}/{filename}")
-async def download_file(file_type: str, teacher_id: str, filename: str):
+def download_file(file_type: str, teacher_id: str, filename: str, request: Request):
     """
     Download files securely
     file_type: lectures, assignments
@@ -1332,148 +3585,812 @@ async def download_file(file_type: str, teacher_id: str, filename: str):
         
         file_path = os.path.join(UPLOAD_DIR, file_type, teacher_id, filename)
         
+        if not os.path.exists(file_path) and file_type in BLOB_TABLES:
+            # Deduplicated uploads live in the blob store under their content hash
+            db = get_db()
+            cursor = db.cursor(dictionary=True)
+            cursor.execute(
+                f"""SELECT t.file_path FROM {file_type} t JOIN users u ON t.teacher_id = u.id
+                    WHERE u.userId = %s AND t.file_name = %s LIMIT 1""",
+                (teacher_id, filename)
+            )
+            row = cursor.fetchone()
+            cursor.close()
+            db.close()
+            if row and row['file_path']:
+                file_path = row['file_path']
+        
         if not os.path.exists(file_path):
             raise HTTPException(status_code=404, detail="File not found")
         
         # Return file for download
-        return FileResponse(
-            path=file_path,
-            filename=filename,
-            media_type='application/octet-stream'
+        return range_file_response(
+            request, file_path, 'application/octet-stream', filename, 'attachment',
+            cache_control=FILE_CACHE_POLICIES.get(file_type.rstrip('s'))
         )
         
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error downloading file: {str(e)}")
 
-# ------------------- STATISTICS ENDPOINTS -------------------
+# ------------------- COUNTER COLUMNS -------------------
 
-@app.get("/teacher/{teacher_id}/stats")
-def get_teacher_stats(teacher_id: str):
-    try:
+# Denormalized counters are kept with a delta in the writer's transaction
+# (bump_counter) and recomputed from their source tables by a periodic
+# reconciler, instead of a COUNT(*) subquery on every write.
+COUNTER_RECONCILE_SECONDS = float(os.getenv("COUNTER_RECONCILE_SECONDS", "3600"))
+
+COUNTER_SOURCES = {
+    ("assignments", "submissions"):
+        "SELECT assignment_id AS id, COUNT(*) AS total FROM assignment_submissions GROUP BY assignment_id",
+    ("quizzes", "attempts"):
+        "SELECT quiz_id AS id, COUNT(*) AS total FROM student_attempts GROUP BY quiz_id",
+}
+
+# Downloads aren't logged per event, so there is nothing to recount: the reconciler
+# only repairs NULLs
+UNSOURCED_COUNTERS = [("lectures", "downloads"), ("materials", "downloads")]
+
+
+def bump_counter(cursor, table, column, row_id, delta):
+    """Add `delta` to table.column for one row, in the caller's transaction (never below 0)"""
+    assert (table, column) in COUNTER_SOURCES or (table, column) in UNSOURCED_COUNTERS
+    cursor.execute(
+        f"UPDATE {table} SET {column} = GREATEST(CAST(COALESCE({column}, 0) AS SIGNED) + %s, 0) WHERE id = %s",
+        (delta, row_id)
+    )
+
+
+class CounterReconciler:
+    """Background thread that recomputes the counter columns every COUNTER_RECONCILE_SECONDS"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None        # {"at", "drifted": {"table.column": rows}, "seconds"}
+
+    def reconcile(self):
+        """Repair every counter that differs from its source; returns rows changed per counter"""
+        started = time.monotonic()
+        drifted = {}
         db = get_db()
-        cursor = db.cursor(dictionary=True)
-        
-        # Get counts for different content types
-        cursor.execute("SELECT COUNT(*) as lecture_count FROM lectures WHERE teacher_id = %s", (teacher_id,))
-        lecture_count = cursor.fetchone()['lecture_count']
-        
-        cursor.execute("SELECT COUNT(*) as assignment_count FROM assignments WHERE teacher_id = %s", (teacher_id,))
-        assignment_count = cursor.fetchone()['assignment_count']
-        
-        cursor.execute("SELECT COUNT(*) as quiz_count FROM quizzes WHERE teacher_id = %s", (teacher_id,))
-        quiz_count = cursor.fetchone()['quiz_count']
-        
-        cursor.execute("SELECT COUNT(*) as notification_count FROM notifications WHERE teacher_id = %s", (teacher_id,))
-        notification_count = cursor.fetchone()['notification_count']
-        
-        # Get total downloads
-        cursor.execute("SELECT SUM(downloads) as total_downloads FROM lectures WHERE teacher_id = %s", (teacher_id,))
-        total_downloads = cursor.fetchone()['total_downloads'] or 0
-        
-        cursor.close()
-        db.close()
+        try:
+            cursor = db.cursor()
+            for (table, column), source in COUNTER_SOURCES.items():
+                cursor.execute(f"""
+                    UPDATE {table} t
+                    LEFT JOIN ({source}) c ON c.id = t.id
+                    SET t.{column} = COALESCE(c.total, 0)
+                    WHERE NOT (t.{column} <=> COALESCE(c.total, 0))
+                """)
+                drifted[f"{table}.{column}"] = cursor.rowcount
+            for table, column in UNSOURCED_COUNTERS:
+                cursor.execute(f"UPDATE {table} SET {column} = 0 WHERE {column} IS NULL")
+                drifted[f"{table}.{column}"] = cursor.rowcount
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
         
-        return {
-            "stats": {
-                "lecture_count": lecture_count,
-                "assignment_count": assignment_count,
-                "quiz_count": quiz_count,
-                "notification_count": notification_count,
-                "total_downloads": total_downloads
-            },
-            "success": True
+        self.last_run = {
+            "at": datetime.now().isoformat(),
+            "drifted": drifted,
+            "seconds": round(time.monotonic() - started, 3),
         }
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching teacher stats: {str(e)}")
+        if any(drifted.values()):
+            logger.info("Counter reconciliation repaired %s", {k: v for k, v in drifted.items() if v})
+            # The teacher stats are built from these counters
+            teacher_stats.mark_dirty(None)
+        return drifted
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning("Counter reconciliation failed: %s", e)
 
-# ------------------- GENERAL GET ENDPOINTS -------------------
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="counter-reconciler", daemon=True)
+            self._thread.start()
 
-@app.get("/lectures")
-def get_all_lectures():
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+counter_reconciler = CounterReconciler(COUNTER_RECONCILE_SECONDS)
+
+
+@app.on_event("startup")
+def start_counter_reconciler():
+    counter_reconciler.start()
+
+
+@app.on_event("shutdown")
+def stop_counter_reconciler():
+    counter_reconciler.stop()
+
+
+@app.post("/admin/counters/reconcile")
+def reconcile_counters():
     try:
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        
-        cursor.execute(
-            """SELECT l.*, u.userId as teacher_userId, u.fullName as teacher_name
-               FROM lectures l 
-               JOIN users u ON l.teacher_id = u.id 
-               ORDER BY l.upload_date DESC"""
-        )
+        return {"success": True, "drifted": counter_reconciler.reconcile(), "last_run": counter_reconciler.last_run}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
+# ------------------- DOWNLOAD COUNTERS -------------------
+
+# Download clicks are aggregated in memory and written behind in one batched
+# UPDATE per table, so a whole class downloading the same lecture doesn't
+# queue up on a single row lock. Counts in the DB are at most
+# DOWNLOAD_FLUSH_SECONDS behind.
+DOWNLOAD_FLUSH_SECONDS = float(os.getenv("DOWNLOAD_FLUSH_SECONDS", "2"))
+DOWNLOAD_FLUSH_EVENTS = int(os.getenv("DOWNLOAD_FLUSH_EVENTS", "500"))
+
+# table with a `downloads` column -> teacher_subject_stats column it also feeds
+DOWNLOAD_COUNTERS = {"lectures": "lecture_downloads", "materials": "material_downloads"}
+
+
+class DownloadCounterBuffer:
+    """Write-behind buffer for lectures/materials download counts"""
+
+    def __init__(self, flush_seconds, flush_events):
+        self.flush_seconds = flush_seconds
+        self.flush_events = flush_events
+        self._pending = {table: {} for table in DOWNLOAD_COUNTERS}     # table -> {row id: count}
+        self._pending_events = 0
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.flushed = {"flushes": 0, "events": 0, "last_flush": None}
+
+    def add(self, table, row_id, count=1):
+        with self._lock:
+            counts = self._pending[table]
+            counts[row_id] = counts.get(row_id, 0) + count
+            self._pending_events += count
+            full = self._pending_events >= self.flush_events
+        if full:
+            self._wake.set()
+
+    def pending_totals(self):
+        """Downloads per table not yet written to the DB"""
+        with self._lock:
+            return {table: sum(counts.values()) for table, counts in self._pending.items()}
+
+    def _restore(self, batch):
+        with self._lock:
+            for table, counts in batch.items():
+                for row_id, count in counts.items():
+                    self._pending[table][row_id] = self._pending[table].get(row_id, 0) + count
+                    self._pending_events += count
+
+    def flush(self):
+        """Write everything buffered so far; returns the number of download events written"""
+        with self._flush_lock:
+            with self._lock:
+                batch, events = self._pending, self._pending_events
+                self._pending = {table: {} for table in DOWNLOAD_COUNTERS}
+                self._pending_events = 0
+            if not events:
+                return 0
+            
+            try:
+                db = get_db()
+                try:
+                    cursor = db.cursor()
+                    for table, counts in batch.items():
+                        if not counts:
+                            continue
+                        ids = sorted(counts)    # stable lock order across workers
+                        cases = " ".join(["WHEN %s THEN %s"] * len(ids))
+                        params = [value for row_id in ids for value in (row_id, counts[row_id])]
+                        cursor.execute(f"""
+                            UPDATE {table}
+                            SET downloads = COALESCE(downloads, 0) + CASE id {cases} ELSE 0 END
+                            WHERE id IN ({', '.join(['%s'] * len(ids))})
+                        """, params + ids)
+                        bump_teacher_stats_many(cursor, table, DOWNLOAD_COUNTERS[table], counts)
+                    db.commit()
+                    cursor.close()
+                finally:
+                    db.close()
+            except Exception:
+                self._restore(batch)
+                raise
+            
+            self.flushed["flushes"] += 1
+            self.flushed["events"] += events
+            self.flushed["last_flush"] = datetime.now().isoformat()
+            return events
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning("Download counter flush failed (will retry): %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="download-counters", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+download_counters = DownloadCounterBuffer(DOWNLOAD_FLUSH_SECONDS, DOWNLOAD_FLUSH_EVENTS)
+
+
+@app.on_event("startup")
+def start_download_counters():
+    download_counters.start()
+
+
+@app.on_event("shutdown")
+def flush_download_counters():
+    download_counters.stop()
+    try:
+        download_counters.flush()
+    except Exception as e:
+        logger.error("Download counts lost on shutdown: %s", e)
+
+
+@app.get("/admin/download-counters")
+def get_download_counter_status():
+    return {"success": True, "pending": download_counters.pending_totals(), **download_counters.flushed}
+
+
+# ------------------- TEACHER STATS -------------------
+
+# Counters per (teacher, subject). Hot writes (uploads, submissions, grading, quiz
+# attempts, downloads) apply deltas with one upsert; deletes and publish toggles, which
+# cascade, mark the teacher dirty and the reconciler rebuilds that teacher's rows.
+# The reconciler also does a full pass every TEACHER_STATS_RECONCILE_SECONDS to repair drift.
+TEACHER_STATS_RECONCILE_SECONDS = float(os.getenv("TEACHER_STATS_RECONCILE_SECONDS", "900"))
+
+TEACHER_SUBJECT_STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS teacher_subject_stats (
+        teacher_id INT NOT NULL,
+        subject_name VARCHAR(255) NOT NULL,
+        lectures INT NOT NULL DEFAULT 0,
+        lecture_downloads INT NOT NULL DEFAULT 0,
+        lecture_views INT NOT NULL DEFAULT 0,
+        assignments INT NOT NULL DEFAULT 0,
+        submissions INT NOT NULL DEFAULT 0,
+        pending_grading INT NOT NULL DEFAULT 0,
+        quizzes INT NOT NULL DEFAULT 0,
+        quizzes_published INT NOT NULL DEFAULT 0,
+        quiz_attempts INT NOT NULL DEFAULT 0,
+        quiz_score_sum DOUBLE NOT NULL DEFAULT 0,
+        quiz_score_count INT NOT NULL DEFAULT 0,
+        materials INT NOT NULL DEFAULT 0,
+        material_downloads INT NOT NULL DEFAULT 0,
+        notifications INT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+        PRIMARY KEY (teacher_id, subject_name)
+    )
+"""
+
+TEACHER_STAT_COLUMNS = (
+    "lectures", "lecture_downloads", "lecture_views",
+    "assignments", "submissions", "pending_grading",
+    "quizzes", "quizzes_published", "quiz_attempts", "quiz_score_sum", "quiz_score_count",
+    "materials", "material_downloads", "notifications",
+)
+
+# Source queries for a rebuild; `t` is the table carrying teacher_id and subject_name
+TEACHER_STATS_SOURCES = (
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS lectures,
+              COALESCE(SUM(t.downloads), 0) AS lecture_downloads,
+              COALESCE(SUM(t.views), 0) AS lecture_views
+       FROM lectures t {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS assignments
+       FROM assignments t {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS submissions,
+              COALESCE(SUM(s.marks_obtained IS NULL), 0) AS pending_grading
+       FROM assignment_submissions s JOIN assignments t ON s.assignment_id = t.id
+       {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS quizzes,
+              COALESCE(SUM(t.is_published = 1), 0) AS quizzes_published,
+              COALESCE(SUM(t.attempts), 0) AS quiz_attempts,
+              COALESCE(SUM(t.average_score), 0) AS quiz_score_sum,
+              COUNT(t.average_score) AS quiz_score_count
+       FROM quizzes t {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS materials,
+              COALESCE(SUM(t.downloads), 0) AS material_downloads
+       FROM materials t {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+    """SELECT t.teacher_id, COALESCE(t.subject_name, '') AS subject_name,
+              COUNT(*) AS notifications
+       FROM notifications t {where} GROUP BY t.teacher_id, COALESCE(t.subject_name, '')""",
+)
+
+
+def _stat_value(column, value):
+    return float(value or 0) if column == "quiz_score_sum" else int(value or 0)
+
+
+def bump_teacher_stats(cursor, source_table, item_id, **deltas):
+    """
+    Add `deltas` to the stats row of the teacher/subject owning `source_table`.id = item_id,
+    e.g. bump_teacher_stats(cursor, 'lectures', lecture_id, lecture_downloads=1).
+    Runs in the caller's transaction; failures are logged and left to the reconciler.
+    """
+    assert source_table in ("lectures", "assignments", "quizzes", "materials", "notifications")
+    columns = [c for c in deltas if c in TEACHER_STAT_COLUMNS]
+    if not columns:
+        return
+    try:
+        cursor.execute(f"""
+            INSERT INTO teacher_subject_stats (teacher_id, subject_name, {', '.join(columns)})
+            SELECT teacher_id, COALESCE(subject_name, ''), {', '.join(['%s'] * len(columns))}
+            FROM {source_table} WHERE id = %s
+            ON DUPLICATE KEY UPDATE {', '.join(f'{c} = {c} + VALUES({c})' for c in columns)}
+        """, (*[deltas[c] for c in columns], item_id))
+    except Exception as e:
+        logger.warning("Could not update teacher stats for %s %s: %s", source_table, item_id, e)
+        teacher_stats.mark_dirty(None)
+
+
+def bump_teacher_stats_many(cursor, source_table, column, deltas):
+    """bump_teacher_stats for many rows of one table at once: deltas is {item id: amount}"""
+    assert source_table in ("lectures", "materials") and column in TEACHER_STAT_COLUMNS
+    ids = sorted(deltas)
+    try:
+        cursor.execute(f"""
+            INSERT INTO teacher_subject_stats (teacher_id, subject_name, {column})
+            SELECT teacher_id, COALESCE(subject_name, ''), CASE id {' '.join(['WHEN %s THEN %s'] * len(ids))} END
+            FROM {source_table} WHERE id IN ({', '.join(['%s'] * len(ids))})
+            ON DUPLICATE KEY UPDATE {column} = {column} + VALUES({column})
+        """, [value for item_id in ids for value in (item_id, deltas[item_id])] + ids)
+    except Exception as e:
+        logger.warning("Could not update teacher stats for %s downloads: %s", source_table, e)
+        teacher_stats.mark_dirty(None)
+
+
+def compute_teacher_stats(cursor, teacher_id=None):
+    """{(teacher_id, subject_name): {column: value}} computed from the source tables"""
+    where = "WHERE t.teacher_id = %s" if teacher_id is not None else ""
+    params = (teacher_id,) if teacher_id is not None else ()
+    
+    stats = {}
+    for query in TEACHER_STATS_SOURCES:
+        cursor.execute(query.format(where=where), params)
+        for row in cursor.fetchall():
+            key = (row['teacher_id'], row['subject_name'])
+            entry = stats.setdefault(key, {c: _stat_value(c, 0) for c in TEACHER_STAT_COLUMNS})
+            for column, value in row.items():
+                if column in TEACHER_STAT_COLUMNS:
+                    entry[column] = _stat_value(column, value)
+    return stats
+
+
+def read_teacher_stats(cursor, teacher_id):
+    """The teacher's per-subject stats rows, keyed by subject_name"""
+    cursor.execute(
+        f"SELECT subject_name, {', '.join(TEACHER_STAT_COLUMNS)} FROM teacher_subject_stats WHERE teacher_id = %s",
+        (teacher_id,)
+    )
+    return {row['subject_name']: row for row in cursor.fetchall()}
+
+
+def sum_teacher_stats(rows):
+    """Totals across a teacher's subjects, plus how many subjects have each kind of content"""
+    totals = {c: sum(_stat_value(c, row[c]) for row in rows.values()) for c in TEACHER_STAT_COLUMNS}
+    for column in ("lectures", "assignments", "quizzes", "materials", "notifications"):
+        totals[f"subjects_with_{column}"] = sum(1 for row in rows.values() if row[column])
+    return totals
+
+
+class TeacherStatsReconciler:
+    """Background thread that rebuilds dirty teachers promptly and every teacher periodically"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._dirty = set()
+        self._full_pass = True      # build everything on the first run
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None        # {"at", "teachers", "drifted_rows", "seconds"}
+
+    def mark_dirty(self, teacher_id):
+        """Schedule a rebuild of one teacher (None: everyone)"""
+        with self._lock:
+            if teacher_id is None:
+                self._full_pass = True
+            else:
+                self._dirty.add(teacher_id)
+        self._wake.set()
+
+    def reconcile(self, teacher_id=None):
+        """Rebuild stats rows from the source tables; returns how many rows had drifted"""
+        started = time.monotonic()
+        db = get_db()
+        try:
+            cursor = db.cursor(dictionary=True)
+            fresh = compute_teacher_stats(cursor, teacher_id)
+            
+            if teacher_id is None:
+                cursor.execute(f"SELECT teacher_id, subject_name, {', '.join(TEACHER_STAT_COLUMNS)} FROM teacher_subject_stats")
+            else:
+                cursor.execute(
+                    f"SELECT teacher_id, subject_name, {', '.join(TEACHER_STAT_COLUMNS)} FROM teacher_subject_stats WHERE teacher_id = %s",
+                    (teacher_id,)
+                )
+            current = {
+                (row['teacher_id'], row['subject_name']): {c: _stat_value(c, row[c]) for c in TEACHER_STAT_COLUMNS}
+                for row in cursor.fetchall()
+            }
+            
+            drifted = 0
+            for key in set(current) - set(fresh):
+                cursor.execute(
+                    "DELETE FROM teacher_subject_stats WHERE teacher_id = %s AND subject_name = %s", key
+                )
+                drifted += 1
+            
+            for key, values in fresh.items():
+                if current.get(key) == values:
+                    continue
+                cursor.execute(f"""
+                    INSERT INTO teacher_subject_stats (teacher_id, subject_name, {', '.join(TEACHER_STAT_COLUMNS)})
+                    VALUES (%s, %s, {', '.join(['%s'] * len(TEACHER_STAT_COLUMNS))})
+                    ON DUPLICATE KEY UPDATE {', '.join(f'{c} = VALUES({c})' for c in TEACHER_STAT_COLUMNS)}
+                """, (*key, *[values[c] for c in TEACHER_STAT_COLUMNS]))
+                drifted += 1
+            
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
+        
+        self.last_run = {
+            "at": datetime.now().isoformat(),
+            "teachers": "all" if teacher_id is None else teacher_id,
+            "drifted_rows": drifted,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        if drifted and teacher_id is None:
+            logger.info("Teacher stats reconciliation repaired %d rows", drifted)
+        return drifted
+
+    def _run(self):
+        next_full = time.monotonic()
+        while not self._stop.is_set():
+            self._wake.wait(max(0.0, next_full - time.monotonic()))
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            
+            with self._lock:
+                full = self._full_pass or time.monotonic() >= next_full
+                dirty, self._dirty = self._dirty, set()
+                self._full_pass = False
+            
+            try:
+                if full:
+                    self.reconcile()
+                    next_full = time.monotonic() + self.interval
+                else:
+                    for teacher_id in dirty:
+                        self.reconcile(teacher_id)
+            except Exception as e:
+                logger.warning("Teacher stats reconciliation failed: %s", e)
+                time.sleep(1)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="teacher-stats-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+teacher_stats = TeacherStatsReconciler(TEACHER_STATS_RECONCILE_SECONDS)
+
+
+@app.on_event("startup")
+def start_teacher_stats():
+    teacher_stats.start()
+
+
+@app.on_event("shutdown")
+def stop_teacher_stats():
+    teacher_stats.stop()
+
+
+@app.post("/admin/teacher-stats/reconcile")
+def reconcile_teacher_stats(teacher_id: Optional[int] = None):
+    """Rebuild teacher stats now (one teacher or all) and report how many rows had drifted"""
+    try:
+        drifted = teacher_stats.reconcile(teacher_id)
+        return {"success": True, "drifted_rows": drifted, "last_run": teacher_stats.last_run}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+# ------------------- STATISTICS ENDPOINTS -------------------
+
+@app.get("/teacher/{teacher_id}/stats")
+def get_teacher_stats(teacher_id: str):
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        totals = sum_teacher_stats(read_teacher_stats(cursor, teacher_id))
+        lecture_count = totals['lectures']
+        assignment_count = totals['assignments']
+        quiz_count = totals['quizzes']
+        notification_count = totals['notifications']
+        total_downloads = totals['lecture_downloads']
         
-        lectures = cursor.fetchall()
         cursor.close()
         db.close()
         
-        return {"lectures": lectures, "success": True}
+        return {
+            "stats": {
+                "lecture_count": lecture_count,
+                "assignment_count": assignment_count,
+                "quiz_count": quiz_count,
+                "notification_count": notification_count,
+                "total_downloads": total_downloads
+            },
+            "success": True
+        }
+        
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error fetching teacher stats: {str(e)}")
+
+# ------------------- LIST PAGINATION -------------------
+
+LIST_PAGE_MAX = int(os.getenv("LIST_PAGE_MAX", "500"))
+_FIELD_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+# Joined teacher columns the content list endpoints add to every row
+LIST_TEACHER_COLUMNS = {"teacher_userId": "u.userId", "teacher_name": "u.fullName"}
+
+
+def encode_page_cursor(sort_value, row_id):
+    raw = json.dumps([None if sort_value is None else str(sort_value), row_id])
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_page_cursor(token):
+    try:
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        return sort_value, int(row_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def fetch_list_page(cursor, table, alias, sort_column, joins="", computed=None, where=(), params=(),
+                    fields=None, limit=None, page_cursor=None, include_total=False, ascending=False):
+    """
+    Keyset page over `table` on (sort_column, id), newest first unless `ascending`;
+    returns (rows, next_cursor, total).
+
+    Without `limit`/`page_cursor` every row is returned, as the list endpoints always did.
+    `fields` is a comma-separated projection (id and sort_column are always included so
+    the next cursor can be built), and `total` is only counted when asked for.
+    """
+    computed = computed or {}
+    if fields:
+        names = [name.strip() for name in fields.split(',') if name.strip()]
+        invalid = [name for name in names if not _FIELD_NAME.match(name)]
+        if invalid:
+            raise HTTPException(status_code=400, detail=f"Invalid field name(s): {', '.join(invalid)}")
+        for required in (sort_column, 'id'):
+            if required not in names:
+                names.append(required)
+        columns = [f"{computed[name]} AS {name}" if name in computed else f"{alias}.{name}" for name in names]
+    else:
+        columns = [f"{alias}.*"] + [f"{expr} AS {name}" for name, expr in computed.items()]
+    
+    conditions, values = list(where), list(params)
+    base_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    op, direction = (">", "ASC") if ascending else ("<", "DESC")
+    if page_cursor:
+        sort_value, last_id = decode_page_cursor(page_cursor)
+        column = f"{alias}.{sort_column}"
+        if sort_column == 'id':
+            conditions.append(f"{alias}.id {op} %s")
+            values.append(last_id)
+        elif sort_value is None:
+            # MySQL sorts NULLs first ascending and last descending: after a NULL come
+            # the remaining NULLs by id, then (ascending only) every non-NULL value
+            after_nulls = f" OR {column} IS NOT NULL" if ascending else ""
+            conditions.append(f"(({column} IS NULL AND {alias}.id {op} %s){after_nulls})")
+            values.append(last_id)
+        else:
+            before_nulls = "" if ascending else f" OR {column} IS NULL"
+            conditions.append(
+                f"({column} {op} %s OR ({column} = %s AND {alias}.id {op} %s){before_nulls})"
+            )
+            values += [sort_value, sort_value, last_id]
+    page_where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    
+    order_by = [f"{alias}.id {direction}"]
+    if sort_column != 'id':
+        order_by.insert(0, f"{alias}.{sort_column} {direction}")
+    query = f"""
+        SELECT {', '.join(columns)}
+        FROM {table} {alias} {joins}
+        {page_where}
+        ORDER BY {', '.join(order_by)}
+    """
+    page_size = None
+    if limit is not None or page_cursor:
+        page_size = max(1, min(limit or LIST_PAGE_MAX, LIST_PAGE_MAX))
+        query += " LIMIT %s"
+        values.append(page_size + 1)
+    
+    try:
+        cursor.execute(query, values)
+    except mysql.connector.Error as e:
+        if e.errno == 1054:  # unknown column
+            raise HTTPException(status_code=400, detail=f"Unknown field: {e.msg}")
+        raise
+    rows = cursor.fetchall()
+    
+    next_cursor = None
+    if page_size is not None and len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_page_cursor(rows[-1][sort_column], rows[-1]['id'])
+    
+    total = None
+    if include_total:
+        cursor.execute(f"SELECT COUNT(*) AS total FROM {table} {alias} {joins} {base_where}", list(params))
+        total = cursor.fetchone()['total']
+    
+    return rows, next_cursor, total
+
+
+def list_page_info(next_cursor, total):
+    info = {"next_cursor": next_cursor}
+    if total is not None:
+        info["total"] = total
+    return info
+
+
+def set_page_headers(response, next_cursor, total):
+    """For endpoints that return a bare list: paging info goes in headers"""
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if total is not None:
+        response.headers["X-Total-Count"] = str(total)
+
+
+# ------------------- GENERAL GET ENDPOINTS -------------------
+
+@app.get("/lectures")
+def get_all_lectures(
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
+    try:
+        db = get_db()
+        cursor = db.cursor(dictionary=True)
+        
+        lectures, next_cursor, total = fetch_list_page(
+            cursor, "lectures", "l", "upload_date",
+            joins="JOIN users u ON l.teacher_id = u.id", computed=LIST_TEACHER_COLUMNS,
+            fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
+        )
+        cursor.close()
+        db.close()
+        
+        return {"lectures": lectures, "success": True, **list_page_info(next_cursor, total)}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching lectures: {str(e)}")
 
 @app.get("/assignments")
-def get_all_assignments():
+def get_all_assignments(
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        cursor.execute(
-            """SELECT a.*, u.userId as teacher_userId, u.fullName as teacher_name
-               FROM assignments a 
-               JOIN users u ON a.teacher_id = u.id 
-               ORDER BY a.created_date DESC"""
+        assignments, next_cursor, total = fetch_list_page(
+            cursor, "assignments", "a", "created_date",
+            joins="JOIN users u ON a.teacher_id = u.id", computed=LIST_TEACHER_COLUMNS,
+            fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
         )
-        
-        assignments = cursor.fetchall()
         cursor.close()
         db.close()
         
-        return {"assignments": assignments, "success": True}
+        return {"assignments": assignments, "success": True, **list_page_info(next_cursor, total)}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching assignments: {str(e)}")
 
 @app.get("/notifications")
-def get_all_notifications():
+def get_all_notifications(
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        cursor.execute(
-            """SELECT n.*, u.userId as teacher_userId, u.fullName as teacher_name
-               FROM notifications n 
-               JOIN users u ON n.teacher_id = u.id 
-               ORDER BY n.created_date DESC"""
+        notifications, next_cursor, total = fetch_list_page(
+            cursor, "notifications", "n", "created_date",
+            joins="JOIN users u ON n.teacher_id = u.id", computed=LIST_TEACHER_COLUMNS,
+            fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
         )
-        
-        notifications = cursor.fetchall()
         cursor.close()
         db.close()
         
-        return {"notifications": notifications, "success": True}
+        return {"notifications": notifications, "success": True, **list_page_info(next_cursor, total)}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching notifications: {str(e)}")
 
 @app.get("/quizzes")
-def get_all_quizzes():
+def get_all_quizzes(
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        cursor.execute(
-            """SELECT q.*, u.userId as teacher_userId, u.fullName as teacher_name
-               FROM quizzes q 
-               JOIN users u ON q.teacher_id = u.id 
-               ORDER BY q.created_date DESC"""
+        quizzes, next_cursor, total = fetch_list_page(
+            cursor, "quizzes", "q", "created_date",
+            joins="JOIN users u ON q.teacher_id = u.id", computed=LIST_TEACHER_COLUMNS,
+            fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
         )
-        
-        quizzes = cursor.fetchall()
         cursor.close()
         db.close()
         
-        return {"quizzes": quizzes, "success": True}
+        return {"quizzes": quizzes, "success": True, **list_page_info(next_cursor, total)}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching quizzes: {str(e)}")
 
@@ -1488,54 +4405,13 @@ def get_student_subjects_with_teachers(year_id: int):
         
         subjects_data = predefined_subjects[year_id]
         
-        # Get all teachers
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        cursor.execute("SELECT userId, fullName, subject FROM users WHERE role = 'teacher'")
-        all_teachers = cursor.fetchall()
-        cursor.close()
-        db.close()
+        ensure_subject_teacher_index()
         
-        # Function for exact matching
-        def exact_subject_match(teacher_subject, target_subject):
-            if not teacher_subject or not target_subject:
-                return False
-            
-            # Normalize both subjects
-            teacher_norm = teacher_subject.lower().strip()
-            target_norm = target_subject.lower().strip()
-            
-            # Remove punctuation and extra spaces
-            import string
-            teacher_norm = teacher_norm.translate(str.maketrans('', '', string.punctuation))
-            target_norm = target_norm.translate(str.maketrans('', '', string.punctuation))
-            
-            teacher_norm = ' '.join(teacher_norm.split())
-            target_norm = ' '.join(target_norm.split())
-            
-            # EXACT MATCH ONLY
-            return teacher_norm == target_norm
-        
-        # Prepare result with teachers for each subject
+        # Prepare result with teachers for each subject (exact match on the normalized name)
         result_subjects = []
         for subject in subjects_data:
             subject_name = subject["subject_name"]
-            matched_teachers = []
-            
-            # Find teachers that exactly match this subject
-            for teacher in all_teachers:
-                teacher_subject = teacher.get("subject", "")
-                if teacher_subject:
-                    # Handle multiple subjects (comma-separated)
-                    teacher_subjects = [s.strip() for s in teacher_subject.split(',')]
-                    for ts in teacher_subjects:
-                        if exact_subject_match(ts, subject_name):
-                            matched_teachers.append({
-                                "userId": teacher["userId"],
-                                "fullName": teacher["fullName"],
-                                "subject": teacher["subject"]
-                            })
-                            break  # No need to check other subjects for this teacher
+            matched_teachers = subject_teacher_index.teachers_for(subject_name)
             
             result_subjects.append({
                 "subject_name": subject_name,
@@ -1598,13 +4474,14 @@ def get_subject_stats(subject_name: str):
 # ------------------- MATERIALS ENDPOINTS -------------------
 
 @app.post("/materials")
-async def create_material(
+def create_material(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
     description: str = Form(""),
     material_type: str = Form("other"),
-    file: UploadFile = File(None)
+    file: UploadFile = File(None),
+    upload_id: Optional[str] = Form(None)
 ):
     try:
         db = get_db()
@@ -1636,10 +4513,10 @@ async def create_material(
             file_path = os.path.join("uploads", "materials", teacher_id, file_name)
             full_file_path = os.path.join(UPLOAD_DIR, "materials", teacher_id, file_name)
             
-            with open(full_file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
-            
-            file_size = os.path.getsize(full_file_path)
+            file_size, sha256 = store_upload_file(file, full_file_path, "materials")
+            file_path, full_file_path = adopt_blob(cursor, full_file_path, sha256, file_size)
+        elif upload_id:
+            file_name, file_path, full_file_path, file_size = chunked_uploads.claim(cursor, upload_id, "materials", teacher_id, title)
         
         # Insert using numeric teacher_id for foreign key
         cursor.execute(
@@ -1648,17 +4525,24 @@ async def create_material(
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
             (numeric_teacher_id, subject_name, title, description, file_path, file_name, file_size, material_type)
         )
+        material_id = cursor.lastrowid
+        bump_teacher_stats(cursor, 'materials', material_id, materials=1)
         
         db.commit()
         cursor.close()
         db.close()
         
+        if file_path:
+            file_index.put('material', material_id, full_file_path, material_file_locator(material_id, teacher_id))
+        
         return {
             "message": "Material uploaded successfully", 
             "success": True,
             "teacher_name": teacher['fullName']
         }
         
+    except HTTPException:
+        raise
     except mysql.connector.Error as e:
         if e.errno == 1452:
             raise HTTPException(status_code=400, detail=f"Database constraint error. Please contact administrator.")
@@ -1692,24 +4576,28 @@ def get_materials(teacher_userId: str, subject_name: str):
         raise HTTPException(status_code=500, detail=f"Error fetching materials: {str(e)}")
 
 @app.get("/materials")
-def get_all_materials():
+def get_all_materials(
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        cursor.execute(
-            """SELECT m.*, u.userId as teacher_userId, u.fullName as teacher_name
-               FROM materials m 
-               JOIN users u ON m.teacher_id = u.id 
-               ORDER BY m.upload_date DESC"""
+        materials, next_cursor, total = fetch_list_page(
+            cursor, "materials", "m", "upload_date",
+            joins="JOIN users u ON m.teacher_id = u.id", computed=LIST_TEACHER_COLUMNS,
+            fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
         )
-        
-        materials = cursor.fetchall()
         cursor.close()
         db.close()
         
-        return {"materials": materials, "success": True}
+        return {"materials": materials, "success": True, **list_page_info(next_cursor, total)}
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fetching materials: {str(e)}")
 
@@ -1720,20 +4608,24 @@ def delete_material(material_id: int):
         cursor = db.cursor(dictionary=True)
         
         # Get file path before deleting
-        cursor.execute("SELECT file_path FROM materials WHERE id = %s", (material_id,))
+        cursor.execute("SELECT file_path, teacher_id FROM materials WHERE id = %s", (material_id,))
         material = cursor.fetchone()
         
-        # Delete file from filesystem
+        # Drop this material's reference to its file; the file goes once the delete has committed
+        released_file = None
         if material and material['file_path']:
-            full_file_path = os.path.join(os.getcwd(), material['file_path'])
-            if os.path.exists(full_file_path):
-                os.remove(full_file_path)
+            released_file = release_blob(cursor, material['file_path'])
         
         # Delete from database
         cursor.execute("DELETE FROM materials WHERE id = %s", (material_id,))
         db.commit()
         cursor.close()
         db.close()
+        remove_released_file(released_file)
+        
+        file_index.remove('material', material_id)
+        if material:
+            teacher_stats.mark_dirty(material['teacher_id'])
         
         return {"message": "Material deleted successfully", "success": True}
         
@@ -1743,17 +4635,7 @@ def delete_material(material_id: int):
 @app.post("/materials/{material_id}/download")
 def increment_material_download_count(material_id: int):
     try:
-        db = get_db()
-        cursor = db.cursor()
-        
-        cursor.execute(
-            "UPDATE materials SET downloads = downloads + 1 WHERE id = %s",
-            (material_id,)
-        )
-        
-        db.commit()
-        cursor.close()
-        db.close()
+        download_counters.add('materials', material_id)
         
         return {"message": "Download count updated", "success": True}
         
@@ -1860,7 +4742,7 @@ def get_all_course_materials(teacher_userId: str, subject_name: str):
 # ------------------- MATERIALS ENDPOINTS -------------------
 
 @app.post("/materials")
-async def create_material(
+def create_material(
     teacher_id: str = Form(...),
     subject_name: str = Form(...),
     title: str = Form(...),
@@ -2031,24 +4913,718 @@ def delete_material(material_id: int):
 @app.post("/materials/{material_id}/download")
 def increment_material_download_count(material_id: int):
     try:
-        db = get_db()
-        cursor = db.cursor()
+        download_counters.add('materials', material_id)
+        
+        return {"message": "Download count updated", "success": True}
         
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error updating download count: {str(e)}")
+
+
+
+# ------------------- FILE STREAMING HELPERS -------------------
+
+STREAM_CHUNK_SIZE = int(os.getenv("STREAM_CHUNK_SIZE", str(256 * 1024)))  # bytes held in memory per viewer
+MAX_RANGES_PER_REQUEST = 16
+
+_RANGE_SPEC = re.compile(r'^\s*(\d*)\s*-\s*(\d*)\s*$')
+_BLOB_NAME = re.compile(r'^([0-9a-f]{64})(\.[^.]*)?$')
+
+# Cache-Control per kind of file. Teacher content may be cached by browsers and
+# proxies but is revalidated (a lecture's file can be replaced under the same URL);
+# student submissions stay out of shared caches and are revalidated every time.
+FILE_CACHE_POLICIES = {
+    "lecture": os.getenv("CACHE_CONTROL_LECTURES", "public, max-age=3600, must-revalidate"),
+    "material": os.getenv("CACHE_CONTROL_MATERIALS", "public, max-age=3600, must-revalidate"),
+    "assignment": os.getenv("CACHE_CONTROL_ASSIGNMENTS", "public, max-age=300, must-revalidate"),
+    "submission": os.getenv("CACHE_CONTROL_SUBMISSIONS", "private, no-cache"),
+}
+
+
+def file_validators(path, stat_result=None):
+    """
+    Strong ETag and Last-Modified for a file on disk. Blob store files are named by
+    their SHA-256, which is the ETag; anything else uses inode + mtime + size.
+    """
+    st = stat_result or os.stat(path)
+    blob = _BLOB_NAME.match(os.path.basename(path))
+    if blob and os.path.basename(os.path.dirname(os.path.dirname(os.path.abspath(path)))) == "blobs":
+        etag = f'"{blob.group(1)}"'
+    else:
+        etag = f'"{st.st_ino:x}-{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = formatdate(st.st_mtime, usegmt=True)
+    return etag, last_modified
+
+
+# How file bytes leave the server. "python" streams them from the worker;
+# "x-accel" (nginx) and "x-sendfile" (Apache/lighttpd) answer with headers only and
+# let the front proxy do the transfer, ranges included, after Python has done the
+# lookup, authorization and conditional-GET checks. nginx needs an internal location
+# mapped onto the uploads directory, e.g.
+#
+#     location /protected-uploads/ {
+#         internal;
+#         alias /srv/islamic-center/backend/uploads/;
+#     }
+#
+# FILE_ACCEL_EMULATE=1 makes the app serve X-Accel-Redirect responses itself, for
+# running the x-accel mode locally without nginx.
+FILE_DELIVERY_MODE = os.getenv("FILE_DELIVERY_MODE", "python").lower()
+FILE_ACCEL_PREFIX = "/" + os.getenv("FILE_ACCEL_PREFIX", "/protected-uploads/").strip("/") + "/"
+FILE_ACCEL_EMULATE = os.getenv("FILE_ACCEL_EMULATE", "0") == "1"
+if FILE_DELIVERY_MODE not in ("python", "x-accel", "x-sendfile"):
+    logger.warning("Unknown FILE_DELIVERY_MODE %r, streaming files from Python", FILE_DELIVERY_MODE)
+    FILE_DELIVERY_MODE = "python"
+
+
+def offload_file_response(path, media_type, headers):
+    """
+    Headers-only response handing `path` to the front proxy, or None when the
+    mode is "python" or the file lies outside the uploads directory.
+    """
+    if FILE_DELIVERY_MODE == "python":
+        return None
+    uploads_root = os.path.abspath(UPLOAD_DIR)
+    full_path = os.path.abspath(path)
+    if os.path.commonpath([uploads_root, full_path]) != uploads_root:
+        return None
+    
+    if FILE_DELIVERY_MODE == "x-accel":
+        relative = os.path.relpath(full_path, uploads_root).replace(os.sep, "/")
+        headers = {**headers, "X-Accel-Redirect": FILE_ACCEL_PREFIX + quote(relative)}
+    else:
+        headers = {**headers, "X-Sendfile": full_path}
+    return Response(status_code=200, media_type=media_type, headers=headers)
+
+
+def full_download(request, response):
+    """
+    Whether a range_file_response sends the whole file, so it counts as a download:
+    304 revalidations and Range requests (answered here or by the proxy) don't.
+    """
+    if response.status_code != 200:
+        return False
+    offloaded = 'X-Accel-Redirect' in response.headers or 'X-Sendfile' in response.headers
+    return not (
+        offloaded and request.headers.get('range')
+        and if_range_matches(request.headers.get('if-range'),
+                             response.headers.get('etag'), response.headers.get('last-modified'))
+    )
+
+
+def accel_internal_path(location):
+    """Path on disk for an X-Accel-Redirect location (the emulator's view of the nginx alias)"""
+    relative = unquote(location[len(FILE_ACCEL_PREFIX):]) if location.startswith(FILE_ACCEL_PREFIX) else None
+    if not relative:
+        return None
+    uploads_root = os.path.abspath(UPLOAD_DIR)
+    full_path = os.path.abspath(os.path.join(uploads_root, relative))
+    if os.path.commonpath([uploads_root, full_path]) != uploads_root or not os.path.isfile(full_path):
+        return None
+    return full_path
+
+
+class AccelRedirectEmulator:
+    """Stand-in for nginx during development: serves X-Accel-Redirect responses from the internal location"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        redirect = {}
+        
+        async def intercept(message):
+            if message["type"] == "http.response.start":
+                headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in message["headers"]}
+                if "x-accel-redirect" in headers:
+                    redirect.update(headers)
+                    return
+            elif redirect:
+                return      # the (empty) body of the redirect response
+            await send(message)
+        
+        await self.app(scope, receive, intercept)
+        if not redirect:
+            return
+        
+        path = accel_internal_path(redirect["x-accel-redirect"])
+        if path is None:
+            await Response(status_code=404)(scope, receive, send)
+            return
+        # Like nginx: the proxy does ranges itself, but keeps the app's type, disposition and caching
+        response = await run_in_threadpool(
+            range_file_response, Request(scope), path,
+            redirect.get("content-type", "application/octet-stream"),
+            None, "inline", redirect.get("cache-control"), False
+        )
+        if "content-disposition" in redirect:
+            response.headers["content-disposition"] = redirect["content-disposition"]
+        await response(scope, receive, send)
+
+
+if FILE_DELIVERY_MODE == "x-accel" and FILE_ACCEL_EMULATE:
+    app.add_middleware(AccelRedirectEmulator)
+
+
+def not_modified(request, etag, mtime):
+    """
+    Conditional GET: If-None-Match (weak comparison, takes precedence) or
+    If-Modified-Since. True when the client's copy is current (answer 304).
+    """
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+    
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def parse_range_header(range_header, file_size):
+    """
+    Parse a Range header into a sorted list of (start, end) byte ranges.
+    Returns None when the header should be ignored (malformed, not bytes, too many ranges)
+    and [] when no range is satisfiable (416).
+    """
+    if not range_header or '=' not in range_header:
+        return None
+    unit, _, spec = range_header.partition('=')
+    if unit.strip().lower() != 'bytes':
+        return None
+
+    parts = [p for p in spec.split(',') if p.strip()]
+    if not parts or len(parts) > MAX_RANGES_PER_REQUEST:
+        return None
+
+    ranges = []
+    for part in parts:
+        match = _RANGE_SPEC.match(part)
+        if not match:
+            return None
+        first, last = match.groups()
+        if first == '' and last == '':
+            return None
+        if first == '':
+            # Suffix range: last N bytes
+            suffix = int(last)
+            if suffix == 0:
+                continue
+            start, end = max(file_size - suffix, 0), file_size - 1
+        else:
+            start = int(first)
+            end = int(last) if last else file_size - 1
+            if last and end < start:
+                return None
+            if start >= file_size:
+                continue
+            end = min(end, file_size - 1)
+        if file_size > 0:
+            ranges.append((start, end))
+
+    # Merge overlapping / adjacent ranges so a client can't make us send bytes twice
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(if_range, etag, last_modified):
+    """If-Range: serve the range only if the client's validator is still current"""
+    if not if_range:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith('W/'):
+        return if_range == etag
+    return if_range == last_modified
+
+
+async def iter_file_range(path, start, end, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield bytes start..end (inclusive) of a file without holding more than one chunk"""
+    async with await anyio.open_file(path, 'rb') as f:
+        await f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = await f.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+async def iter_multipart_ranges(path, ranges, parts_headers, boundary):
+    for (start, end), part_header in zip(ranges, parts_headers):
+        yield part_header
+        async for chunk in iter_file_range(path, start, end):
+            yield chunk
+        yield b'\r\n'
+    yield f'--{boundary}--\r\n'.encode()
+
+
+def content_disposition(disposition, filename):
+    """Content-Disposition value that survives non-ASCII file names"""
+    if not filename:
+        return disposition
+    try:
+        filename.encode('latin-1')
+        return f'{disposition}; filename="{filename}"'
+    except UnicodeEncodeError:
+        return f"{disposition}; filename*=UTF-8''{quote(filename)}"
+
+
+def range_file_response(request, path, media_type, filename=None, disposition='inline', cache_control=None,
+                        offload=True):
+    """
+    Stream a file honouring conditional GET (304), Range (single, multi and suffix
+    ranges) and If-Range. Memory per response is bounded by STREAM_CHUNK_SIZE
+    regardless of file size. With a proxy FILE_DELIVERY_MODE (and offload=True)
+    only the headers are built here and the proxy sends the bytes.
+    """
+    st = os.stat(path)
+    file_size = st.st_size
+    etag, last_modified = file_validators(path, st)
+    validators = {'ETag': etag, 'Last-Modified': last_modified}
+    if cache_control:
+        validators['Cache-Control'] = cache_control
+    
+    if not_modified(request, etag, st.st_mtime):
+        return Response(status_code=304, headers=validators)
+    
+    headers = {
+        'Accept-Ranges': 'bytes',
+        **validators,
+        'Content-Disposition': content_disposition(disposition, filename),
+    }
+    
+    if offload:
+        offloaded = offload_file_response(path, media_type, headers)
+        if offloaded is not None:
+            return offloaded
+
+    range_header = request.headers.get('range')
+    ranges = None
+    if range_header and if_range_matches(request.headers.get('if-range'), etag, last_modified):
+        ranges = parse_range_header(range_header, file_size)
+
+    if ranges is None:
+        headers['Content-Length'] = str(file_size)
+        return StreamingResponse(
+            iter_file_range(path, 0, file_size - 1),
+            status_code=200,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    if not ranges:
+        return Response(
+            status_code=416,
+            headers={'Content-Range': f'bytes */{file_size}', 'Accept-Ranges': 'bytes'},
+        )
+
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers['Content-Range'] = f'bytes {start}-{end}/{file_size}'
+        headers['Content-Length'] = str(end - start + 1)
+        return StreamingResponse(
+            iter_file_range(path, start, end),
+            status_code=206,
+            media_type=media_type,
+            headers=headers,
+        )
+
+    boundary = uuid.uuid4().hex
+    parts_headers = [
+        (
+            f'--{boundary}\r\n'
+            f'Content-Type: {media_type}\r\n'
+            f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+        ).encode()
+        for start, end in ranges
+    ]
+    content_length = sum(len(h) + (end - start + 1) + 2 for h, (start, end) in zip(parts_headers, ranges))
+    content_length += len(f'--{boundary}--\r\n')
+    headers['Content-Length'] = str(content_length)
+    return StreamingResponse(
+        iter_multipart_ranges(path, ranges, parts_headers, boundary),
+        status_code=206,
+        media_type=f'multipart/byteranges; boundary={boundary}',
+        headers=headers,
+    )
+
+
+# ------------------- LECTURE HLS PACKAGING -------------------
+
+# Lecture videos are packaged into adaptive HLS after upload: one H.264/AAC
+# rendition per HLS_RENDITIONS entry (never upscaled past the source), cut into
+# HLS_SEGMENT_SECONDS segments on aligned keyframes, under
+# uploads/hls/<lecture id>/{master.m3u8, <rendition>/index.m3u8, <rendition>/seg_NNNNN.ts}.
+# The queue is the lectures table itself (hls_status), so pending jobs survive
+# restarts, and a conditional UPDATE lets only one worker claim each lecture.
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+HLS_ENABLED = os.getenv("HLS_ENABLED", "1") == "1"
+HLS_DIR = os.path.join(UPLOAD_DIR, "hls")
+HLS_SEGMENT_SECONDS = int(os.getenv("HLS_SEGMENT_SECONDS", "6"))
+HLS_POLL_SECONDS = float(os.getenv("HLS_POLL_SECONDS", "60"))
+HLS_JOB_TIMEOUT_SECONDS = int(os.getenv("HLS_JOB_TIMEOUT_SECONDS", str(3 * 3600)))
+# A 'processing' claim is only taken over once it is older than any live job can be
+# (probe + ffmpeg timeout + swapping the package in), so a slow job is never packaged twice
+HLS_CLAIM_STALE_SECONDS = max(
+    int(os.getenv("HLS_CLAIM_STALE_SECONDS", "0")),
+    HLS_JOB_TIMEOUT_SECONDS + 30 * 60,
+)
+HLS_VIDEO_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.mkv', '.webm', '.avi', '.wmv', '.flv'}
+
+# (name, height, video bitrate, audio bitrate)
+HLS_RENDITIONS = [
+    ("240p", 240, "400k", "64k"),
+    ("480p", 480, "1200k", "96k"),
+    ("720p", 720, "2800k", "128k"),
+]
+
+_HLS_ASSET = re.compile(r'^(master\.m3u8|(\d+p)/(index\.m3u8|seg_\d{5}\.ts))$')
+
+
+def hls_source(file_name):
+    return bool(file_name) and os.path.splitext(file_name)[1].lower() in HLS_VIDEO_EXTENSIONS
+
+
+def queue_hls_packaging(cursor, lecture_id):
+    """Mark a lecture's video for packaging, in the caller's transaction"""
+    if schema_cache.has_column('lectures', 'hls_status'):
         cursor.execute(
-            "UPDATE materials SET downloads = downloads + 1 WHERE id = %s",
-            (material_id,)
+            "UPDATE lectures SET hls_status = 'pending', hls_error = NULL, hls_updated_at = NOW() WHERE id = %s",
+            (lecture_id,)
         )
-        
-        db.commit()
+
+
+def _migration_lecture_hls(cursor):
+    """HLS job status columns on lectures (and the index the packager polls)"""
+    cursor.execute("""
+        SELECT column_name AS column_name FROM information_schema.columns
+        WHERE table_schema = DATABASE() AND table_name = 'lectures'
+    """)
+    columns = {row['column_name'] for row in cursor.fetchall()}
+    for column, ddl in (
+        ("hls_status", "hls_status VARCHAR(16) NULL"),
+        ("hls_error", "hls_error VARCHAR(512) NULL"),
+        ("hls_updated_at", "hls_updated_at DATETIME NULL"),
+    ):
+        if column not in columns:
+            cursor.execute(f"ALTER TABLE lectures ADD COLUMN {ddl}")
+    _migration_hot_indexes(cursor)
+
+
+def probe_video(path):
+    """(height, has_audio) of a video file, via ffprobe"""
+    def probe(*args):
+        result = subprocess.run(
+            [FFPROBE_BIN, "-v", "error", *args, "-of", "csv=p=0", path],
+            capture_output=True, text=True, timeout=60
+        )
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip() or "ffprobe failed")
+        return result.stdout.strip()
+    
+    height = probe("-select_streams", "v:0", "-show_entries", "stream=height")
+    if not height:
+        raise RuntimeError("no video stream")
+    has_audio = bool(probe("-select_streams", "a", "-show_entries", "stream=index"))
+    return int(height.splitlines()[0].strip(",")), has_audio
+
+
+def hls_command(source, output_dir, renditions, has_audio):
+    """One ffmpeg run decoding the source once and encoding every rendition"""
+    count = len(renditions)
+    split = f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))
+    scales = ";".join(f"[v{i}]scale=-2:{height}[v{i}out]" for i, (_, height, _, _) in enumerate(renditions))
+    command = [
+        FFMPEG_BIN, "-hide_banner", "-loglevel", "error", "-y", "-i", source,
+        "-filter_complex", f"{split};{scales}",
+    ]
+    for i, (_, height, video_bitrate, audio_bitrate) in enumerate(renditions):
+        command += ["-map", f"[v{i}out]"]
+        if has_audio:
+            command += ["-map", "0:a:0"]
+        command += [
+            f"-b:v:{i}", video_bitrate, f"-maxrate:v:{i}", video_bitrate,
+            f"-bufsize:v:{i}", f"{int(video_bitrate[:-1]) * 2}k",
+        ]
+        if has_audio:
+            command += [f"-b:a:{i}", audio_bitrate]
+    command += [
+        "-c:v", "libx264", "-preset", "veryfast", "-profile:v", "main", "-sc_threshold", "0",
+        "-force_key_frames", f"expr:gte(t,n_forced*{HLS_SEGMENT_SECONDS})",
+    ]
+    if has_audio:
+        command += ["-c:a", "aac", "-ac", "2"]
+    stream_map = " ".join(
+        f"v:{i},a:{i},name:{name}" if has_audio else f"v:{i},name:{name}"
+        for i, (name, _, _, _) in enumerate(renditions)
+    )
+    command += [
+        "-f", "hls", "-hls_time", str(HLS_SEGMENT_SECONDS), "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(output_dir, "%v", "seg_%05d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", stream_map,
+        os.path.join(output_dir, "%v", "index.m3u8"),
+    ]
+    return command
+
+
+class HlsPackager:
+    """
+    Background thread packaging pending lecture videos one at a time. A claim is
+    an UPDATE from 'pending' (or from a 'processing' claim older than
+    HLS_CLAIM_STALE_SECONDS, left by a crashed worker) to 'processing'; the result is 'ready',
+    'failed' with the error, or 'skipped' when the file is not a usable video.
+    """
+
+    def __init__(self, poll_seconds):
+        self.poll_seconds = poll_seconds
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.current = None         # lecture id being packaged
+        self.last_job = None        # {"lecture_id", "status", "seconds", "at"}
+        self.totals = {"ready": 0, "failed": 0, "skipped": 0}
+
+    def wake(self):
+        self._wake.set()
+
+    def _claim(self, db):
+        cursor = db.cursor(dictionary=True)
+        cursor.execute(
+            """SELECT l.id, l.file_path, l.file_name, u.userId as teacher_userId
+               FROM lectures l LEFT JOIN users u ON l.teacher_id = u.id
+               WHERE l.hls_status = 'pending'
+               OR (l.hls_status = 'processing' AND l.hls_updated_at < NOW() - INTERVAL %s SECOND)
+               ORDER BY l.id LIMIT 5""",
+            (HLS_CLAIM_STALE_SECONDS,)
+        )
+        for lecture in cursor.fetchall():
+            cursor.execute(
+                """UPDATE lectures SET hls_status = 'processing', hls_updated_at = NOW()
+                   WHERE id = %s AND (hls_status = 'pending'
+                   OR (hls_status = 'processing' AND hls_updated_at < NOW() - INTERVAL %s SECOND))""",
+                (lecture['id'], HLS_CLAIM_STALE_SECONDS)
+            )
+            claimed = cursor.rowcount == 1
+            db.commit()
+            if claimed:
+                cursor.close()
+                return lecture
         cursor.close()
-        db.close()
+        return None
+
+    def _finish(self, lecture_id, status, error=None):
+        db = get_db()
+        try:
+            cursor = db.cursor()
+            cursor.execute(
+                "UPDATE lectures SET hls_status = %s, hls_error = %s, hls_updated_at = NOW() WHERE id = %s",
+                (status, error[:512] if error else None, lecture_id)
+            )
+            db.commit()
+            cursor.close()
+        finally:
+            db.close()
+
+    def package(self, lecture):
+        """Package one lecture; returns (status, error)"""
+        source = resolve_lecture_file(lecture, lecture['teacher_userId'])
+        if not source:
+            return "failed", "Lecture file not found on server"
+        if not hls_source(source):
+            return "skipped", None
+        try:
+            height, has_audio = probe_video(source)
+        except Exception as e:
+            return "skipped", f"Not a playable video: {e}"
         
-        return {"message": "Download count updated", "success": True}
+        renditions = [r for r in HLS_RENDITIONS if r[1] <= height] or [HLS_RENDITIONS[0]]
+        final_dir = os.path.join(HLS_DIR, str(lecture['id']))
+        work_dir = f"{final_dir}.tmp"
+        shutil.rmtree(work_dir, ignore_errors=True)
+        for name, _, _, _ in renditions:
+            os.makedirs(os.path.join(work_dir, name), exist_ok=True)
         
+        try:
+            result = subprocess.run(
+                hls_command(source, work_dir, renditions, has_audio),
+                capture_output=True, text=True, timeout=HLS_JOB_TIMEOUT_SECONDS
+            )
+        except subprocess.TimeoutExpired:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return "failed", f"ffmpeg timed out after {HLS_JOB_TIMEOUT_SECONDS}s"
+        if result.returncode != 0:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            return "failed", result.stderr.strip()[-500:] or f"ffmpeg exited with {result.returncode}"
+        
+        # Swap the finished package in whole, so players never see a half-written one
+        shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(work_dir, final_dir)
+        return "ready", None
+
+    def run_once(self):
+        """Package every claimable lecture; returns how many were processed"""
+        processed = 0
+        while not self._stop.is_set():
+            db = get_db()
+            try:
+                lecture = self._claim(db)
+            finally:
+                db.close()
+            if lecture is None:
+                return processed
+            
+            started = time.time()
+            self.current = lecture['id']
+            try:
+                status, error = self.package(lecture)
+            except Exception as e:
+                status, error = "failed", str(e)
+            finally:
+                self.current = None
+            self._finish(lecture['id'], status, error)
+            if error:
+                logger.warning("HLS packaging of lecture %s %s: %s", lecture['id'], status, error)
+            
+            self.totals[status] += 1
+            self.last_job = {
+                "lecture_id": lecture['id'],
+                "status": status,
+                "seconds": round(time.time() - started, 1),
+                "at": datetime.now().isoformat(),
+            }
+            processed += 1
+        return processed
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.warning("HLS packager run failed: %s", e)
+            self._wake.wait(self.poll_seconds)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="hls-packager", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+hls_packager = HlsPackager(HLS_POLL_SECONDS)
+
+
+def hls_available():
+    return HLS_ENABLED and shutil.which(FFMPEG_BIN) is not None and shutil.which(FFPROBE_BIN) is not None
+
+
+@app.on_event("startup")
+def start_hls_packager():
+    if not HLS_ENABLED:
+        return
+    if not hls_available():
+        logger.warning("HLS packaging disabled: %s / %s not found; lectures stay pending", FFMPEG_BIN, FFPROBE_BIN)
+        return
+    os.makedirs(HLS_DIR, exist_ok=True)
+    hls_packager.start()
+
+
+@app.on_event("shutdown")
+def stop_hls_packager():
+    hls_packager.stop()
+
+
+@app.get("/lectures/{lecture_id}/hls/{asset_path:path}")
+def get_lecture_hls_asset(lecture_id: int, asset_path: str, request: Request):
+    """master.m3u8, <rendition>/index.m3u8 and the segments of a packaged lecture"""
+    match = _HLS_ASSET.match(asset_path)
+    if not match:
+        raise HTTPException(status_code=404, detail="Unknown HLS asset")
+    
+    path = os.path.join(HLS_DIR, str(lecture_id), *asset_path.split("/"))
+    if not os.path.isfile(path):
+        status = None
+        if schema_cache.has_column('lectures', 'hls_status'):
+            db = get_db()
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("SELECT hls_status FROM lectures WHERE id = %s", (lecture_id,))
+            row = cursor.fetchone()
+            cursor.close()
+            db.close()
+            status = row['hls_status'] if row else None
+        raise HTTPException(status_code=404, detail=f"HLS asset not available (hls_status: {status or 'none'})")
+    
+    media_type = 'application/vnd.apple.mpegurl' if path.endswith('.m3u8') else 'video/mp2t'
+    return range_file_response(request, path, media_type, cache_control=FILE_CACHE_POLICIES['lecture'])
+
+
+@app.get("/admin/hls")
+def get_hls_status():
+    """Packager state and the lectures per hls_status"""
+    try:
+        counts = {}
+        if schema_cache.has_column('lectures', 'hls_status'):
+            db = get_db()
+            cursor = db.cursor(dictionary=True)
+            cursor.execute("SELECT COALESCE(hls_status, 'none') AS status, COUNT(*) AS n FROM lectures GROUP BY hls_status")
+            counts = {row['status']: row['n'] for row in cursor.fetchall()}
+            cursor.close()
+            db.close()
+        return {
+            "success": True,
+            "enabled": HLS_ENABLED,
+            "ffmpeg_available": hls_available(),
+            "renditions": [name for name, _, _, _ in HLS_RENDITIONS],
+            "current_lecture": hls_packager.current,
+            "last_job": hls_packager.last_job,
+            "totals": hls_packager.totals,
+            "lectures": counts,
+        }
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error updating download count: {str(e)}")
+        return {"success": False, "error": str(e)}
 
 
+@app.post("/admin/hls/{lecture_id}/requeue")
+def requeue_lecture_hls(lecture_id: int):
+    try:
+        if not schema_cache.has_column('lectures', 'hls_status'):
+            return {"success": False, "error": "HLS columns missing: apply the schema migrations first"}
+        db = get_db()
+        cursor = db.cursor()
+        queue_hls_packaging(cursor, lecture_id)
+        updated = cursor.rowcount
+        db.commit()
+        cursor.close()
+        db.close()
+        if not updated:
+            return {"success": False, "error": "Lecture not found"}
+        hls_packager.wake()
+        return {"success": True, "message": "Lecture queued for HLS packaging"}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
 
 # ------------------- FILE PATH RESOLUTION FUNCTIONS FOR LECTURES -------------------
 
@@ -2092,59 +5668,10 @@ def fix_file_path(file_path, teacher_id):
     
     return path
 
-def search_file_by_name(filename, teacher_id):
-    """Enhanced file search with multiple strategies"""
-    if not filename:
-        return None
-    
-    search_dirs = [
-        f"uploads/lectures/teacher_{teacher_id}",
-        f"uploads/lectures/teacher_{teacher_id}_5674",
-        f"uploads/lectures/{teacher_id}",
-        "uploads/lectures",
-        f"uploads/lectures/teacher_{teacher_id.lower()}",
-        f"uploads/lectures/teacher_{teacher_id.upper()}",
-    ]
-    
-    # Strategy 1: Exact match
-    for search_dir in search_dirs:
-        if not os.path.exists(search_dir):
-            continue
-        
-        exact_path = os.path.join(search_dir, filename)
-        if os.path.exists(exact_path):
-            return exact_path
-    
-    # Strategy 2: Case-insensitive match
-    for search_dir in search_dirs:
-        if not os.path.exists(search_dir):
-            continue
-        
-        try:
-            for file in os.listdir(search_dir):
-                if file.lower() == filename.lower():
-                    return os.path.join(search_dir, file)
-        except OSError:
-            continue
-    
-    # Strategy 3: Partial filename match
-    filename_without_ext = os.path.splitext(filename)[0]
-    for search_dir in search_dirs:
-        if not os.path.exists(search_dir):
-            continue
-        
-        try:
-            for file in os.listdir(search_dir):
-                if filename_without_ext.lower() in file.lower():
-                    return os.path.join(search_dir, file)
-        except OSError:
-            continue
-    
-    return None
-
 def search_file_by_name(filename, teacher_id):
     """Search for file by name in teacher directories"""
     search_dirs = [
+        f"uploads/lectures/{teacher_id}",
         f"uploads/lectures/teacher_{teacher_id}",
         f"uploads/lectures/teacher_{teacher_id}_5674",
         "uploads/lectures",
@@ -2169,28 +5696,6 @@ def search_file_by_name(filename, teacher_id):
     
     return None
 
-def find_any_teacher_file(teacher_id):
-    """Find any file in teacher's directory as fallback"""
-    teacher_dirs = [
-        f"uploads/lectures/teacher_{teacher_id}",
-        f"uploads/lectures/teacher_{teacher_id}_5674",
-    ]
-    
-    for teacher_dir in teacher_dirs:
-        if os.path.exists(teacher_dir):
-            try:
-                files = os.listdir(teacher_dir)
-                if files:
-                    first_file = files[0]
-                    return {
-                        'path': os.path.join(teacher_dir, first_file),
-                        'name': first_file
-                    }
-            except OSError:
-                continue
-    
-    return None
-
 def search_with_different_extensions(filename, teacher_id):
     """Search for file with different extensions"""
     name_without_ext = os.path.splitext(filename)[0]
@@ -2213,56 +5718,112 @@ def search_with_different_extensions(filename, teacher_id):
     
     return None
 
-def find_actual_lecture_file(lecture, teacher_id):
-    """Find the actual file location with multiple fallback strategies"""
-    
-    # Strategy 1: Check the path from database
+def locate_lecture_file(lecture, teacher_id):
+    """Scan the candidate lecture directories for a lecture's file (slow path, fills the file index)"""
     db_path = lecture.get('file_path')
     db_filename = lecture.get('file_name')
     
+    # Strategy 1: Check the path from database (with common fixes)
     if db_path and db_path != 'NULL':
-        # Fix common path issues
         fixed_path = fix_file_path(db_path, teacher_id)
-        if fixed_path and os.path.exists(fixed_path):
-            return {
-                'exists': True,
-                'actual_path': fixed_path,
-                'url': f"http://localhost:8000/{fixed_path}",
-                'status': 'found'
-            }
+        if fixed_path and os.path.isfile(fixed_path):
+            return fixed_path
     
-    # Strategy 2: Search by filename in teacher directories
-    if db_filename and db_filename != 'NULL':
+    if db_filename and db_filename != 'NULL' and teacher_id:
+        # Strategy 2: Search by filename in teacher directories
         found_path = search_file_by_name(db_filename, teacher_id)
+        if found_path and os.path.isfile(found_path):
+            return found_path
+        
+        # Strategy 3: Same name with a different extension
+        found_path = search_with_different_extensions(db_filename, teacher_id)
         if found_path:
-            return {
-                'exists': True,
-                'actual_path': found_path,
-                'url': f"http://localhost:8000/{found_path}",
-                'status': 'found_by_search'
-            }
+            return found_path
+    
+    return None
+
+def locate_material_file(material, teacher_id):
+    """Find a material's file on disk (slow path, fills the file index)"""
+    file_path = material.get('file_path')
+    file_name = material.get('file_name')
+    
+    if file_path and file_path != 'NULL' and os.path.isfile(file_path):
+        return file_path
+    
+    if file_name and teacher_id:
+        alt_path = os.path.join(UPLOAD_DIR, "materials", teacher_id, file_name)
+        if os.path.isfile(alt_path):
+            return alt_path
+    
+    return None
+
+def locate_submission_file(submission):
+    """Find an assignment submission's file on disk (slow path, fills the file index)"""
+    file_path = submission.get('file_path')
+    file_name = submission.get('file_name') or ''
+    
+    base_path = os.path.join(UPLOAD_DIR, 'assignment_submissions')
+    possible_paths = [
+        file_path,
+        os.path.join(base_path, str(submission['id']), file_name) if file_name else None,
+        os.path.join(base_path, str(submission.get('assignment_id')), file_name) if file_name else None,
+        os.path.join(base_path, file_name) if file_name else None,
+    ]
+    
+    for path in possible_paths:
+        if path and os.path.isfile(path):
+            return path
+    
+    return None
+
+def current_file_row(table, item_id):
+    """A row's file columns as stored now: index locators outlive the row they were built from"""
+    db = get_db()
+    try:
+        cursor = db.cursor(dictionary=True)
+        extra = ", assignment_id" if table == "assignment_submissions" else ""
+        cursor.execute(f"SELECT id, file_path, file_name{extra} FROM {table} WHERE id = %s", (item_id,))
+        row = cursor.fetchone()
+        cursor.close()
+        return row
+    finally:
+        db.close()
+
+def lecture_file_locator(lecture_id, teacher_id, fallback=None):
+    return lambda: locate_lecture_file(current_file_row('lectures', lecture_id) or fallback or {}, teacher_id)
+
+def material_file_locator(material_id, teacher_id, fallback=None):
+    return lambda: locate_material_file(current_file_row('materials', material_id) or fallback or {}, teacher_id)
+
+def submission_file_locator(submission_id, fallback=None):
+    return lambda: locate_submission_file(
+        current_file_row('assignment_submissions', submission_id) or fallback or {'id': submission_id}
+    )
+
+def resolve_lecture_file(lecture, teacher_id):
+    return file_index.resolve('lecture', lecture['id'], lambda: locate_lecture_file(lecture, teacher_id),
+                              lecture_file_locator(lecture['id'], teacher_id, lecture))
+
+def resolve_material_file(material, teacher_id):
+    return file_index.resolve('material', material['id'], lambda: locate_material_file(material, teacher_id),
+                              material_file_locator(material['id'], teacher_id, material))
+
+def resolve_submission_file(submission):
+    return file_index.resolve('submission', submission['id'], lambda: locate_submission_file(submission),
+                              submission_file_locator(submission['id'], submission))
+
+def find_actual_lecture_file(lecture, teacher_id):
+    """Find the actual file location (served from the file location index)"""
+    actual_path = resolve_lecture_file(lecture, teacher_id)
     
-    # Strategy 3: Search any file in teacher directories (fallback)
-    any_file = find_any_teacher_file(teacher_id)
-    if any_file:
+    if actual_path:
         return {
             'exists': True,
-            'actual_path': any_file['path'],
-            'url': f"http://localhost:8000/{any_file['path']}",
-            'status': 'found_any_file'
+            'actual_path': actual_path,
+            'url': f"http://localhost:8000/{actual_path}",
+            'status': 'found'
         }
     
-    # Strategy 4: Check if file exists with different extensions
-    if db_filename:
-        found_with_extension = search_with_different_extensions(db_filename, teacher_id)
-        if found_with_extension:
-            return {
-                'exists': True,
-                'actual_path': found_with_extension,
-                'url': f"http://localhost:8000/{found_with_extension}",
-                'status': 'found_different_extension'
-            }
-    
     return {
         'exists': False,
         'actual_path': None,
@@ -2270,6 +5831,214 @@ def find_actual_lecture_file(lecture, teacher_id):
         'status': 'not_found'
     }
 
+# ------------------- FILE LOCATION INDEX -------------------
+
+FILE_INDEX_WATCH_INTERVAL = float(os.getenv("FILE_INDEX_WATCH_INTERVAL", "5"))  # seconds between scans of uploads/
+
+
+class FileLocationIndex:
+    """
+    Maps (kind, id) for lectures, materials and submissions to a verified path on disk.
+    Lookups are a dict read; the directory scans only happen when an entry is first
+    resolved, and a background watcher re-verifies entries whose directories changed.
+    Directories under `skip` are never watched: they hold generated output that
+    changes constantly and never holds an indexed file.
+    """
+
+    def __init__(self, root, skip=()):
+        self.root = root
+        self.skip = {os.path.normpath(os.path.abspath(path)) for path in skip}
+        self._paths = {}        # (kind, id) -> path
+        self._missing = set()   # keys whose file could not be found (negative cache)
+        self._locators = {}     # (kind, id) -> callable doing the slow lookup
+        self._by_dir = {}       # normalized directory -> set of keys stored there
+        self._lock = threading.Lock()
+        self._dir_mtimes = {}
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def _index_path(self, key, path):
+        directory = os.path.normpath(os.path.dirname(os.path.abspath(path)))
+        self._paths[key] = path
+        self._by_dir.setdefault(directory, set()).add(key)
+        self._missing.discard(key)
+
+    def _unindex(self, key):
+        path = self._paths.pop(key, None)
+        if path is not None:
+            directory = os.path.normpath(os.path.dirname(os.path.abspath(path)))
+            keys = self._by_dir.get(directory)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._by_dir[directory]
+
+    def lookup(self, kind, item_id):
+        return self._paths.get((kind, item_id))
+
+    def resolve(self, kind, item_id, locate, relocate=None):
+        """
+        `locate` finds the file from the row the caller holds; `relocate` (kept for the
+        watcher's retries, defaults to `locate`) should re-read the row, since its
+        file_path can change after this call (e.g. moved into the blob store).
+        """
+        key = (kind, item_id)
+        path = self._paths.get(key)
+        if path is not None or key in self._missing:
+            return path
+        
+        path = locate()
+        with self._lock:
+            self._locators[key] = relocate or locate
+            if path:
+                self._index_path(key, path)
+            else:
+                self._missing.add(key)
+        return path
+
+    def put(self, kind, item_id, path, locate=None):
+        key = (kind, item_id)
+        with self._lock:
+            self._unindex(key)
+            if locate is not None:
+                self._locators[key] = locate
+            self._index_path(key, path)
+
+    def remove(self, kind, item_id):
+        key = (kind, item_id)
+        with self._lock:
+            self._unindex(key)
+            self._missing.discard(key)
+            self._locators.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            counts = {}
+            for kind, _ in self._paths:
+                counts[kind] = counts.get(kind, 0) + 1
+            return {
+                "indexed": counts,
+                "missing": len(self._missing),
+                "watched_directories": len(self._dir_mtimes),
+            }
+
+    # --- startup build ---
+
+    def build(self, db):
+        cursor = db.cursor(dictionary=True)
+        
+        cursor.execute(
+            """SELECT l.id, l.file_path, l.file_name, u.userId as teacher_userId
+               FROM lectures l
+               LEFT JOIN users u ON l.teacher_id = u.id
+               WHERE l.file_path IS NOT NULL OR l.file_name IS NOT NULL"""
+        )
+        for lecture in cursor.fetchall():
+            resolve_lecture_file(lecture, lecture['teacher_userId'])
+        
+        cursor.execute(
+            """SELECT m.id, m.file_path, m.file_name, u.userId as teacher_userId
+               FROM materials m
+               LEFT JOIN users u ON m.teacher_id = u.id
+               WHERE m.file_path IS NOT NULL OR m.file_name IS NOT NULL"""
+        )
+        for material in cursor.fetchall():
+            resolve_material_file(material, material['teacher_userId'])
+        
+        cursor.execute(
+            """SELECT id, assignment_id, file_path, file_name
+               FROM assignment_submissions
+               WHERE file_path IS NOT NULL OR file_name IS NOT NULL"""
+        )
+        for submission in cursor.fetchall():
+            resolve_submission_file(submission)
+        
+        cursor.close()
+        self._dir_mtimes = self._snapshot_dirs()
+
+    # --- filesystem watcher ---
+
+    def _snapshot_dirs(self):
+        mtimes = {}
+        for root, dirs, _files in os.walk(self.root):
+            dirs[:] = [d for d in dirs if os.path.normpath(os.path.abspath(os.path.join(root, d))) not in self.skip]
+            try:
+                mtimes[os.path.normpath(os.path.abspath(root))] = os.stat(root).st_mtime_ns
+            except OSError:
+                continue
+        return mtimes
+
+    def refresh(self):
+        """Re-verify entries in directories that changed since the last scan"""
+        snapshot = self._snapshot_dirs()
+        changed = {d for d, m in snapshot.items() if self._dir_mtimes.get(d) != m}
+        changed |= set(self._dir_mtimes) - set(snapshot)
+        self._dir_mtimes = snapshot
+        if not changed:
+            return 0
+        
+        with self._lock:
+            stale = [key for d in changed for key in self._by_dir.get(d, ())
+                     if not os.path.isfile(self._paths[key])]
+            for key in stale:
+                self._unindex(key)
+            # Anything unresolved may have just appeared; anything stale may have moved
+            retry = [(key, self._locators.get(key)) for key in list(self._missing) + stale]
+            self._missing.difference_update(k for k, _ in retry)
+        
+        for key, locate in retry:
+            path = locate() if locate else None
+            with self._lock:
+                if path:
+                    self._index_path(key, path)
+                else:
+                    self._missing.add(key)
+        return len(changed)
+
+    def _watch(self):
+        while not self._stop.wait(FILE_INDEX_WATCH_INTERVAL):
+            try:
+                self.refresh()
+            except Exception as e:
+                logger.warning("File index refresh failed: %s", e)
+
+    def start_watcher(self):
+        if self._watcher is None:
+            self._stop.clear()
+            self._watcher = threading.Thread(target=self._watch, name="file-index-watcher", daemon=True)
+            self._watcher.start()
+
+    def stop_watcher(self):
+        self._stop.set()
+        self._watcher = None
+
+
+file_index = FileLocationIndex(UPLOAD_DIR, skip=(HLS_DIR, UPLOAD_SESSIONS_DIR))
+
+
+@app.on_event("startup")
+def build_file_index():
+    try:
+        db = get_db()
+        try:
+            file_index.build(db)
+        finally:
+            db.close()
+    except Exception as e:
+        logger.warning("File index build skipped: %s", e)
+    file_index.start_watcher()
+
+
+@app.on_event("shutdown")
+def stop_file_index():
+    file_index.stop_watcher()
+
+
+@app.get("/admin/file-index")
+def get_file_index_status():
+    """Entries in the file location index"""
+    return {"success": True, "file_index": file_index.stats()}
+
 # ------------------- ENHANCED LECTURE ENDPOINTS -------------------
 
 # Replace your existing get_lectures endpoint with this enhanced version
@@ -2318,7 +6087,7 @@ def get_lectures(teacher_userId: str, subject_name: str):
 
 # NEW ENDPOINT: Enhanced lecture streaming with file resolution
 @app.get("/lectures/{lecture_id}/stream")
-def stream_lecture_file(lecture_id: int):
+def stream_lecture_file(lecture_id: int, request: Request):
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
@@ -2346,10 +6115,10 @@ def stream_lecture_file(lecture_id: int):
         cursor.close()
         db.close()
         
-        return FileResponse(
-            file_info['actual_path'],
-            media_type='application/octet-stream',
-            filename=lecture.get('file_name') or f"lecture_{lecture_id}"
+        return range_file_response(
+            request, file_info['actual_path'], 'application/octet-stream',
+            lecture.get('file_name') or f"lecture_{lecture_id}", 'attachment',
+            cache_control=FILE_CACHE_POLICIES['lecture']
         )
         
     except HTTPException:
@@ -2359,7 +6128,7 @@ def stream_lecture_file(lecture_id: int):
 
 # NEW ENDPOINT: Enhanced lecture download with file resolution
 @app.get("/lectures/{lecture_id}/download")
-def download_lecture_file(lecture_id: int):
+def download_lecture_file(lecture_id: int, request: Request):
     """Enhanced download endpoint with file existence check"""
     try:
         db = get_db()
@@ -2385,21 +6154,18 @@ def download_lecture_file(lecture_id: int):
                 detail=f"Lecture file not found. Status: {file_info['status']}"
             )
         
-        # Update download count
-        cursor.execute(
-            "UPDATE lectures SET downloads = downloads + 1 WHERE id = %s",
-            (lecture_id,)
-        )
-        db.commit()
-        
         cursor.close()
         db.close()
         
-        return FileResponse(
-            file_info['actual_path'],
-            media_type='application/octet-stream',
-            filename=lecture.get('file_name') or f"lecture_{lecture_id}"
+        response = range_file_response(
+            request, file_info['actual_path'], 'application/octet-stream',
+            lecture.get('file_name') or f"lecture_{lecture_id}", 'attachment',
+            cache_control=FILE_CACHE_POLICIES['lecture']
         )
+        # Update download count (buffered, written behind)
+        if full_download(request, response):
+            download_counters.add('lectures', lecture_id)
+        return response
         
     except HTTPException:
         raise
@@ -2470,7 +6236,7 @@ def read_root():
 # ------------------- ENHANCED DOWNLOAD ENDPOINTS -------------------
 
 @app.get("/download/lecture/{lecture_id}")
-def download_lecture(lecture_id: int):
+def download_lecture(lecture_id: int, request: Request):
     """Enhanced lecture download with proper file resolution"""
     try:
         db = get_db()
@@ -2496,32 +6262,22 @@ def download_lecture(lecture_id: int):
         if not file_path or file_path == 'NULL':
             raise HTTPException(status_code=404, detail="No file attached to this lecture")
         
-        # Fix common file path issues
-        fixed_path = fix_file_path(file_path, teacher_id)
-        
-        if not fixed_path or not os.path.exists(fixed_path):
-            # Try to find the file using alternative methods
-            found_path = search_file_by_name(file_name, teacher_id)
-            if found_path:
-                fixed_path = found_path
-            else:
-                raise HTTPException(status_code=404, detail="Lecture file not found on server")
+        fixed_path = resolve_lecture_file(lecture, teacher_id)
+        if not fixed_path:
+            raise HTTPException(status_code=404, detail="Lecture file not found on server")
         
-        # Update download count
-        cursor.execute(
-            "UPDATE lectures SET downloads = downloads + 1 WHERE id = %s",
-            (lecture_id,)
-        )
-        db.commit()
         cursor.close()
         db.close()
         
         # Return file for download
-        return FileResponse(
-            fixed_path,
-            media_type='application/octet-stream',
-            filename=file_name
+        response = range_file_response(
+            request, fixed_path, 'application/octet-stream', file_name, 'attachment',
+            cache_control=FILE_CACHE_POLICIES['lecture']
         )
+        # Update download count (buffered, written behind)
+        if full_download(request, response):
+            download_counters.add('lectures', lecture_id)
+        return response
         
     except HTTPException:
         raise
@@ -2530,7 +6286,7 @@ def download_lecture(lecture_id: int):
 
 # Similar endpoint for materials
 @app.get("/download/material/{material_id}")
-def download_material(material_id: int):
+def download_material(material_id: int, request: Request):
     """Download material file"""
     try:
         db = get_db()
@@ -2556,32 +6312,22 @@ def download_material(material_id: int):
         if not file_path or file_path == 'NULL':
             raise HTTPException(status_code=404, detail="No file attached to this material")
         
-        # Fix file path if needed
-        fixed_path = file_path
-        if not os.path.exists(fixed_path):
-            # Try alternative path resolution for materials
-            material_dir = os.path.join(UPLOAD_DIR, "materials", teacher_id)
-            alt_path = os.path.join(material_dir, file_name)
-            if os.path.exists(alt_path):
-                fixed_path = alt_path
-            else:
-                raise HTTPException(status_code=404, detail="Material file not found on server")
+        fixed_path = resolve_material_file(material, teacher_id)
+        if not fixed_path:
+            raise HTTPException(status_code=404, detail="Material file not found on server")
         
-        # Update download count
-        cursor.execute(
-            "UPDATE materials SET downloads = downloads + 1 WHERE id = %s",
-            (material_id,)
-        )
-        db.commit()
         cursor.close()
         db.close()
         
         # Return file for download
-        return FileResponse(
-            fixed_path,
-            media_type='application/octet-stream',
-            filename=file_name
+        response = range_file_response(
+            request, fixed_path, 'application/octet-stream', file_name, 'attachment',
+            cache_control=FILE_CACHE_POLICIES['material']
         )
+        # Update download count (buffered, written behind)
+        if full_download(request, response):
+            download_counters.add('materials', material_id)
+        return response
         
     except HTTPException:
         raise
@@ -2822,7 +6568,7 @@ def test_download_lecture(lecture_id: int):
 # ------------------- VIEW LECTURE ENDPOINT -------------------
 
 @app.get("/view/lecture/{lecture_id}")
-def view_lecture(lecture_id: int):
+def view_lecture(lecture_id: int, request: Request):
     """View lecture file in browser (for supported file types)"""
     try:
         db = get_db()
@@ -2848,16 +6594,9 @@ def view_lecture(lecture_id: int):
         if not file_path or file_path == 'NULL':
             raise HTTPException(status_code=404, detail="No file attached to this lecture")
         
-        # Fix common file path issues
-        fixed_path = fix_file_path(file_path, teacher_id)
-        
-        if not fixed_path or not os.path.exists(fixed_path):
-            # Try to find the file using alternative methods
-            found_path = search_file_by_name(file_name, teacher_id)
-            if found_path:
-                fixed_path = found_path
-            else:
-                raise HTTPException(status_code=404, detail="Lecture file not found on server")
+        fixed_path = resolve_lecture_file(lecture, teacher_id)
+        if not fixed_path:
+            raise HTTPException(status_code=404, detail="Lecture file not found on server")
         
         # Determine content type based on file extension
         def get_content_type(file_path):
@@ -2895,6 +6634,7 @@ def view_lecture(lecture_id: int):
                 "UPDATE lectures SET views = COALESCE(views, 0) + 1 WHERE id = %s",
                 (lecture_id,)
             )
+            bump_teacher_stats(cursor, 'lectures', lecture_id, lecture_views=1)
             db.commit()
         except:
             # If views column doesn't exist, continue without error
@@ -2904,10 +6644,9 @@ def view_lecture(lecture_id: int):
         db.close()
         
         # Return file for viewing
-        return FileResponse(
-            fixed_path,
-            media_type=content_type,
-            filename=file_name
+        return range_file_response(
+            request, fixed_path, content_type, file_name,
+            cache_control=FILE_CACHE_POLICIES['lecture']
         )
         
     except HTTPException:
@@ -2985,7 +6724,7 @@ def test_video_file(lecture_id: int):
         return {"success": False, "error": str(e)}
 
 @app.get("/stream/lecture/{lecture_id}")
-async def stream_lecture_file(lecture_id: int, request: Request):
+def stream_lecture_file(lecture_id: int, request: Request):
     """Stream lecture file with proper video headers for HTML5 video player"""
     try:
         db = get_db()
@@ -3009,22 +6748,11 @@ async def stream_lecture_file(lecture_id: int, request: Request):
         file_name = lecture.get('file_name')
         
         # Find the actual file
-        fixed_path = fix_file_path(file_path, teacher_id)
-        actual_file_path = None
-        
-        if fixed_path and os.path.exists(fixed_path) and os.path.isfile(fixed_path):
-            actual_file_path = fixed_path
-        else:
-            found_path = search_file_by_name(file_name, teacher_id)
-            if found_path and os.path.exists(found_path) and os.path.isfile(found_path):
-                actual_file_path = found_path
+        actual_file_path = resolve_lecture_file(lecture, teacher_id)
         
         if not actual_file_path:
             raise HTTPException(status_code=404, detail="Lecture file not found")
         
-        # Get file size for range requests (video streaming)
-        file_size = os.path.getsize(actual_file_path)
-        
         # Determine content type
         def get_content_type(file_path):
             extension = os.path.splitext(file_path)[1].lower()
@@ -3041,57 +6769,12 @@ async def stream_lecture_file(lecture_id: int, request: Request):
         
         content_type = get_content_type(actual_file_path)
         
-        # Check if range header is present (for video seeking)
-        range_header = request.headers.get('Range')
-        
-        if range_header:
-            # Handle range requests for video streaming
-            range_match = re.match(r'bytes=(\d+)-(\d+)?', range_header)
-            if range_match:
-                start = int(range_match.group(1))
-                end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-                
-                if start >= file_size:
-                    raise HTTPException(status_code=416, detail="Range not satisfiable")
-                
-                end = min(end, file_size - 1)
-                length = end - start + 1
-                
-                # Read the specific byte range
-                with open(actual_file_path, 'rb') as video_file:
-                    video_file.seek(start)
-                    data = video_file.read(length)
-                
-                # Return partial content response
-                response = Response(
-                    content=data,
-                    status_code=206,
-                    media_type=content_type,
-                    headers={
-                        'Content-Range': f'bytes {start}-{end}/{file_size}',
-                        'Accept-Ranges': 'bytes',
-                        'Content-Length': str(length),
-                        'Content-Disposition': f'inline; filename="{file_name}"'
-                    }
-                )
-                cursor.close()
-                db.close()
-                return response
-        
-        # If no range header, return the entire file
         cursor.close()
         db.close()
         
-        return FileResponse(
-            actual_file_path,
-            media_type=content_type,
-            filename=file_name,
-            headers={
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(file_size),
-                'Content-Disposition': f'inline; filename="{file_name}"'
-            }
-        )
+        # Range / If-Range / multi-range handling streams the file in bounded chunks
+        return range_file_response(request, actual_file_path, content_type, file_name,
+                                   cache_control=FILE_CACHE_POLICIES['lecture'])
         
     except HTTPException:
         raise
@@ -3180,98 +6863,6 @@ def debug_lecture_file(lecture_id: int):
         
     except Exception as e:
         return {"success": False, "error": str(e)}
-
-
-    """Stream lecture file with proper video headers"""
-    try:
-        db = get_db()
-        cursor = db.cursor(dictionary=True)
-        
-        cursor.execute(
-            """SELECT l.*, u.userId as teacher_userId 
-               FROM lectures l 
-               JOIN users u ON l.teacher_id = u.id 
-               WHERE l.id = %s""", 
-            (lecture_id,)
-        )
-        lecture = cursor.fetchone()
-        
-        if not lecture:
-            raise HTTPException(status_code=404, detail="Lecture not found")
-        
-        teacher_id = lecture['teacher_userId']
-        file_path = lecture.get('file_path')
-        file_name = lecture.get('file_name')
-        
-        # Find the actual file
-        fixed_path = fix_file_path(file_path, teacher_id)
-        actual_file_path = None
-        
-        if fixed_path and os.path.exists(fixed_path) and os.path.isfile(fixed_path):
-            actual_file_path = fixed_path
-        else:
-            found_path = search_file_by_name(file_name, teacher_id)
-            if found_path and os.path.exists(found_path) and os.path.isfile(found_path):
-                actual_file_path = found_path
-        
-        if not actual_file_path:
-            raise HTTPException(status_code=404, detail="Lecture file not found")
-        
-        # Get file size for range requests (video streaming)
-        file_size = os.path.getsize(actual_file_path)
-        
-        # Check if range header is present (for video seeking)
-        range_header = request.headers.get('Range')
-        
-        if range_header:
-            # Handle range requests for video streaming
-            range_match = re.match(r'bytes=(\d+)-(\d+)?', range_header)
-            if range_match:
-                start = int(range_match.group(1))
-                end = int(range_match.group(2)) if range_match.group(2) else file_size - 1
-                
-                if start >= file_size:
-                    raise HTTPException(status_code=416, detail="Range not satisfiable")
-                
-                end = min(end, file_size - 1)
-                length = end - start + 1
-                
-                with open(actual_file_path, 'rb') as video_file:
-                    video_file.seek(start)
-                    data = video_file.read(length)
-                
-                response = Response(
-                    content=data,
-                    status_code=206,
-                    media_type='video/mp4',
-                    headers={
-                        'Content-Range': f'bytes {start}-{end}/{file_size}',
-                        'Accept-Ranges': 'bytes',
-                        'Content-Length': str(length),
-                        'Content-Disposition': f'inline; filename="{file_name}"'
-                    }
-                )
-                return response
-        
-        # Regular file response
-        cursor.close()
-        db.close()
-        
-        return FileResponse(
-            actual_file_path,
-            media_type='video/mp4',
-            filename=file_name,
-            headers={
-                'Accept-Ranges': 'bytes',
-                'Content-Length': str(file_size),
-                'Content-Disposition': f'inline; filename="{file_name}"'
-            }
-        )
-        
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error streaming lecture: {str(e)}")
     
 #make comprehensice mcqs system
 
@@ -3318,20 +6909,16 @@ class QuestionCreate(BaseModel):
 
 
 @app.post("/create_quiz_with_questions")
-async def create_quiz_with_questions(quiz_data: QuizCreate):
+def create_quiz_with_questions(quiz_data: QuizCreate):
     """Create a quiz with all questions and options - WITH SUBJECT VALIDATION - COMPLETE VERSION"""
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"=== STARTING QUIZ CREATION ===")
-        print(f"Teacher ID: {quiz_data.teacher_id}")
-        print(f"Quiz title: {quiz_data.title}")
-        print(f"Subject: {quiz_data.subject_name}")
-        print(f"Questions received: {len(quiz_data.questions)}")
-        
-        # Log the full structure to debug
-        print(f"Full quiz data: {quiz_data.dict()}")
+        logger.debug(
+            "Creating quiz %r for teacher %s (%s, %d questions)",
+            quiz_data.title, quiz_data.teacher_id, quiz_data.subject_name, len(quiz_data.questions)
+        )
         
         # Get teacher's numeric ID and assigned subject
         cursor.execute(
@@ -3341,7 +6928,7 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
         teacher = cursor.fetchone()
         
         if not teacher:
-            print(f"ERROR: Teacher not found with userId: {quiz_data.teacher_id}")
+            logger.warning("Quiz creation: teacher not found: %s", quiz_data.teacher_id)
             cursor.close()
             db.close()
             raise HTTPException(
@@ -3351,8 +6938,6 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
         
         numeric_teacher_id = teacher['id']
         teacher_subject = teacher.get('subject', '')
-        print(f"✓ Found teacher: {teacher['fullName']} (ID: {numeric_teacher_id})")
-        print(f"✓ Teacher's assigned subject: {teacher_subject}")
         
         # ⚠️ SUBJECT VALIDATION: Check if teacher can create quiz for this subject
         if teacher_subject:
@@ -3374,10 +6959,9 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
                     detail=f"Not authorized. You can only create quizzes for your assigned subjects: {teacher_subject}"
                 )
         else:
-            print(f"⚠️ Teacher has no assigned subjects")
+            logger.debug("Teacher %s has no assigned subjects", quiz_data.teacher_id)
         
         # ✅ CREATE QUIZ - ADD THIS PART BACK!
-        print(f"Creating quiz: {quiz_data.title}")
         cursor.execute(
             """INSERT INTO quizzes 
             (teacher_id, subject_name, title, description, start_date, end_date, 
@@ -3396,19 +6980,13 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
         )
         
         quiz_id = cursor.lastrowid
-        print(f"✓ Quiz created with ID: {quiz_id}")
+        bump_teacher_stats(cursor, 'quizzes', quiz_id, quizzes=1, quizzes_published=1 if quiz_data.is_published else 0)
         
         # Add questions and options
         questions_added = 0
         options_added = 0
         
         for q_index, question in enumerate(quiz_data.questions):
-            print(f"\nProcessing question {q_index + 1}/{len(quiz_data.questions)}")
-            print(f"  Question text: {question.question_text[:50]}...")
-            print(f"  Question type: {question.question_type}")
-            print(f"  Marks: {question.marks}")
-            print(f"  Options: {len(question.options)}")
-            
             # Get correct answer
             correct_answer = question.correct_answer
             if not correct_answer and question.options:
@@ -3416,7 +6994,6 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
                 for opt in question.options:
                     if opt.is_correct:
                         correct_answer = opt.option_text
-                        print(f"  Found correct answer from options: {correct_answer[:50]}...")
                         break
             
             # Insert question
@@ -3436,7 +7013,6 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
             
             question_id = cursor.lastrowid
             questions_added += 1
-            print(f"  ✓ Question added with ID: {question_id}")
             
             # Add options for this question
             for opt_index, option in enumerate(question.options):
@@ -3451,15 +7027,10 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
                      option.is_correct)
                 )
                 options_added += 1
-                if option.is_correct:
-                    print(f"    ✓ Option {opt_index + 1}: {option.option_text[:30]}... (CORRECT)")
-                else:
-                    print(f"    ✓ Option {opt_index + 1}: {option.option_text[:30]}...")
         
         db.commit()
-        print(f"\n=== QUIZ CREATION COMPLETE ===")
-        print(f"Total questions added: {questions_added}")
-        print(f"Total options added: {options_added}")
+        answer_key_cache.invalidate(quiz_id)
+        logger.info("Quiz %s created: %d questions, %d options", quiz_id, questions_added, options_added)
         
         cursor.close()
         db.close()
@@ -3477,9 +7048,7 @@ async def create_quiz_with_questions(quiz_data: QuizCreate):
         raise e  # Re-raise HTTP exceptions
     except Exception as e:
         error_msg = f"Error creating quiz: {str(e)}"
-        print(f"✗ ERROR: {error_msg}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("%s", error_msg)
         
         # Close connections if they exist
         try:
@@ -3606,8 +7175,11 @@ def start_quiz_attempt(quiz_id: int, student_userId: str):
         )
         
         attempt_id = cursor.lastrowid
+        bump_counter(cursor, 'quizzes', 'attempts', quiz_id, 1)
+        bump_teacher_stats(cursor, 'quizzes', quiz_id, quiz_attempts=1)
         
         db.commit()
+        update_student_rollup(db, numeric_student_id)
         cursor.close()
         db.close()
         
@@ -3707,7 +7279,11 @@ def finish_quiz_attempt(attempt_id: int, time_taken_minutes: int):
             (total_score, time_taken_minutes, attempt_id)
         )
         
+        cursor.execute("SELECT student_id FROM student_attempts WHERE id = %s", (attempt_id,))
+        attempt = cursor.fetchone()
         db.commit()
+        if attempt:
+            update_student_rollup(db, attempt['student_id'])
         
         # Get attempt details
         cursor.execute(
@@ -3842,6 +7418,7 @@ def publish_quiz(quiz_id: int, teacher_userId: str):
         
         cursor.execute("SELECT is_published FROM quizzes WHERE id = %s", (quiz_id,))
         new_status = cursor.fetchone()['is_published']
+        bump_teacher_stats(cursor, 'quizzes', quiz_id, quizzes_published=1 if new_status else -1)
         
         db.commit()
         cursor.close()
@@ -3866,7 +7443,7 @@ def delete_quiz(quiz_id: int, teacher_userId: str):
         
         # Verify teacher owns this quiz
         cursor.execute(
-            """SELECT q.id FROM quizzes q 
+            """SELECT q.id, q.teacher_id FROM quizzes q 
                JOIN users u ON q.teacher_id = u.id 
                WHERE u.userId = %s AND q.id = %s""",
             (teacher_userId, quiz_id)
@@ -3883,6 +7460,9 @@ def delete_quiz(quiz_id: int, teacher_userId: str):
         cursor.close()
         db.close()
         
+        answer_key_cache.invalidate(quiz_id)
+        teacher_stats.mark_dirty(quiz['teacher_id'])
+        
         return {"message": "Quiz deleted successfully", "success": True}
         
     except Exception as e:
@@ -4042,22 +7622,123 @@ from fastapi.responses import JSONResponse
 from datetime import datetime
 import traceback
 
+# ------------------- QUIZ GRADING ENGINE -------------------
+
+ANSWER_KEY_TTL_SECONDS = float(os.getenv("ANSWER_KEY_TTL_SECONDS", "600"))
+
+
+class QuizAnswerKeyCache:
+    """
+    Per-quiz answer keys: {question_id: {"marks", "correct_answer", "options": {option_id: is_correct}}}.
+    Loaded with two queries on first use and dropped whenever the quiz changes.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    def get(self, cursor, quiz_id):
+        with self._lock:
+            entry = self._keys.get(quiz_id)
+        if entry and time.monotonic() - entry[0] < self.ttl:
+            return entry[1]
+        
+        answer_key = self._load(cursor, quiz_id)
+        with self._lock:
+            self._keys[quiz_id] = (time.monotonic(), answer_key)
+        return answer_key
+
+    def invalidate(self, quiz_id):
+        with self._lock:
+            self._keys.pop(quiz_id, None)
+
+    @staticmethod
+    def _load(cursor, quiz_id):
+        cursor.execute("""
+            SELECT id, marks, correct_answer, question_type 
+            FROM questions 
+            WHERE quiz_id = %s
+        """, (quiz_id,))
+        answer_key = {
+            q['id']: {
+                "marks": float(q['marks'] or 0),
+                "correct_answer": (q['correct_answer'] or '').strip().lower(),
+                "question_type": q['question_type'],
+                "options": {},
+            }
+            for q in cursor.fetchall()
+        }
+        
+        cursor.execute("""
+            SELECT o.id, o.question_id, o.is_correct 
+            FROM options o 
+            JOIN questions q ON o.question_id = q.id 
+            WHERE q.quiz_id = %s
+        """, (quiz_id,))
+        for option in cursor.fetchall():
+            question = answer_key.get(option['question_id'])
+            if question is not None:
+                question["options"][option['id']] = bool(option['is_correct'])
+        
+        return answer_key
+
+
+answer_key_cache = QuizAnswerKeyCache(ANSWER_KEY_TTL_SECONDS)
+
+
+def _as_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def grade_quiz_answers(answer_key, answers):
+    """
+    Grade submitted answers against an answer key in memory.
+    Returns (rows, total_marks) where rows are
+    (question_id, selected_option_id, answer_text, is_correct, marks_obtained).
+    Answers for questions outside the quiz are skipped.
+    """
+    rows = []
+    total_marks = 0.00
+    
+    for answer in answers:
+        question_id = _as_id(answer.get('question_id'))
+        question = answer_key.get(question_id)
+        if question is None:
+            continue
+        
+        selected_option_id = _as_id(answer.get('selected_option_id')) if answer.get('selected_option_id') else None
+        answer_text = answer.get('answer_text', '').strip() if answer.get('answer_text') else None
+        
+        is_correct = False
+        if selected_option_id:
+            # MCQ / True False: an option from another question counts as incorrect
+            is_correct = question["options"].get(selected_option_id, False)
+            if selected_option_id not in question["options"]:
+                # ...and isn't stored: its FK would fail and abort the whole batch, attempt included
+                selected_option_id = None
+        elif answer_text and question["correct_answer"]:
+            is_correct = answer_text.lower() == question["correct_answer"]
+        
+        marks_obtained = question["marks"] if is_correct else 0.00
+        total_marks += marks_obtained
+        rows.append((question_id, selected_option_id, answer_text, is_correct, marks_obtained))
+    
+    return rows, total_marks
+
+
 @app.post("/student/quiz/{quiz_id}/submit")
-async def submit_student_quiz(quiz_id: int, request_data: dict):
+def submit_student_quiz(quiz_id: int, request_data: dict):
     """Submit a quiz attempt - COMPLETELY FIXED VERSION"""
     try:
-        print(f"\n{'='*60}")
-        print("📝 QUIZ SUBMISSION REQUEST RECEIVED")
-        print(f"{'='*60}")
-        
         # Extract data from request
         student_userId = request_data.get('student_userId')
         answers = request_data.get('answers', [])
         
-        print(f"Quiz ID: {quiz_id}")
-        print(f"Student UserId: {student_userId}")
-        print(f"Number of answers: {len(answers)}")
-        print(f"Answers data: {answers}")
+        logger.debug("Quiz submission: quiz=%s student=%s answers=%d", quiz_id, student_userId, len(answers))
         
         # Validate input
         if not student_userId:
@@ -4100,7 +7781,6 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
             )
         
         numeric_student_id = student['id']
-        print(f"✓ Student found: {student['fullName']} (ID: {numeric_student_id})")
         
         # 2. Get quiz
         cursor.execute("""
@@ -4123,10 +7803,6 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
                 }
             )
         
-        print(f"✓ Quiz found: {quiz['title']}")
-        print(f"  Subject: {quiz['subject_name']}")
-        print(f"  Published: {quiz['is_published']}")
-        
         # Check if quiz is published
         if not quiz.get('is_published'):
             cursor.close()
@@ -4169,16 +7845,8 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
                 }
             )
         
-        # 3. Get quiz questions for validation
-        cursor.execute("""
-            SELECT id, marks, correct_answer, question_type 
-            FROM questions 
-            WHERE quiz_id = %s
-        """, (quiz_id,))
-        quiz_questions = cursor.fetchall()
-        question_ids = [q['id'] for q in quiz_questions]
-        
-        print(f"✓ Found {len(quiz_questions)} questions for quiz")
+        # 3. Load the answer key (cached per quiz)
+        answer_key = answer_key_cache.get(cursor, quiz_id)
         
         # 4. Create quiz attempt
         try:
@@ -4189,12 +7857,11 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
             """, (numeric_student_id, quiz_id, 0.00))
             
             attempt_id = cursor.lastrowid
-            print(f"✓ Created attempt: ID {attempt_id}")
             
         except Exception as e:
             cursor.close()
             db.close()
-            print(f"✗ Error creating attempt: {str(e)}")
+            logger.error("Failed to create attempt for quiz %s: %s", quiz_id, e)
             return JSONResponse(
                 status_code=500,
                 content={
@@ -4204,83 +7871,16 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
                 }
             )
         
-        # 5. Process each answer
-        total_marks = 0.00
-        processed_count = 0
+        # 5. Grade all answers in memory and store them in one batch
+        graded_rows, total_marks = grade_quiz_answers(answer_key, answers)
+        processed_count = len(graded_rows)
         
-        for i, answer in enumerate(answers):
-            question_id = answer.get('question_id')
-            selected_option_id = answer.get('selected_option_id')
-            answer_text = answer.get('answer_text', '').strip() if answer.get('answer_text') else None
-            
-            print(f"\n  Processing answer {i + 1}:")
-            print(f"    Question ID: {question_id}")
-            print(f"    Option ID: {selected_option_id}")
-            print(f"    Answer Text: {answer_text}")
-            
-            # Validate question exists in this quiz
-            if question_id not in question_ids:
-                print(f"    ⚠️  Question {question_id} not in this quiz. Skipping.")
-                continue
-            
-            # Get question details
-            question = next((q for q in quiz_questions if q['id'] == question_id), None)
-            if not question:
-                print(f"    ⚠️  Question details not found. Skipping.")
-                continue
-            
-            is_correct = False
-            marks_obtained = 0.00
-            
-            # Handle MCQ/True False
-            if selected_option_id:
-                print(f"    📋 Checking option {selected_option_id}...")
-                cursor.execute("""
-                    SELECT is_correct FROM options 
-                    WHERE id = %s AND question_id = %s
-                """, (selected_option_id, question_id))
-                
-                option = cursor.fetchone()
-                if option:
-                    is_correct = bool(option['is_correct'])
-                    marks_obtained = float(question['marks']) if is_correct else 0.00
-                    print(f"    {'✅' if is_correct else '❌'} Option result: correct={is_correct}, marks={marks_obtained}")
-                else:
-                    print(f"    ⚠️  Option not found, treating as incorrect")
-            
-            # Handle short answer
-            elif answer_text:
-                print(f"    📝 Checking short answer...")
-                correct_answer = question.get('correct_answer', '').strip().lower() if question.get('correct_answer') else ''
-                if correct_answer:
-                    is_correct = answer_text.lower() == correct_answer
-                    marks_obtained = float(question['marks']) if is_correct else 0.00
-                    print(f"    {'✅' if is_correct else '❌'} Short answer: correct={is_correct}, marks={marks_obtained}")
-                else:
-                    print(f"    ⚠️  No correct answer defined for this question")
-            
-            # Insert answer
-            try:
-                cursor.execute("""
-                    INSERT INTO student_answers 
-                    (attempt_id, question_id, selected_option_id, answer_text, is_correct, marks_obtained) 
-                    VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    attempt_id,
-                    question_id,
-                    selected_option_id if selected_option_id else None,
-                    answer_text,
-                    is_correct,
-                    marks_obtained
-                ))
-                
-                total_marks += marks_obtained
-                processed_count += 1
-                print(f"    ✓ Answer saved successfully")
-                
-            except Exception as insert_error:
-                print(f"    ✗ Failed to save answer: {str(insert_error)}")
-                continue
+        if graded_rows:
+            cursor.executemany("""
+                INSERT INTO student_answers 
+                (attempt_id, question_id, selected_option_id, answer_text, is_correct, marks_obtained) 
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, [(attempt_id,) + row for row in graded_rows])
         
         # 6. Update attempt with total score
         cursor.execute("""
@@ -4290,13 +7890,11 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
         """, (float(total_marks), attempt_id))
         
         # 7. Update quiz attempts count
-        cursor.execute("""
-            UPDATE quizzes 
-            SET attempts = attempts + 1 
-            WHERE id = %s
-        """, (quiz_id,))
+        bump_counter(cursor, 'quizzes', 'attempts', quiz_id, 1)
+        bump_teacher_stats(cursor, 'quizzes', quiz_id, quiz_attempts=1)
         
         db.commit()
+        update_student_rollup(db, numeric_student_id)
         
         # 8. Calculate percentage
         percentage = 0.00
@@ -4304,13 +7902,10 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
         if total_quiz_marks and total_quiz_marks > 0:
             percentage = round((total_marks / float(total_quiz_marks)) * 100, 2)
         
-        print(f"\n{'='*60}")
-        print("🎉 QUIZ SUBMISSION COMPLETE")
-        print(f"{'='*60}")
-        print(f"Attempt ID: {attempt_id}")
-        print(f"Processed answers: {processed_count}/{len(answers)}")
-        print(f"Total marks: {total_marks}/{total_quiz_marks}")
-        print(f"Percentage: {percentage}%")
+        logger.info(
+            "Quiz %s submitted: attempt=%s graded=%d/%d score=%s/%s",
+            quiz_id, attempt_id, processed_count, len(answers), total_marks, total_quiz_marks
+        )
         
         response_data = {
             "success": True,
@@ -4331,11 +7926,7 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
         return JSONResponse(status_code=200, content=response_data)
         
     except Exception as e:
-        print(f"\n{'✗'*60}")
-        print("💥 CRITICAL ERROR IN QUIZ SUBMISSION")
-        print(f"{'✗'*60}")
-        print(f"Error: {str(e)}")
-        traceback.print_exc()
+        logger.exception("Quiz submission failed for quiz %s", quiz_id)
         
         # Cleanup
         try:
@@ -4346,15 +7937,14 @@ async def submit_student_quiz(quiz_id: int, request_data: dict):
         except:
             pass
         
-        return JSONResponse(
-            status_code=500,
-            content={
-                "success": False,
-                "detail": f"Internal server error: {str(e)}",
-                "error_type": "INTERNAL_SERVER_ERROR",
-                "traceback": traceback.format_exc()[:500]  # First 500 chars of traceback
-            }
-        )
+        content = {
+            "success": False,
+            "detail": f"Internal server error: {str(e)}",
+            "error_type": "INTERNAL_SERVER_ERROR",
+        }
+        if RESPONSE_DEBUG:
+            content["traceback"] = traceback.format_exc()[:500]  # First 500 chars of traceback
+        return JSONResponse(status_code=500, content=content)
 
 @app.get("/student/{userId}/quiz/results")
 def get_student_quiz_results_all(userId: str):
@@ -4517,6 +8107,8 @@ def start_quiz_attempt(quiz_id: int, student_userId: str):
         )
         
         attempt_id = cursor.lastrowid
+        bump_counter(cursor, 'quizzes', 'attempts', quiz_id, 1)
+        bump_teacher_stats(cursor, 'quizzes', quiz_id, quiz_attempts=1)
         
         db.commit()
         cursor.close()
@@ -4565,18 +8157,10 @@ def get_teacher_assigned_subjects(teacher_id: str):
         # Split multiple subjects (comma-separated)
         assigned_subjects = [s.strip() for s in teacher_subject.split(',') if s.strip()]
         
-        # Get all available subjects for matching
-        all_subjects_set = set()
-        for year_subjects in predefined_subjects.values():
-            for subject in year_subjects:
-                all_subjects_set.add(subject["subject_name"])
-        
         # Find exact matches for teacher's subjects
         matched_subjects = []
         for teacher_subj in assigned_subjects:
-            for available_subj in all_subjects_set:
-                if is_subject_match(teacher_subj, available_subj):
-                    matched_subjects.append(available_subj)
+            matched_subjects.extend(catalog_matches(teacher_subj))
         
         cursor.close()
         db.close()
@@ -4607,14 +8191,11 @@ class AssignmentGradeUpdate(BaseModel):
 # Endpoint for teachers to get all submissions for an assignment
 @app.get("/assignments/{assignment_id}/submissions")
 def get_assignment_submissions(assignment_id: int, teacher_userId: str):
-    """Get all submissions for an assignment (teacher view) - DEBUG VERSION"""
+    """Get all submissions for an assignment (teacher view)"""
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"🔍 DEBUG: Starting get_assignment_submissions for assignment {assignment_id}")
-        print(f"🔍 DEBUG: Teacher userId: {teacher_userId}")
-        
         # Verify teacher owns this assignment
         cursor.execute(
             """SELECT a.id, a.teacher_id, a.title, u.userId as teacher_userId 
@@ -4625,7 +8206,6 @@ def get_assignment_submissions(assignment_id: int, teacher_userId: str):
         )
         
         assignment_auth = cursor.fetchone()
-        print(f"🔍 DEBUG: Teacher authorization check: {assignment_auth}")
         
         if not assignment_auth:
             cursor.close()
@@ -4633,34 +8213,13 @@ def get_assignment_submissions(assignment_id: int, teacher_userId: str):
             return {
                 "error": "Not authorized to view these submissions or assignment not found",
                 "success": False,
-                "debug": {
+                **debug_block({
                     "assignment_id": assignment_id,
                     "teacher_userId": teacher_userId,
                     "message": "Teacher doesn't own this assignment or assignment doesn't exist"
-                }
+                })
             }
         
-        # Debug: Check what's in assignment_submissions table
-        cursor.execute("SELECT COUNT(*) as count FROM assignment_submissions WHERE assignment_id = %s", (assignment_id,))
-        count_result = cursor.fetchone()
-        print(f"🔍 DEBUG: Total submissions in assignment_submissions table: {count_result['count']}")
-        
-        # Debug: Show all submissions for this assignment
-        cursor.execute("SELECT * FROM assignment_submissions WHERE assignment_id = %s", (assignment_id,))
-        raw_submissions = cursor.fetchall()
-        print(f"🔍 DEBUG: Raw submissions from assignment_submissions table:")
-        for sub in raw_submissions:
-            print(f"  - ID: {sub.get('id')}, Student ID: {sub.get('student_id')}, Status: {sub.get('status')}")
-        
-        # Debug: Check the users table for student info
-        if raw_submissions:
-            student_ids = [str(sub['student_id']) for sub in raw_submissions if sub.get('student_id')]
-            print(f"🔍 DEBUG: Student IDs in submissions: {student_ids}")
-            
-            cursor.execute(f"SELECT id, userId, fullName FROM users WHERE id IN ({','.join(student_ids)})")
-            students = cursor.fetchall()
-            print(f"🔍 DEBUG: Students found in users table: {students}")
-        
         # Get all submissions with student info using LEFT JOIN to ensure we get all submissions
         # even if student info is missing
         query = """
@@ -4680,13 +8239,15 @@ def get_assignment_submissions(assignment_id: int, teacher_userId: str):
             ORDER BY s.submission_date DESC
         """
         
-        print(f"🔍 DEBUG: Executing query: {query}")
         cursor.execute(query, (assignment_id,))
         submissions = cursor.fetchall()
         
-        print(f"🔍 DEBUG: Query returned {len(submissions)} submissions")
-        for i, sub in enumerate(submissions):
-            print(f"  Submission {i+1}: ID={sub.get('id')}, Student={sub.get('student_name')}, Student ID={sub.get('student_id')}")
+        if logger.isEnabledFor(logging.DEBUG):
+            missing_students = [sub.get('id') for sub in submissions if not sub.get('student_userId')]
+            logger.debug(
+                "Assignment %s: %d submissions, without student record: %s",
+                assignment_id, len(submissions), missing_students
+            )
         
         # Get assignment details
         cursor.execute(
@@ -4701,9 +8262,6 @@ def get_assignment_submissions(assignment_id: int, teacher_userId: str):
         cursor.close()
         db.close()
         
-        print(f"🔍 DEBUG: Final response - Assignment: {assignment_details.get('title') if assignment_details else 'Not found'}")
-        print(f"🔍 DEBUG: Final response - Submissions count: {len(submissions)}")
-        
         # Convert decimal to float for JSON serialization
         for sub in submissions:
             if 'marks_obtained' in sub and sub['marks_obtained'] is not None:
@@ -4714,18 +8272,16 @@ def get_assignment_submissions(assignment_id: int, teacher_userId: str):
             "submissions": submissions,
             "total_submissions": len(submissions),
             "success": True,
-            "debug": {
-                "raw_count": count_result['count'],
+            **debug_block({
+                "raw_count": len(submissions),
                 "assignment_id": assignment_id,
                 "teacher_userId": teacher_userId,
                 "query_used": query
-            }
+            })
         }
         
     except Exception as e:
-        print(f"🔍 DEBUG: ERROR in get_assignment_submissions: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_assignment_submissions for assignment %s", assignment_id)
         return {
             "error": f"Error fetching submissions: {str(e)}",
             "success": False
@@ -4860,7 +8416,7 @@ from fastapi import HTTPException
 
 # Add this endpoint to handle file downloads
 @app.get("/assignments/submissions/{submission_id}/download")
-def download_submission_file(submission_id: int, teacher_userId: str = None):
+def download_submission_file(submission_id: int, request: Request, teacher_userId: str = None):
     """Download a submission file"""
     try:
         db = get_db()
@@ -4899,45 +8455,20 @@ def download_submission_file(submission_id: int, teacher_userId: str = None):
         cursor.close()
         db.close()
         
-        # Get file path
-        file_path = submission.get('file_path')
-        if not file_path or not os.path.exists(file_path):
-            print(f"DEBUG: File not found at path: {file_path}")
-            print(f"DEBUG: Current working directory: {os.getcwd()}")
-            print(f"DEBUG: Submission file_name: {submission.get('file_name')}")
-            
-            # Try alternative paths
-            base_path = os.path.join(os.getcwd(), 'uploads', 'assignment_submissions')
-            possible_paths = [
-                file_path,
-                os.path.join(base_path, str(submission_id), submission.get('file_name', '')),
-                os.path.join(base_path, str(submission['assignment_id']), submission.get('file_name', '')),
-                os.path.join(base_path, submission.get('file_name', ''))
-            ]
-            
-            for path in possible_paths:
-                if path and os.path.exists(path):
-                    file_path = path
-                    break
-            
-            if not file_path or not os.path.exists(file_path):
-                raise HTTPException(status_code=404, detail="File not found on server")
+        file_path = resolve_submission_file(submission)
+        if not file_path:
+            logger.warning("Submission %s file not found: %s", submission_id, submission.get('file_path'))
+            raise HTTPException(status_code=404, detail="File not found on server")
         
         # Get file name for download
         file_name = submission.get('file_name', 'submission_file')
         
-        # Check if file exists
-        if not os.path.exists(file_path):
-            print(f"ERROR: File does not exist at: {file_path}")
-            raise HTTPException(status_code=404, detail="File not found")
-        
         print(f"DEBUG: Serving file from: {file_path}")
         
         # Serve the file
-        return FileResponse(
-            path=file_path,
-            filename=file_name,
-            media_type='application/octet-stream'
+        return range_file_response(
+            request, file_path, 'application/octet-stream', file_name, 'attachment',
+            cache_control=FILE_CACHE_POLICIES['submission']
         )
         
     except HTTPException:
@@ -4950,7 +8481,7 @@ def download_submission_file(submission_id: int, teacher_userId: str = None):
 
 # Add this endpoint to get file for viewing in browser
 @app.get("/assignments/submissions/{submission_id}/view")
-def view_submission_file(submission_id: int, teacher_userId: str = None):
+def view_submission_file(submission_id: int, request: Request, teacher_userId: str = None):
     """View a submission file in browser (for PDFs, images, etc.)"""
     try:
         db = get_db()
@@ -4989,26 +8520,10 @@ def view_submission_file(submission_id: int, teacher_userId: str = None):
         cursor.close()
         db.close()
         
-        # Get file path
-        file_path = submission.get('file_path')
         file_name = submission.get('file_name', '')
+        file_path = resolve_submission_file(submission)
         
-        if not file_path or not os.path.exists(file_path):
-            # Try to find the file
-            base_path = os.path.join(os.getcwd(), 'uploads', 'assignment_submissions')
-            possible_paths = [
-                file_path,
-                os.path.join(base_path, str(submission_id), file_name),
-                os.path.join(base_path, str(submission['assignment_id']), file_name),
-                os.path.join(base_path, file_name)
-            ]
-            
-            for path in possible_paths:
-                if path and os.path.exists(path):
-                    file_path = path
-                    break
-        
-        if not file_path or not os.path.exists(file_path):
+        if not file_path:
             raise HTTPException(status_code=404, detail="File not found on server")
         
         # Determine content type based on file extension
@@ -5031,10 +8546,9 @@ def view_submission_file(submission_id: int, teacher_userId: str = None):
         
         content_type = content_type_map.get(file_ext, 'application/octet-stream')
         
-        return FileResponse(
-            path=file_path,
-            filename=file_name,
-            media_type=content_type
+        return range_file_response(
+            request, file_path, content_type, file_name,
+            cache_control=FILE_CACHE_POLICIES['submission']
         )
         
     except HTTPException:
@@ -5149,10 +8663,10 @@ def grade_submission(submission_id: int, teacher_userId: str, grade_data: Assign
             return {
                 "error": "Not authorized to grade this submission",
                 "success": False,
-                "debug": {
+                **debug_block({
                     "teacher_id_in_assignment": submission['teacher_id'],
                     "teacher_userId_provided": teacher_userId
-                }
+                })
             }
         
         # 3. Use default total marks (100) since column doesn't exist
@@ -5185,19 +8699,13 @@ def grade_submission(submission_id: int, teacher_userId: str, grade_data: Assign
             teacher['id'],  # Use teacher's database ID
             submission_id
         ))
+        if submission.get('marks_obtained') is None:
+            bump_teacher_stats(cursor, 'assignments', submission['assignment_id'], pending_grading=-1)
         
-        # 5. Update assignment submissions count (removed total_marks reference)
-        cursor.execute("""
-            UPDATE assignments 
-            SET submissions = (
-                SELECT COUNT(*) 
-                FROM assignment_submissions 
-                WHERE assignment_id = %s AND status IN ('submitted', 'graded', 'late')
-            )
-            WHERE id = %s
-        """, (submission['assignment_id'], submission['assignment_id']))
+        # 5. Grading doesn't change assignments.submissions (kept by bump_counter on insert/delete)
         
         db.commit()
+        update_student_rollup(db, submission['student_id'])
         
         # 6. Get updated submission for response (without total_marks)
         cursor.execute("""
@@ -5232,7 +8740,10 @@ def grade_submission(submission_id: int, teacher_userId: str, grade_data: Assign
                 f"Teacher {teacher['fullName']} has graded your assignment. You received {grade_data.marks_obtained}/{total_marks} marks.",
                 'high'
             ))
+            bump_teacher_stats(cursor, 'notifications', cursor.lastrowid, notifications=1)
             db.commit()
+            notification_counts.invalidate()
+            notification_broker.notify()
         except Exception as e:
             print(f"Note: Could not create notification: {e}")
         
@@ -5243,12 +8754,12 @@ def grade_submission(submission_id: int, teacher_userId: str, grade_data: Assign
             "success": True,
             "message": "Grade submitted successfully",
             "submission": updated_submission,
-            "debug": {
+            **debug_block({
                 "submission_id": submission_id,
                 "marks_set": grade_data.marks_obtained,
                 "status_set": "graded",
                 "total_marks_used": total_marks
-            }
+            })
         }
         
     except Exception as e:
@@ -5577,19 +9088,13 @@ def auto_grade_overdue_assignment(request_data: dict):
         ))
         
         submission_id = cursor.lastrowid
+        bump_teacher_stats(cursor, 'assignments', assignment_id, submissions=1)
         
         # Update assignment submissions count
-        cursor.execute("""
-            UPDATE assignments 
-            SET submissions = (
-                SELECT COUNT(*) 
-                FROM assignment_submissions 
-                WHERE assignment_id = %s
-            )
-            WHERE id = %s
-        """, (assignment_id, assignment_id))
+        bump_counter(cursor, 'assignments', 'submissions', assignment_id, 1)
         
         db.commit()
+        update_student_rollup(db, student_id)
         
         # Get the created submission for response
         cursor.execute("""
@@ -5706,6 +9211,9 @@ def submit_assignment(submission: AssignmentSubmissionCreate):
                     "DELETE FROM assignment_submissions WHERE id = %s",
                     (existing_submission['id'],)
                 )
+                file_index.remove('submission', existing_submission['id'])
+                bump_teacher_stats(cursor, 'assignments', submission.assignment_id, submissions=-1)
+                bump_counter(cursor, 'assignments', 'submissions', submission.assignment_id, -1)
             else:
                 cursor.close()
                 db.close()
@@ -5735,19 +9243,25 @@ def submit_assignment(submission: AssignmentSubmissionCreate):
         ))
         
         submission_id = cursor.lastrowid
+        bump_teacher_stats(cursor, 'assignments', submission.assignment_id, submissions=1, pending_grading=1)
         
         # Update assignment submissions count
-        cursor.execute("""
-            UPDATE assignments 
-            SET submissions = (
-                SELECT COUNT(*) 
-                FROM assignment_submissions 
-                WHERE assignment_id = %s
-            )
-            WHERE id = %s
-        """, (submission.assignment_id, submission.assignment_id))
+        bump_counter(cursor, 'assignments', 'submissions', submission.assignment_id, 1)
         
         db.commit()
+        update_student_rollup(db, student_id)
+        
+        if submission.file_path or submission.file_name:
+            submission_row = {
+                'id': submission_id,
+                'assignment_id': submission.assignment_id,
+                'file_path': submission.file_path,
+                'file_name': submission.file_name,
+            }
+            submission_file = locate_submission_file(submission_row)
+            if submission_file:
+                file_index.put('submission', submission_id, submission_file,
+                               submission_file_locator(submission_id, submission_row))
         
         # Get the created submission
         cursor.execute("""
@@ -5857,12 +9371,8 @@ def check_and_auto_grade(request_data: dict):
         # If overdue, auto-grade with 0 marks
         if assignment['is_overdue'] == 1:
             try:
-                # First, check if auto_graded column exists
-                cursor.execute("SHOW COLUMNS FROM assignment_submissions LIKE 'auto_graded'")
-                has_auto_graded = cursor.fetchone()
-                
                 # Insert auto-graded submission
-                if has_auto_graded:
+                if schema_cache.has_column("assignment_submissions", "auto_graded"):
                     insert_query = """
                         INSERT INTO assignment_submissions 
                         (assignment_id, student_id, submission_text, submission_date,
@@ -5903,19 +9413,13 @@ def check_and_auto_grade(request_data: dict):
                     ))
                 
                 submission_id = cursor.lastrowid
+                bump_teacher_stats(cursor, 'assignments', assignment_id, submissions=1)
                 
                 # Update submissions count
-                cursor.execute("""
-                    UPDATE assignments 
-                    SET submissions = (
-                        SELECT COUNT(*) 
-                        FROM assignment_submissions 
-                        WHERE assignment_id = %s
-                    )
-                    WHERE id = %s
-                """, (assignment_id, assignment_id))
+                bump_counter(cursor, 'assignments', 'submissions', assignment_id, 1)
                 
                 db.commit()
+                update_student_rollup(db, student_id)
                 
                 return {
                     "success": True,
@@ -5940,22 +9444,270 @@ def check_and_auto_grade(request_data: dict):
         cursor.close()
         db.close()
 
+# ------------------- AUTO-GRADE SCHEDULER -------------------
+
+# Zero-grades every enrolled student who has no submission for an overdue
+# assignment, server side, so the frontend no longer has to trigger it.
+AUTO_GRADE_ENABLED = os.getenv("AUTO_GRADE_ENABLED", "1") == "1"
+AUTO_GRADE_INTERVAL_SECONDS = float(os.getenv("AUTO_GRADE_INTERVAL_SECONDS", "300"))
+AUTO_GRADE_BATCH_SIZE = int(os.getenv("AUTO_GRADE_BATCH_SIZE", "500"))
+
+AUTO_GRADE_TEXT = 'Auto-graded: No submission received before deadline'
+
+# (student, assignment) pairs with no submission, for every assignment past its due date
+MISSING_SUBMISSIONS_QUERY = """
+    SELECT a.id AS assignment_id, e.student_id
+    FROM assignments a
+    JOIN student_subject_enrollments e ON e.subject_name = a.subject_name
+    LEFT JOIN assignment_submissions s ON s.assignment_id = a.id AND s.student_id = e.student_id
+    WHERE a.due_date < NOW() AND s.id IS NULL
+    ORDER BY a.id, e.student_id
+"""
+
+
+class AutoGradeScheduler:
+    """
+    Background thread that periodically finds every missing (student, assignment)
+    pair with one anti-join and inserts the zero grades in batched transactions.
+
+    Each batch re-checks NOT EXISTS when inserting, so a run is idempotent even if a
+    student submits mid-run, and a MySQL named lock keeps multiple workers from
+    grading at the same time.
+    """
+
+    LOCK_NAME = "islamiccenter_auto_grader"
+
+    def __init__(self, interval, batch_size):
+        self.interval = interval
+        self.batch_size = batch_size
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._run_lock = threading.Lock()
+        self.running = False
+        self.progress = None        # {"pairs", "inserted", "batches_done"} while a run is in progress
+        self.last_run = None        # {"at", "overdue_assignments", "missing_pairs", "inserted", "batches", "seconds"}
+        self.totals = {"runs": 0, "inserted": 0, "failures": 0}
+
+    def _sync_enrollments(self, db):
+        """Students whose enrollment is missing or stale would be skipped by the anti-join"""
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("""
+            SELECT u.id FROM users u
+            LEFT JOIN student_enrollment_years ey ON ey.student_id = u.id
+            WHERE u.role = 'student'
+            AND (ey.student_id IS NULL OR NOT (ey.current_year <=> u.current_year))
+        """)
+        stale = [row['id'] for row in cursor.fetchall()]
+        cursor.close()
+        for student_id in stale:
+            sync_student_enrollment(db, student_id)
+            db.commit()
+
+    def _insert_batch(self, db, pairs):
+        """Insert one batch of zero grades in a single transaction; returns rows inserted"""
+        cursor = db.cursor(dictionary=True)
+        with_flag = schema_cache.has_column("assignment_submissions", "auto_graded")
+        
+        students_by_assignment = {}
+        for pair in pairs:
+            students_by_assignment.setdefault(pair['assignment_id'], []).append(pair['student_id'])
+        
+        inserted = 0
+        for assignment_id, student_ids in students_by_assignment.items():
+            student_rows = " UNION ALL ".join(["SELECT %s AS student_id"] * len(student_ids))
+            cursor.execute(f"""
+                INSERT INTO assignment_submissions
+                (assignment_id, student_id, submission_text, submission_date,
+                 marks_obtained, feedback, graded_by, graded_date, status{', auto_graded' if with_flag else ''})
+                SELECT a.id, p.student_id, %s, UTC_TIMESTAMP(), 0,
+                       CONCAT('Automatically graded with 0 marks. Assignment was due on ',
+                              DATE_FORMAT(a.due_date, '%%Y-%%m-%%d %%H:%%i'),
+                              '. Late submissions are not accepted.'),
+                       a.teacher_id, UTC_TIMESTAMP(), 'graded'{', TRUE' if with_flag else ''}
+                FROM ({student_rows}) p
+                JOIN assignments a ON a.id = %s
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM assignment_submissions s
+                    WHERE s.assignment_id = a.id AND s.student_id = p.student_id
+                )
+            """, [AUTO_GRADE_TEXT, *student_ids, assignment_id])
+            graded = cursor.rowcount
+            if graded:
+                bump_counter(cursor, 'assignments', 'submissions', assignment_id, graded)
+                bump_teacher_stats(cursor, 'assignments', assignment_id, submissions=graded)
+                inserted += graded
+        
+        db.commit()
+        cursor.close()
+        if inserted:
+            for student_id in sorted({pair['student_id'] for pair in pairs}):
+                update_student_rollup(db, student_id)
+        return inserted
+
+    def run_once(self):
+        """One full pass; returns last_run, or None if another worker holds the lock"""
+        with self._run_lock:
+            started = time.monotonic()
+            db = get_db()
+            locked = False
+            try:
+                cursor = db.cursor()
+                cursor.execute("SELECT GET_LOCK(%s, 0)", (self.LOCK_NAME,))
+                locked = cursor.fetchone()[0] == 1
+                cursor.close()
+                if not locked:
+                    return None
+                
+                self.running = True
+                self._sync_enrollments(db)
+                
+                cursor = db.cursor(dictionary=True)
+                cursor.execute(MISSING_SUBMISSIONS_QUERY)
+                pairs = cursor.fetchall()
+                cursor.close()
+                
+                self.progress = {"pairs": len(pairs), "inserted": 0, "batches_done": 0}
+                inserted = 0
+                for start in range(0, len(pairs), self.batch_size):
+                    inserted += self._insert_batch(db, pairs[start:start + self.batch_size])
+                    self.progress["inserted"] = inserted
+                    self.progress["batches_done"] += 1
+                
+                self.last_run = {
+                    "at": datetime.now().isoformat(),
+                    "overdue_assignments": len({pair['assignment_id'] for pair in pairs}),
+                    "missing_pairs": len(pairs),
+                    "inserted": inserted,
+                    "batches": self.progress["batches_done"],
+                    "seconds": round(time.monotonic() - started, 3),
+                }
+                self.totals["runs"] += 1
+                self.totals["inserted"] += inserted
+                if inserted:
+                    logger.info("Auto-graded %d overdue submissions", inserted)
+                return self.last_run
+            finally:
+                self.running = False
+                self.progress = None
+                if locked:
+                    try:
+                        cursor = db.cursor()
+                        cursor.execute("SELECT RELEASE_LOCK(%s)", (self.LOCK_NAME,))
+                        cursor.fetchall()
+                        cursor.close()
+                    except Exception:
+                        pass
+                db.close()
+
+    def prometheus_lines(self):
+        last = self.last_run or {}
+        return [
+            "# HELP auto_grader_inserted_total Zero-grade submissions inserted by the scheduler.",
+            "# TYPE auto_grader_inserted_total counter",
+            f"auto_grader_inserted_total {self.totals['inserted']}",
+            "# HELP auto_grader_runs_total Completed auto-grade passes.",
+            "# TYPE auto_grader_runs_total counter",
+            f"auto_grader_runs_total {self.totals['runs']}",
+            "# HELP auto_grader_failures_total Auto-grade passes that raised.",
+            "# TYPE auto_grader_failures_total counter",
+            f"auto_grader_failures_total {self.totals['failures']}",
+            "# HELP auto_grader_last_run_missing_pairs Missing (student, assignment) pairs found by the last pass.",
+            "# TYPE auto_grader_last_run_missing_pairs gauge",
+            f"auto_grader_last_run_missing_pairs {last.get('missing_pairs', 0)}",
+            "# HELP auto_grader_last_run_seconds Duration of the last pass.",
+            "# TYPE auto_grader_last_run_seconds gauge",
+            f"auto_grader_last_run_seconds {last.get('seconds', 0)}",
+        ]
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                self.totals["failures"] += 1
+                logger.warning("Auto-grade pass failed: %s", e)
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="auto-grader", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+auto_grader = AutoGradeScheduler(AUTO_GRADE_INTERVAL_SECONDS, AUTO_GRADE_BATCH_SIZE)
+metrics.register_collector(auto_grader.prometheus_lines)
+
+
+@app.on_event("startup")
+def start_auto_grader():
+    if AUTO_GRADE_ENABLED:
+        auto_grader.start()
+
+
+@app.on_event("shutdown")
+def stop_auto_grader():
+    auto_grader.stop()
+
+
+@app.get("/admin/auto-grader")
+def get_auto_grader_status():
+    return {
+        "success": True,
+        "enabled": AUTO_GRADE_ENABLED,
+        "interval_seconds": auto_grader.interval,
+        "batch_size": auto_grader.batch_size,
+        "running": auto_grader.running,
+        "progress": auto_grader.progress,
+        "last_run": auto_grader.last_run,
+        "totals": auto_grader.totals,
+    }
+
+
+@app.post("/admin/auto-grader/run")
+def run_auto_grader():
+    """Run a pass now (blocks until it finishes)"""
+    try:
+        result = auto_grader.run_once()
+        if result is None:
+            return {"success": False, "error": "Another worker is running the auto-grader"}
+        return {"success": True, "run": result}
+    except Exception as e:
+        return {"success": False, "error": str(e)}
+
+
 # Add this endpoint to get student by userId
 @app.get("/users")
-def get_user_by_userId(userId: str = None):
-    """Get user by userId (works for both students and teachers)"""
+def get_user_by_userId(
+    userId: str = None,
+    limit: Optional[int] = Query(None, ge=1),
+    page_cursor: Optional[str] = Query(None, alias="cursor"),
+    fields: Optional[str] = None,
+    include_total: bool = False
+):
+    """Get user by userId (works for both students and teachers); without userId, the keyset-paged student list"""
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"🔍 DEBUG: Looking for user with userId: {userId}")
-        
+        page = {}
         if userId:
             cursor.execute("SELECT * FROM users WHERE userId = %s", (userId,))
+            users = cursor.fetchall()
         else:
-            cursor.execute("SELECT * FROM users WHERE role = 'student'")
-        
-        users = cursor.fetchall()
+            users, next_cursor, total = fetch_list_page(
+                cursor, "users", "u", "id", ascending=True,
+                where=["u.role = 'student'"],
+                fields=fields, limit=limit, page_cursor=page_cursor, include_total=include_total
+            )
+            page = list_page_info(next_cursor, total)
         
         cursor.close()
         db.close()
@@ -5970,213 +9722,367 @@ def get_user_by_userId(userId: str = None):
             if user.get('created_at'):
                 user['created_at'] = str(user['created_at'])
         
-        return {"success": True, "users": users}
+        return {"success": True, "users": users, **page}
         
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Error in get_user_by_userId: {str(e)}")
+        logger.warning("Error in get_user_by_userId: %s", e)
         return {"success": False, "error": str(e)}
 
 
-# REPLACE the entire /student/{student_userId}/dashboard/stats endpoint with this FIXED version:
+# ------------------- STUDENT DASHBOARD ROLLUPS -------------------
+
+# Per-student aggregates that only change when the student submits or gets graded.
+# They are rebuilt right after the writing transaction commits, so the dashboard can
+# read them together with the date-dependent counts in a single query. Each rebuild
+# locks the student's rollup row first, so concurrent rebuilds run one after another
+# and the later one reads what the earlier one saw; a periodic pass repairs any
+# rollup a failed rebuild left behind.
+STUDENT_DASHBOARD_ROLLUPS_DDL = """
+    CREATE TABLE IF NOT EXISTS student_dashboard_rollups (
+        student_id INT NOT NULL PRIMARY KEY,
+        current_year VARCHAR(100) NULL,
+        year_index INT NOT NULL DEFAULT 0,
+        submitted_assignments INT NOT NULL DEFAULT 0,
+        graded_assignments INT NOT NULL DEFAULT 0,
+        avg_assignment_score DOUBLE NOT NULL DEFAULT 0,
+        completed_quizzes INT NOT NULL DEFAULT 0,
+        avg_quiz_score DOUBLE NOT NULL DEFAULT 0,
+        subject_performance TEXT NULL,
+        recent_activities TEXT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP
+    )
+"""
+
+# Base progress shown before a student has any activity
+YEAR_BASE_PROGRESS = {1: 20, 2: 40, 3: 60, 4: 80, 5: 95}
+
+
+def student_year_index(student_year):
+    """Map a users.current_year value ("First Year", "1", ...) to a predefined_subjects key, 0 if unknown"""
+    if not student_year:
+        return 0
+    year = student_year.lower()
+    for index, word in ((1, "first"), (2, "second"), (3, "third"), (4, "fourth"), (5, "fifth")):
+        if word in year or str(index) in year:
+            return index if index in predefined_subjects else 0
+    return 0
+
+
+STUDENT_DASHBOARD_QUERY = """
+    SELECT u.id, u.userId, u.fullName, u.current_year, u.email, u.phone,
+           r.student_id AS rollup_student_id, r.current_year AS rollup_year, r.year_index,
+           r.submitted_assignments, r.graded_assignments, r.avg_assignment_score,
+           r.completed_quizzes, r.avg_quiz_score, r.subject_performance, r.recent_activities,
+           ey.student_id AS enrollment_student_id, ey.current_year AS enrollment_year, ey.year_id,
+           (SELECT COUNT(*) FROM assignments a
+            WHERE a.due_date >= %(today)s
+            AND NOT EXISTS (SELECT 1 FROM assignment_submissions s
+                            WHERE s.assignment_id = a.id AND s.student_id = u.id)) AS pending_assignments,
+           (SELECT COUNT(*) FROM quizzes q
+            WHERE q.is_published = 1 AND q.end_date >= %(today)s
+            AND NOT EXISTS (SELECT 1 FROM student_attempts sa
+                            WHERE sa.quiz_id = q.id AND sa.student_id = u.id)) AS upcoming_quizzes,
+           (SELECT COUNT(*) FROM quizzes q
+            WHERE q.is_published = 1 AND q.end_date >= %(today)s) AS total_quizzes,
+           (SELECT COUNT(*) FROM student_subject_enrollments e
+            JOIN assignments a ON a.subject_name = e.subject_name
+            WHERE e.student_id = u.id AND a.due_date >= %(today)s) AS available_assignments,
+           (SELECT COUNT(*) FROM student_subject_enrollments e
+            WHERE e.student_id = u.id) AS subjects_count
+    FROM users u
+    LEFT JOIN student_dashboard_rollups r ON r.student_id = u.id
+    LEFT JOIN student_enrollment_years ey ON ey.student_id = u.id
+    WHERE u.userId = %(userId)s AND u.role = 'student'
+"""
+
+
+def refresh_student_rollup(db, student_id):
+    """
+    Recompute one student's rollup row. Call it at the start of a transaction (after the
+    write that changed the student's data has committed) and commit afterwards: the row
+    lock is taken before anything is read, so the reads see every committed write.
+    """
+    cursor = db.cursor(dictionary=True)
+    cursor.execute("""
+        INSERT INTO student_dashboard_rollups (student_id) VALUES (%s)
+        ON DUPLICATE KEY UPDATE student_id = student_id
+    """, (student_id,))
+    cursor.execute("""
+        SELECT u.current_year,
+               (SELECT COUNT(DISTINCT s.assignment_id) FROM assignment_submissions s
+                WHERE s.student_id = u.id) AS submitted_assignments,
+               (SELECT COUNT(*) FROM assignment_submissions s
+                WHERE s.student_id = u.id AND s.marks_obtained IS NOT NULL) AS graded_assignments,
+               (SELECT COALESCE(AVG(s.marks_obtained), 0) FROM assignment_submissions s
+                WHERE s.student_id = u.id AND s.marks_obtained IS NOT NULL) AS avg_assignment_score,
+               (SELECT COUNT(DISTINCT sa.quiz_id) FROM student_attempts sa
+                WHERE sa.student_id = u.id) AS completed_quizzes,
+               (SELECT COALESCE(AVG(sa.total_score), 0) FROM student_attempts sa
+                WHERE sa.student_id = u.id) AS avg_quiz_score
+        FROM users u
+        WHERE u.id = %s
+    """, (student_id,))
+    totals = cursor.fetchone()
+    if not totals:
+        cursor.close()
+        return
+    
+    year_index = student_year_index(totals['current_year'])
+    
+    # Per-subject performance for the student's first three enrolled subjects
+    subject_performance = []
+    cursor.execute("""
+        SELECT subject_name FROM student_subject_enrollments
+        WHERE student_id = %s
+        ORDER BY subject_id
+        LIMIT 3
+    """, (student_id,))
+    year_subjects = [row['subject_name'] for row in cursor.fetchall()]
+    if year_subjects:
+        cursor.execute("""
+            SELECT a.subject_name, COUNT(DISTINCT s.id) AS submitted,
+                   COALESCE(AVG(s.marks_obtained), 0) AS avg_score
+            FROM assignment_submissions s
+            JOIN assignments a ON s.assignment_id = a.id
+            WHERE s.student_id = %s
+            GROUP BY a.subject_name
+        """, (student_id,))
+        assignment_stats = {row['subject_name']: (row['submitted'], row['avg_score']) for row in cursor.fetchall()}
+        
+        cursor.execute("""
+            SELECT q.subject_name, COUNT(DISTINCT sa.id) AS attempted,
+                   COALESCE(AVG(sa.total_score), 0) AS avg_score
+            FROM student_attempts sa
+            JOIN quizzes q ON sa.quiz_id = q.id
+            WHERE sa.student_id = %s
+            GROUP BY q.subject_name
+        """, (student_id,))
+        quiz_stats = {row['subject_name']: (row['attempted'], row['avg_score']) for row in cursor.fetchall()}
+        
+        for subject_name in year_subjects:
+            assignments_submitted, assignments_avg = assignment_stats.get(subject_name, (0, 0))
+            quizzes_attempted, quizzes_avg = quiz_stats.get(subject_name, (0, 0))
+            
+            averages = []
+            if assignments_submitted > 0:
+                averages.append(float(assignments_avg or 0))
+            if quizzes_attempted > 0:
+                averages.append(float(quizzes_avg or 0))
+            average_score = sum(averages) / len(averages) if averages else 0
+            
+            subject_performance.append({
+                "subject_name": subject_name,
+                "assignments_submitted": assignments_submitted,
+                "assignments_graded": assignments_submitted,  # Simplified
+                "quizzes_attempted": quizzes_attempted,
+                "average_score": round(average_score, 1),
+                "performance_percentage": min(round(average_score, 1), 100)
+            })
+    
+    # Latest activity across assignments and quizzes
+    cursor.execute("""
+        (SELECT 
+            'assignment_submission' as activity_type,
+            '📝 Submitted Assignment' as title,
+            a.title as description,
+            a.subject_name,
+            s.submission_date as timestamp,
+            s.marks_obtained as score,
+            NULL as max_score
+        FROM assignment_submissions s
+        JOIN assignments a ON s.assignment_id = a.id
+        WHERE s.student_id = %s
+        ORDER BY s.submission_date DESC
+        LIMIT 2)
+        
+        UNION ALL
+        
+        (SELECT 
+            'quiz_attempt' as activity_type,
+            '📊 Attempted Quiz' as title,
+            q.title as description,
+            q.subject_name,
+            sa.submitted_at as timestamp,
+            sa.total_score as score,
+            q.total_marks as max_score
+        FROM student_attempts sa
+        JOIN quizzes q ON sa.quiz_id = q.id
+        WHERE sa.student_id = %s
+        ORDER BY sa.submitted_at DESC
+        LIMIT 2)
+        
+        ORDER BY timestamp DESC
+        LIMIT 3
+    """, (student_id, student_id))
+    recent_activities = cursor.fetchall()
+    
+    cursor.execute("""
+        INSERT INTO student_dashboard_rollups
+        (student_id, current_year, year_index, submitted_assignments, graded_assignments,
+         avg_assignment_score, completed_quizzes, avg_quiz_score, subject_performance, recent_activities)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+        ON DUPLICATE KEY UPDATE
+            current_year = VALUES(current_year),
+            year_index = VALUES(year_index),
+            submitted_assignments = VALUES(submitted_assignments),
+            graded_assignments = VALUES(graded_assignments),
+            avg_assignment_score = VALUES(avg_assignment_score),
+            completed_quizzes = VALUES(completed_quizzes),
+            avg_quiz_score = VALUES(avg_quiz_score),
+            subject_performance = VALUES(subject_performance),
+            recent_activities = VALUES(recent_activities)
+    """, (
+        student_id,
+        totals['current_year'],
+        year_index,
+        totals['submitted_assignments'] or 0,
+        totals['graded_assignments'] or 0,
+        float(totals['avg_assignment_score'] or 0),
+        totals['completed_quizzes'] or 0,
+        float(totals['avg_quiz_score'] or 0),
+        json.dumps(jsonable_encoder(subject_performance)),
+        json.dumps(jsonable_encoder(recent_activities)),
+    ))
+    cursor.close()
+
+
+def update_student_rollup(db, student_id):
+    """
+    refresh_student_rollup for write paths, called right after their commit. It commits
+    its own transaction; a rollup failure must not fail the student's write (the
+    reconciler repairs it).
+    """
+    try:
+        refresh_student_rollup(db, student_id)
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Could not refresh dashboard rollup for student %s: %s", student_id, e)
+
+
+def rebuild_student_rollups(student_ids=None):
+    """Rebuild the rollups (and enrollments) of the given students, or of every student"""
+    db = get_db()
+    try:
+        cursor = db.cursor(dictionary=True)
+        if student_ids is None:
+            cursor.execute("SELECT id FROM users WHERE role = 'student'")
+            student_ids = [row['id'] for row in cursor.fetchall()]
+        cursor.close()
+        db.commit()     # end the read snapshot before the first rollup lock
+        
+        for student_id in student_ids:
+            sync_student_enrollment(db, student_id)
+            db.commit()
+            refresh_student_rollup(db, student_id)
+            db.commit()
+    finally:
+        db.close()
+    return len(student_ids)
+
+
+class StudentRollupReconciler:
+    """Background thread rebuilding every dashboard rollup every STUDENT_ROLLUP_RECONCILE_SECONDS"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.last_run = None        # {"at", "students", "seconds"}
+
+    def reconcile(self):
+        started = time.monotonic()
+        students = rebuild_student_rollups()
+        self.last_run = {
+            "at": datetime.now().isoformat(),
+            "students": students,
+            "seconds": round(time.monotonic() - started, 3),
+        }
+        return students
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop.is_set():
+                break
+            try:
+                self.reconcile()
+            except Exception as e:
+                logger.warning("Dashboard rollup reconciliation failed: %s", e)
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rollup-reconciler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        self._thread = None
+
+
+STUDENT_ROLLUP_RECONCILE_SECONDS = float(os.getenv("STUDENT_ROLLUP_RECONCILE_SECONDS", "3600"))
+rollup_reconciler = StudentRollupReconciler(STUDENT_ROLLUP_RECONCILE_SECONDS)
+
+
+@app.on_event("startup")
+def start_rollup_reconciler():
+    rollup_reconciler.start()
+
+
+@app.on_event("shutdown")
+def stop_rollup_reconciler():
+    rollup_reconciler.stop()
+
+
+def read_student_dashboard(cursor, student_userId):
+    params = {"userId": student_userId, "today": datetime.now().date()}
+    cursor.execute(STUDENT_DASHBOARD_QUERY, params)
+    return cursor.fetchone()
+
 
 @app.get("/student/{student_userId}/dashboard/stats")
-def get_student_dashboard_stats(student_userId: str):
-    """Get comprehensive dashboard statistics for a student - FIXED VERSION"""
+def get_student_dashboard_stats(student_userId: str, refresh: bool = False):
+    """
+    Dashboard statistics for a student, read from the per-student rollup in one query.
+    `refresh=true` rebuilds the rollup from the source tables first (consistency check).
+    """
     try:
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"🔍 DEBUG DASHBOARD: Getting stats for student: {student_userId}")
-        
-        # 1. Get student basic info
-        cursor.execute("""
-            SELECT id, userId, fullName, current_year, email, phone
-            FROM users 
-            WHERE userId = %s AND role = 'student'
-        """, (student_userId,))
-        
-        student = cursor.fetchone()
+        row = read_student_dashboard(cursor, student_userId)
         
-        if not student:
-            print(f"❌ Student not found: {student_userId}")
+        if not row:
+            logger.debug("Dashboard: student not found: %s", student_userId)
             cursor.close()
             db.close()
             return {"success": False, "error": "Student not found"}
         
-        student_id = student['id']
-        student_name = student['fullName']
-        student_year = student['current_year']
-        
-        print(f"✅ Found student: {student_name} (ID: {student_id}, Year: {student_year})")
-        
-        # 2. Get student's subjects based on their year (simplified)
-        student_subjects = []
-        if student_year:
-            if "first" in student_year.lower() or "1" in student_year:
-                if 1 in predefined_subjects:
-                    student_subjects = predefined_subjects[1]
-            elif "second" in student_year.lower() or "2" in student_year:
-                if 2 in predefined_subjects:
-                    student_subjects = predefined_subjects[2]
-            elif "third" in student_year.lower() or "3" in student_year:
-                if 3 in predefined_subjects:
-                    student_subjects = predefined_subjects[3]
-            elif "fourth" in student_year.lower() or "4" in student_year:
-                if 4 in predefined_subjects:
-                    student_subjects = predefined_subjects[4]
-            elif "fifth" in student_year.lower() or "5" in student_year:
-                if 5 in predefined_subjects:
-                    student_subjects = predefined_subjects[5]
-        
-        print(f"📚 Student subjects count: {len(student_subjects)}")
-        
-        # 3. Get assignments data - SIMPLIFIED
-        current_date = datetime.now().date()
-        
-        # Pending assignments (not submitted and not overdue)
-        cursor.execute("""
-            SELECT COUNT(DISTINCT a.id) as pending_count
-            FROM assignments a
-            WHERE a.due_date >= %s 
-            AND a.id NOT IN (
-                SELECT s.assignment_id 
-                FROM assignment_submissions s 
-                WHERE s.student_id = %s
-            )
-        """, (current_date, student_id))
-        
-        pending_result = cursor.fetchone()
-        pending_assignments = pending_result['pending_count'] if pending_result else 0
-        print(f"📝 Pending assignments: {pending_assignments}")
-        
-        # Total submitted assignments
-        cursor.execute("""
-            SELECT COUNT(DISTINCT assignment_id) as submitted_count
-            FROM assignment_submissions 
-            WHERE student_id = %s
-        """, (student_id,))
-        
-        submitted_result = cursor.fetchone()
-        submitted_assignments = submitted_result['submitted_count'] if submitted_result else 0
-        print(f"✅ Submitted assignments: {submitted_assignments}")
-        
-        # Graded assignments with scores
-        cursor.execute("""
-            SELECT COUNT(*) as graded_count, 
-                   COALESCE(AVG(marks_obtained), 0) as avg_score
-            FROM assignment_submissions 
-            WHERE student_id = %s 
-            AND marks_obtained IS NOT NULL
-        """, (student_id,))
-        
-        graded_result = cursor.fetchone()
-        graded_assignments = graded_result['graded_count'] if graded_result else 0
-        avg_assignment_score = float(graded_result['avg_score']) if graded_result and graded_result['avg_score'] else 0
-        print(f"📊 Graded assignments: {graded_assignments}, Avg score: {avg_assignment_score}")
-        
-        # 4. Get quizzes data - SIMPLIFIED
-        # Upcoming quizzes (not attempted and not expired)
-        cursor.execute("""
-            SELECT COUNT(DISTINCT q.id) as upcoming_count
-            FROM quizzes q
-            WHERE q.is_published = 1 
-            AND q.end_date >= %s 
-            AND q.id NOT IN (
-                SELECT sa.quiz_id 
-                FROM student_attempts sa 
-                WHERE sa.student_id = %s
-            )
-        """, (current_date, student_id))
-        
-        upcoming_result = cursor.fetchone()
-        upcoming_quizzes = upcoming_result['upcoming_count'] if upcoming_result else 0
-        print(f"📅 Upcoming quizzes: {upcoming_quizzes}")
-        
-        # Total available quizzes
-        cursor.execute("""
-            SELECT COUNT(DISTINCT q.id) as total_count
-            FROM quizzes q
-            WHERE q.is_published = 1 
-            AND q.end_date >= %s
-        """, (current_date,))
-        
-        total_result = cursor.fetchone()
-        total_quizzes = total_result['total_count'] if total_result else 0
-        print(f"📋 Total quizzes: {total_quizzes}")
-        
-        # Completed quizzes
-        cursor.execute("""
-            SELECT COUNT(DISTINCT quiz_id) as completed_count,
-                   COALESCE(AVG(total_score), 0) as avg_score
-            FROM student_attempts 
-            WHERE student_id = %s
-        """, (student_id,))
-        
-        completed_result = cursor.fetchone()
-        completed_quizzes = completed_result['completed_count'] if completed_result else 0
-        avg_quiz_score = float(completed_result['avg_score']) if completed_result and completed_result['avg_score'] else 0
-        print(f"🏆 Completed quizzes: {completed_quizzes}, Avg score: {avg_quiz_score}")
+        # Missing enrollment or rollup, or the student's year changed since they were built
+        enrollment_stale = row['enrollment_student_id'] is None or row['enrollment_year'] != row['current_year']
+        if refresh or enrollment_stale or row['rollup_student_id'] is None or row['rollup_year'] != row['current_year']:
+            sync_student_enrollment(db, row['id'])
+            db.commit()
+            refresh_student_rollup(db, row['id'])
+            db.commit()
+            row = read_student_dashboard(cursor, student_userId)
         
-        # 5. Get recent activities
-        recent_activities = []
-        try:
-            cursor.execute("""
-                (SELECT 
-                    'assignment_submission' as activity_type,
-                    '📝 Submitted Assignment' as title,
-                    a.title as description,
-                    a.subject_name,
-                    s.submission_date as timestamp,
-                    s.marks_obtained as score,
-                    NULL as max_score
-                FROM assignment_submissions s
-                JOIN assignments a ON s.assignment_id = a.id
-                WHERE s.student_id = %s
-                ORDER BY s.submission_date DESC
-                LIMIT 2)
-                
-                UNION ALL
-                
-                (SELECT 
-                    'quiz_attempt' as activity_type,
-                    '📊 Attempted Quiz' as title,
-                    q.title as description,
-                    q.subject_name,
-                    sa.submitted_at as timestamp,
-                    sa.total_score as score,
-                    q.total_marks as max_score
-                FROM student_attempts sa
-                JOIN quizzes q ON sa.quiz_id = q.id
-                WHERE sa.student_id = %s
-                ORDER BY sa.submitted_at DESC
-                LIMIT 2)
-                
-                ORDER BY timestamp DESC
-                LIMIT 3
-            """, (student_id, student_id))
-            
-            recent_activities = cursor.fetchall()
-            print(f"📈 Recent activities: {len(recent_activities)}")
-        except Exception as e:
-            print(f"⚠️ Could not fetch recent activities: {e}")
+        cursor.close()
+        db.close()
         
-        # 6. Calculate overall progress - SIMPLIFIED
-        overall_progress = 0
+        student_year = row['current_year']
+        year_index = row['year_index'] or 0
         
-        # Count total assignments available for student's year
-        total_assignments_available = 0
-        if student_subjects:
-            subject_names = [subj["subject_name"] for subj in student_subjects]
-            placeholders = ', '.join(['%s'] * len(subject_names))
-            cursor.execute(f"""
-                SELECT COUNT(*) as total 
-                FROM assignments 
-                WHERE subject_name IN ({placeholders})
-                AND due_date >= %s
-            """, (*subject_names, current_date))
-            
-            total_result = cursor.fetchone()
-            total_assignments_available = total_result['total'] if total_result else 0
+        submitted_assignments = row['submitted_assignments'] or 0
+        completed_quizzes = row['completed_quizzes'] or 0
+        total_quizzes = row['total_quizzes'] or 0
+        total_assignments_available = row['available_assignments'] or 0
         
         # Calculate progress
         assignment_progress = 0
@@ -6191,123 +10097,47 @@ def get_student_dashboard_stats(student_userId: str):
         overall_progress = min(assignment_progress + quiz_progress, 100)
         
         # If no activities yet, set base progress
-        if overall_progress == 0:
-            if student_year:
-                if "first" in student_year.lower() or "1" in student_year:
-                    overall_progress = 20
-                elif "second" in student_year.lower() or "2" in student_year:
-                    overall_progress = 40
-                elif "third" in student_year.lower() or "3" in student_year:
-                    overall_progress = 60
-                elif "fourth" in student_year.lower() or "4" in student_year:
-                    overall_progress = 80
-                elif "fifth" in student_year.lower() or "5" in student_year:
-                    overall_progress = 95
-                else:
-                    overall_progress = 30
-        
-        # 7. Get subject performance - SIMPLIFIED
-        subject_performance = []
-        try:
-            if student_subjects:
-                for subject_data in student_subjects[:3]:  # Limit to 3 subjects
-                    subject_name = subject_data["subject_name"]
-                    
-                    # Assignment stats
-                    cursor.execute("""
-                        SELECT 
-                            COUNT(DISTINCT s.id) as submitted,
-                            COALESCE(AVG(s.marks_obtained), 0) as avg_score
-                        FROM assignment_submissions s
-                        JOIN assignments a ON s.assignment_id = a.id
-                        WHERE s.student_id = %s 
-                        AND a.subject_name = %s
-                    """, (student_id, subject_name))
-                    
-                    assignment_stats = cursor.fetchone()
-                    
-                    # Quiz stats
-                    cursor.execute("""
-                        SELECT 
-                            COUNT(DISTINCT sa.id) as attempted,
-                            COALESCE(AVG(sa.total_score), 0) as avg_score
-                        FROM student_attempts sa
-                        JOIN quizzes q ON sa.quiz_id = q.id
-                        WHERE sa.student_id = %s 
-                        AND q.subject_name = %s
-                    """, (student_id, subject_name))
-                    
-                    quiz_stats = cursor.fetchone()
-                    
-                    # Calculate average
-                    assignments_submitted = assignment_stats['submitted'] if assignment_stats else 0
-                    assignments_avg = float(assignment_stats['avg_score']) if assignment_stats and assignment_stats['avg_score'] else 0
-                    quizzes_attempted = quiz_stats['attempted'] if quiz_stats else 0
-                    quizzes_avg = float(quiz_stats['avg_score']) if quiz_stats and quiz_stats['avg_score'] else 0
-                    
-                    # Overall average
-                    if assignments_submitted > 0 or quizzes_attempted > 0:
-                        total_avg = 0
-                        count = 0
-                        if assignments_submitted > 0:
-                            total_avg += assignments_avg
-                            count += 1
-                        if quizzes_attempted > 0:
-                            total_avg += quizzes_avg
-                            count += 1
-                        average_score = total_avg / count
-                    else:
-                        average_score = 0
-                    
-                    subject_performance.append({
-                        "subject_name": subject_name,
-                        "assignments_submitted": assignments_submitted,
-                        "assignments_graded": assignments_submitted,  # Simplified
-                        "quizzes_attempted": quizzes_attempted,
-                        "average_score": round(average_score, 1),
-                        "performance_percentage": min(round(average_score, 1), 100)
-                    })
-        except Exception as e:
-            print(f"⚠️ Could not fetch subject performance: {e}")
-        
-        cursor.close()
-        db.close()
-        
-        print(f"🎉 Dashboard stats calculated successfully!")
-        print(f"   Overall progress: {overall_progress}%")
-        print(f"   Subjects: {len(subject_performance)}")
-        print(f"   Activities: {len(recent_activities)}")
+        if overall_progress == 0 and student_year:
+            overall_progress = YEAR_BASE_PROGRESS.get(year_index, 30)
         
         return {
             "success": True,
             "student_info": {
                 "userId": student_userId,
-                "fullName": student_name,
+                "fullName": row['fullName'],
                 "current_year": student_year,
-                "email": student.get('email'),
-                "phone": student.get('phone')
+                "email": row.get('email'),
+                "phone": row.get('phone')
             },
             "stats": {
-                "pending_assignments": pending_assignments,
+                "pending_assignments": row['pending_assignments'] or 0,
                 "submitted_assignments": submitted_assignments,
-                "graded_assignments": graded_assignments,
-                "avg_assignment_score": round(avg_assignment_score, 1),
-                "upcoming_quizzes": upcoming_quizzes,
+                "graded_assignments": row['graded_assignments'] or 0,
+                "avg_assignment_score": round(float(row['avg_assignment_score'] or 0), 1),
+                "upcoming_quizzes": row['upcoming_quizzes'] or 0,
                 "total_quizzes": total_quizzes,
                 "completed_quizzes": completed_quizzes,
-                "avg_quiz_score": round(avg_quiz_score, 1),
+                "avg_quiz_score": round(float(row['avg_quiz_score'] or 0), 1),
                 "recent_notifications": 0,  # Placeholder
                 "overall_progress": round(overall_progress, 1)
             },
-            "subject_performance": subject_performance,
-            "recent_activities": recent_activities,
-            "subjects_count": len(student_subjects)
+            "subject_performance": json.loads(row['subject_performance'] or "[]"),
+            "recent_activities": json.loads(row['recent_activities'] or "[]"),
+            "subjects_count": row['subjects_count'] or 0,
+            **({"enrollment_error": unresolved_year_error(student_year)} if row['year_id'] is None else {})
         }
         
     except Exception as e:
-        print(f"❌ ERROR in get_student_dashboard_stats: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_student_dashboard_stats for %s", student_userId)
+        return {"success": False, "error": str(e)}
+
+
+@app.post("/admin/dashboard-rollups/rebuild")
+def rebuild_dashboard_rollups():
+    """Rebuild every student's dashboard rollup from the source tables"""
+    try:
+        return {"success": True, "rebuilt": rebuild_student_rollups()}
+    except Exception as e:
         return {"success": False, "error": str(e)}
 
 # ------------------- TEACHER DASHBOARD ENDPOINTS -------------------
@@ -6319,19 +10149,20 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         db = get_db()
         cursor = db.cursor(dictionary=True)
         
-        print(f"🔍 TEACHER DASHBOARD: Getting stats for teacher: {teacher_userId}")
-        
-        # 1. Get teacher basic info
+        # 1. Get teacher basic info (and the date-dependent assignment counts)
         cursor.execute("""
-            SELECT id, userId, fullName, subject, email, phone
-            FROM users 
-            WHERE userId = %s AND role = 'teacher'
+            SELECT u.id, u.userId, u.fullName, u.subject, u.email, u.phone,
+                   (SELECT COUNT(*) FROM assignments a
+                    WHERE a.teacher_id = u.id AND a.due_date < CURDATE()) AS past_due,
+                   (SELECT COUNT(*) FROM assignments a
+                    WHERE a.teacher_id = u.id AND a.due_date >= CURDATE()) AS upcoming
+            FROM users u
+            WHERE u.userId = %s AND u.role = 'teacher'
         """, (teacher_userId,))
         
         teacher = cursor.fetchone()
         
         if not teacher:
-            print(f"❌ Teacher not found: {teacher_userId}")
             cursor.close()
             db.close()
             return {"success": False, "error": "Teacher not found"}
@@ -6340,9 +10171,6 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         teacher_name = teacher['fullName']
         teacher_subjects = teacher.get('subject', '').split(',') if teacher.get('subject') else []
         
-        print(f"✅ Found teacher: {teacher_name} (ID: {teacher_id})")
-        print(f"📚 Assigned subjects: {teacher_subjects}")
-        
         # 2. Get assigned subjects data
         assigned_subjects_data = []
         for subject in teacher_subjects:
@@ -6352,86 +10180,13 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         
         # If no subjects assigned, get from predefined based on name matching
         if not assigned_subjects_data:
-            # Get all subjects for matching
-            all_subjects_set = set()
-            for year_subjects in predefined_subjects.values():
-                for subj in year_subjects:
-                    all_subjects_set.add(subj["subject_name"])
-            
             # Try to match teacher's subject field
-            if teacher.get('subject'):
-                teacher_subj = teacher.get('subject')
-                for available_subj in all_subjects_set:
-                    if is_subject_match(teacher_subj, available_subj):
-                        assigned_subjects_data.append({"subject_name": available_subj})
-                        break
-        
-        print(f"📊 Processing {len(assigned_subjects_data)} assigned subjects")
-        
-        # 3. Get lectures statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_lectures,
-                COALESCE(SUM(downloads), 0) as total_downloads,
-                COALESCE(SUM(views), 0) as total_views,
-                COUNT(DISTINCT subject_name) as subjects_with_lectures
-            FROM lectures 
-            WHERE teacher_id = %s
-        """, (teacher_id,))
-        
-        lectures_stats = cursor.fetchone()
-        
-        # 4. Get assignments statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_assignments,
-                COALESCE(SUM(submissions), 0) as total_submissions,
-                COUNT(DISTINCT subject_name) as subjects_with_assignments,
-                SUM(CASE WHEN due_date < CURDATE() THEN 1 ELSE 0 END) as past_due,
-                SUM(CASE WHEN due_date >= CURDATE() THEN 1 ELSE 0 END) as upcoming
-            FROM assignments 
-            WHERE teacher_id = %s
-        """, (teacher_id,))
-        
-        assignments_stats = cursor.fetchone()
-        
-        # 5. Get quizzes statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_quizzes,
-                COALESCE(SUM(attempts), 0) as total_attempts,
-                COALESCE(AVG(average_score), 0) as avg_quiz_score,
-                COUNT(DISTINCT subject_name) as subjects_with_quizzes,
-                SUM(CASE WHEN is_published = 1 THEN 1 ELSE 0 END) as published,
-                SUM(CASE WHEN is_published = 0 THEN 1 ELSE 0 END) as draft
-            FROM quizzes 
-            WHERE teacher_id = %s
-        """, (teacher_id,))
-        
-        quizzes_stats = cursor.fetchone()
-        
-        # 6. Get materials statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_materials,
-                COALESCE(SUM(downloads), 0) as total_downloads,
-                COUNT(DISTINCT subject_name) as subjects_with_materials
-            FROM materials 
-            WHERE teacher_id = %s
-        """, (teacher_id,))
+            for available_subj in catalog_matches(teacher.get('subject'))[:1]:
+                assigned_subjects_data.append({"subject_name": available_subj})
         
-        materials_stats = cursor.fetchone()
-        
-        # 7. Get notifications statistics
-        cursor.execute("""
-            SELECT 
-                COUNT(*) as total_notifications,
-                COUNT(DISTINCT subject_name) as subjects_with_notifications
-            FROM notifications 
-            WHERE teacher_id = %s
-        """, (teacher_id,))
-        
-        notifications_stats = cursor.fetchone()
+        # 3. Counters from the maintained per-subject stats
+        stats_rows = read_teacher_stats(cursor, teacher_id)
+        totals = sum_teacher_stats(stats_rows)
         
         # 8. Get recent student submissions (for grading)
         cursor.execute("""
@@ -6496,62 +10251,24 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         subject_performance = []
         for subject_data in assigned_subjects_data[:5]:  # Limit to 5 subjects
             subject_name = subject_data["subject_name"]
-            
-            # Assignments for this subject
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_assignments,
-                    COALESCE(SUM(submissions), 0) as total_submissions,
-                    COALESCE(AVG(submissions), 0) as avg_submissions
-                FROM assignments 
-                WHERE teacher_id = %s 
-                AND subject_name = %s
-            """, (teacher_id, subject_name))
-            
-            assignment_stats = cursor.fetchone()
-            
-            # Quizzes for this subject
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_quizzes,
-                    COALESCE(SUM(attempts), 0) as total_attempts,
-                    COALESCE(AVG(average_score), 0) as avg_score
-                FROM quizzes 
-                WHERE teacher_id = %s 
-                AND subject_name = %s
-            """, (teacher_id, subject_name))
-            
-            quiz_stats = cursor.fetchone()
-            
-            # Lectures for this subject
-            cursor.execute("""
-                SELECT 
-                    COUNT(*) as total_lectures,
-                    COALESCE(SUM(downloads), 0) as total_downloads,
-                    COALESCE(AVG(downloads), 0) as avg_downloads
-                FROM lectures 
-                WHERE teacher_id = %s 
-                AND subject_name = %s
-            """, (teacher_id, subject_name))
-            
-            lecture_stats = cursor.fetchone()
+            row = stats_rows.get(subject_name) or {c: 0 for c in TEACHER_STAT_COLUMNS}
             
             subject_performance.append({
                 "subject_name": subject_name,
                 "assignments": {
-                    "total": assignment_stats['total_assignments'] or 0,
-                    "submissions": assignment_stats['total_submissions'] or 0,
-                    "avg_submissions": round(float(assignment_stats['avg_submissions'] or 0), 1)
+                    "total": row['assignments'],
+                    "submissions": row['submissions'],
+                    "avg_submissions": round(row['submissions'] / row['assignments'], 1) if row['assignments'] else 0
                 },
                 "quizzes": {
-                    "total": quiz_stats['total_quizzes'] or 0,
-                    "attempts": quiz_stats['total_attempts'] or 0,
-                    "avg_score": round(float(quiz_stats['avg_score'] or 0), 1)
+                    "total": row['quizzes'],
+                    "attempts": row['quiz_attempts'],
+                    "avg_score": round(float(row['quiz_score_sum']) / row['quiz_score_count'], 1) if row['quiz_score_count'] else 0
                 },
                 "lectures": {
-                    "total": lecture_stats['total_lectures'] or 0,
-                    "downloads": lecture_stats['total_downloads'] or 0,
-                    "avg_downloads": round(float(lecture_stats['avg_downloads'] or 0), 1)
+                    "total": row['lectures'],
+                    "downloads": row['lecture_downloads'],
+                    "avg_downloads": round(row['lecture_downloads'] / row['lectures'], 1) if row['lectures'] else 0
                 }
             })
         
@@ -6565,21 +10282,17 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         if total_students > 0:
             # Based on submissions and attempts
             total_engagement = (
-                (assignments_stats['total_submissions'] or 0) +
-                (quizzes_stats['total_attempts'] or 0)
+                totals['submissions'] +
+                totals['quiz_attempts']
             )
             max_possible_engagement = (
-                (assignments_stats['total_assignments'] or 0) * total_students +
-                (quizzes_stats['total_quizzes'] or 0) * total_students
+                totals['assignments'] * total_students +
+                totals['quizzes'] * total_students
             )
             
             if max_possible_engagement > 0:
                 engagement_score = (total_engagement / max_possible_engagement) * 100
         
-        print(f"🎉 Teacher dashboard stats calculated successfully!")
-        print(f"   Engagement score: {engagement_score:.1f}%")
-        print(f"   Pending grading: {len(pending_grading)}")
-        
         return {
             "success": True,
             "teacher_info": {
@@ -6592,34 +10305,34 @@ def get_teacher_dashboard_stats(teacher_userId: str):
             },
             "stats": {
                 "lectures": {
-                    "total": lectures_stats['total_lectures'] or 0,
-                    "downloads": lectures_stats['total_downloads'] or 0,
-                    "views": lectures_stats['total_views'] or 0,
-                    "subjects": lectures_stats['subjects_with_lectures'] or 0
+                    "total": totals['lectures'],
+                    "downloads": totals['lecture_downloads'],
+                    "views": totals['lecture_views'],
+                    "subjects": totals['subjects_with_lectures']
                 },
                 "assignments": {
-                    "total": assignments_stats['total_assignments'] or 0,
-                    "submissions": assignments_stats['total_submissions'] or 0,
-                    "subjects": assignments_stats['subjects_with_assignments'] or 0,
-                    "past_due": assignments_stats['past_due'] or 0,
-                    "upcoming": assignments_stats['upcoming'] or 0
+                    "total": totals['assignments'],
+                    "submissions": totals['submissions'],
+                    "subjects": totals['subjects_with_assignments'],
+                    "past_due": teacher['past_due'] or 0,
+                    "upcoming": teacher['upcoming'] or 0
                 },
                 "quizzes": {
-                    "total": quizzes_stats['total_quizzes'] or 0,
-                    "attempts": quizzes_stats['total_attempts'] or 0,
-                    "avg_score": round(float(quizzes_stats['avg_quiz_score'] or 0), 1),
-                    "subjects": quizzes_stats['subjects_with_quizzes'] or 0,
-                    "published": quizzes_stats['published'] or 0,
-                    "draft": quizzes_stats['draft'] or 0
+                    "total": totals['quizzes'],
+                    "attempts": totals['quiz_attempts'],
+                    "avg_score": round(totals['quiz_score_sum'] / totals['quiz_score_count'], 1) if totals['quiz_score_count'] else 0,
+                    "subjects": totals['subjects_with_quizzes'],
+                    "published": totals['quizzes_published'],
+                    "draft": totals['quizzes'] - totals['quizzes_published']
                 },
                 "materials": {
-                    "total": materials_stats['total_materials'] or 0,
-                    "downloads": materials_stats['total_downloads'] or 0,
-                    "subjects": materials_stats['subjects_with_materials'] or 0
+                    "total": totals['materials'],
+                    "downloads": totals['material_downloads'],
+                    "subjects": totals['subjects_with_materials']
                 },
                 "notifications": {
-                    "total": notifications_stats['total_notifications'] or 0,
-                    "subjects": notifications_stats['subjects_with_notifications'] or 0
+                    "total": totals['notifications'],
+                    "subjects": totals['subjects_with_notifications']
                 },
                 "engagement_score": round(engagement_score, 1)
             },
@@ -6630,9 +10343,7 @@ def get_teacher_dashboard_stats(teacher_userId: str):
         }
         
     except Exception as e:
-        print(f"❌ ERROR in get_teacher_dashboard_stats: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error in get_teacher_dashboard_stats for %s", teacher_userId)
         return {"success": False, "error": str(e)}
 
 @app.get("/teacher/{teacher_userId}/dashboard/quick-stats")
@@ -6651,24 +10362,7 @@ def get_teacher_quick_stats(teacher_userId: str):
         
         teacher_id = teacher['id']
         
-        # Get counts
-        cursor.execute("SELECT COUNT(*) as lectures FROM lectures WHERE teacher_id = %s", (teacher_id,))
-        lectures = cursor.fetchone()
-        
-        cursor.execute("SELECT COUNT(*) as assignments FROM assignments WHERE teacher_id = %s", (teacher_id,))
-        assignments = cursor.fetchone()
-        
-        cursor.execute("SELECT COUNT(*) as quizzes FROM quizzes WHERE teacher_id = %s", (teacher_id,))
-        quizzes = cursor.fetchone()
-        
-        cursor.execute("""
-            SELECT COUNT(*) as pending 
-            FROM assignment_submissions s
-            JOIN assignments a ON s.assignment_id = a.id
-            WHERE a.teacher_id = %s AND s.marks_obtained IS NULL
-        """, (teacher_id,))
-        
-        pending = cursor.fetchone()
+        totals = sum_teacher_stats(read_teacher_stats(cursor, teacher_id))
         
         cursor.close()
         db.close()
@@ -6676,10 +10370,10 @@ def get_teacher_quick_stats(teacher_userId: str):
         return {
             "success": True,
             "quick_stats": {
-                "lectures": lectures['lectures'] or 0,
-                "assignments": assignments['assignments'] or 0,
-                "quizzes": quizzes['quizzes'] or 0,
-                "pending_grading": pending['pending'] or 0
+                "lectures": totals['lectures'],
+                "assignments": totals['assignments'],
+                "quizzes": totals['quizzes'],
+                "pending_grading": totals['pending_grading']
             }
         }
         
@@ -6771,4 +10465,11 @@ def get_teacher_recent_activity(teacher_userId: str, limit: int = 10):
         }
         
     except Exception as e:
-        return {"success": False, "error": str(e)}
\ No newline at end of file
+        return {"success": False, "error": str(e)}
+
+
+# Shutdown hooks run in registration order: registered last, so every hook above
+# (e.g. the download counter flush) can still get its log records written
+@app.on_event("shutdown")
+def stop_log_listener():
+    log_listener.stop()
@@ -0,0 +1,180 @@
+"""
+Concurrent request latency benchmark for the Islamic Center API.
+
+Measures how long a cheap probe request (GET / by default) takes while a
+number of slow requests (large lecture uploads, or any other endpoint) are
+in flight. When blocking DB/file work runs on the event loop, probe latency
+climbs with the slow requests; when it runs on the worker thread pool the
+probe stays fast.
+
+Run it against the server before and after a change:
+
+    uvicorn app:app --port 8000            # in another terminal
+    python bench_concurrency.py --teacher-id teacher_hamna_5674 --upload-mb 200
+
+Upload load creates real lectures; they are deleted again (DELETE /lectures/{id})
+once the run ends. Uploads still in flight when the probes finish are waited for
+first, so an interrupted run (Ctrl+C) is the only way to leave "bench upload" rows
+behind.
+
+Only the standard library is used so it runs in the backend venv as-is.
+"""
+import argparse
+import io
+import json
+import statistics
+import threading
+import time
+import urllib.request
+import uuid
+
+
+def timed_get(url):
+    start = time.perf_counter()
+    with urllib.request.urlopen(url, timeout=300) as resp:
+        resp.read()
+    return time.perf_counter() - start
+
+
+def multipart_upload(url, fields, file_field, file_name, file_size):
+    """POST a multipart form with a generated file of file_size bytes"""
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f"--{boundary}\r\nContent-Disposition: form-data; name=\"{name}\"\r\n\r\n{value}\r\n".encode())
+    body.write(
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"{file_field}\"; "
+        f"filename=\"{file_name}\"\r\nContent-Type: application/octet-stream\r\n\r\n".encode()
+    )
+    chunk = b"\0" * (1024 * 1024)
+    remaining = file_size
+    while remaining > 0:
+        body.write(chunk[:min(len(chunk), remaining)])
+        remaining -= len(chunk)
+    body.write(f"\r\n--{boundary}--\r\n".encode())
+
+    req = urllib.request.Request(url, data=body.getvalue(), method="POST")
+    req.add_header("Content-Type", f"multipart/form-data; boundary={boundary}")
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=600) as resp:
+        payload = json.loads(resp.read() or b"{}")
+    return time.perf_counter() - start, payload
+
+
+def delete_lecture(base_url, lecture_id):
+    req = urllib.request.Request(f"{base_url}/lectures/{lecture_id}", method="DELETE")
+    with urllib.request.urlopen(req, timeout=60) as resp:
+        resp.read()
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--probe-path", default="/", help="cheap endpoint whose latency is measured")
+    parser.add_argument("--probes", type=int, default=200, help="number of probe requests")
+    parser.add_argument("--probe-concurrency", type=int, default=10)
+    parser.add_argument("--slow-path", default=None,
+                        help="GET endpoint used as background load instead of uploads "
+                             "(e.g. /student/STUDENT_ID/dashboard/stats)")
+    parser.add_argument("--slow-concurrency", type=int, default=8, help="slow requests kept in flight")
+    parser.add_argument("--teacher-id", default=None, help="teacher userId used for upload load")
+    parser.add_argument("--subject", default="Tajveed")
+    parser.add_argument("--upload-mb", type=int, default=100)
+    args = parser.parse_args()
+
+    if not args.slow_path and not args.teacher_id:
+        parser.error("give --slow-path or --teacher-id (for upload load)")
+
+    stop = threading.Event()
+    slow_times = []
+    created_lectures = []
+    slow_lock = threading.Lock()
+
+    def slow_worker(n):
+        while not stop.is_set():
+            try:
+                if args.slow_path:
+                    elapsed = timed_get(args.base_url + args.slow_path)
+                else:
+                    elapsed, payload = multipart_upload(
+                        args.base_url + "/lectures",
+                        {
+                            "teacher_id": args.teacher_id,
+                            "subject_name": args.subject,
+                            "title": f"bench upload {n} {uuid.uuid4().hex[:6]}",
+                            "description": "bench_concurrency.py",
+                        },
+                        "file", "bench.mp4", args.upload_mb * 1024 * 1024,
+                    )
+                    if payload.get("lecture_id"):
+                        with slow_lock:
+                            created_lectures.append(payload["lecture_id"])
+                with slow_lock:
+                    slow_times.append(elapsed)
+            except Exception as e:
+                print(f"slow request failed: {e}")
+                time.sleep(0.5)
+
+    def probe_run(count, results):
+        for _ in range(count):
+            results.append(timed_get(args.base_url + args.probe_path))
+
+    # Baseline probe latency with an idle server
+    idle = []
+    probe_run(min(args.probes, 50), idle)
+
+    workers = [threading.Thread(target=slow_worker, args=(i,), daemon=True) for i in range(args.slow_concurrency)]
+    for w in workers:
+        w.start()
+    time.sleep(1.0)  # let the slow requests get going
+
+    loaded = []
+    per_thread = max(1, args.probes // args.probe_concurrency)
+    probes = [threading.Thread(target=probe_run, args=(per_thread, loaded)) for _ in range(args.probe_concurrency)]
+    started = time.perf_counter()
+    for t in probes:
+        t.start()
+    for t in probes:
+        t.join()
+    wall = time.perf_counter() - started
+    stop.set()
+    for w in workers:
+        w.join()
+
+    deleted = 0
+    for lecture_id in created_lectures:
+        try:
+            delete_lecture(args.base_url, lecture_id)
+            deleted += 1
+        except Exception as e:
+            print(f"could not delete bench lecture {lecture_id}: {e}")
+
+    def summary(values):
+        return {
+            "count": len(values),
+            "p50_ms": round(statistics.median(values) * 1000, 1),
+            "p95_ms": round(percentile(values, 95) * 1000, 1),
+            "max_ms": round(max(values) * 1000, 1),
+        }
+
+    report = {
+        "probe_path": args.probe_path,
+        "slow_load": args.slow_path or f"POST /lectures ({args.upload_mb} MB)",
+        "slow_concurrency": args.slow_concurrency,
+        "probe_idle": summary(idle),
+        "probe_under_load": summary(loaded),
+        "probe_throughput_rps": round(len(loaded) / wall, 1),
+        "slow_requests_completed": len(slow_times),
+        "bench_lectures_deleted": f"{deleted}/{len(created_lectures)}",
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
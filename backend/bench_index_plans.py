@@ -0,0 +1,142 @@
+"""
+Query plan benchmark for the hot-column indexes (schema migration 2).
+
+Runs the filters the API uses most (teacher/subject lists, notification feeds,
+submission and attempt lookups, quiz answer keys, login) twice against the
+same database: once with the migration's `idx_*` indexes hidden through
+IGNORE INDEX, once as the optimizer sees them. For each query it prints the
+access type, chosen key and estimated rows from EXPLAIN, plus the median
+execution time, so the plan change is visible side by side.
+
+Apply the migrations first (start the server once, or POST /admin/schema/migrate),
+then run it with the same DB_* environment variables as the server:
+
+    python bench_index_plans.py --repeat 50
+
+Only mysql-connector (already a backend dependency) is needed.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import mysql.connector
+
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST", "localhost"),
+    "user": os.getenv("DB_USER", "root"),
+    "password": os.getenv("DB_PASSWORD", ""),
+    "database": os.getenv("DB_NAME", "islamiccenter"),
+}
+
+# {table} placeholders are replaced by the table name, optionally followed by IGNORE INDEX (...)
+QUERIES = [
+    ("teacher lectures by subject",
+     "SELECT l.id FROM {lectures} l WHERE l.teacher_id = %(teacher_id)s AND l.subject_name = %(subject)s"),
+    ("teacher assignments by subject",
+     "SELECT a.id FROM {assignments} a WHERE a.teacher_id = %(teacher_id)s AND a.subject_name = %(subject)s"),
+    ("open assignments in subject",
+     "SELECT COUNT(*) FROM {assignments} a WHERE a.subject_name = %(subject)s AND a.due_date >= CURDATE()"),
+    ("subject notification feed",
+     "SELECT n.id FROM {notifications} n WHERE n.subject_name = %(subject)s ORDER BY n.created_date DESC LIMIT 20"),
+    ("newest notifications page",
+     "SELECT n.id FROM {notifications} n ORDER BY n.created_date DESC, n.id DESC LIMIT 50"),
+    ("student submission for assignment",
+     "SELECT s.id FROM {assignment_submissions} s WHERE s.assignment_id = %(assignment_id)s AND s.student_id = %(student_id)s"),
+    ("student attempts for quiz",
+     "SELECT sa.id FROM {student_attempts} sa WHERE sa.student_id = %(student_id)s AND sa.quiz_id = %(quiz_id)s"),
+    ("quiz answer key options",
+     "SELECT o.id FROM {options} o JOIN {questions} q ON o.question_id = q.id WHERE q.quiz_id = %(quiz_id)s"),
+    ("login / user lookup",
+     "SELECT u.id FROM {users} u WHERE u.userId = %(user_id)s AND u.role = 'student'"),
+]
+
+
+def sample_params(cursor):
+    """Realistic parameter values taken from the data itself"""
+    def scalar(sql, default):
+        cursor.execute(sql)
+        row = cursor.fetchone()
+        return row[0] if row and row[0] is not None else default
+
+    return {
+        "teacher_id": scalar("SELECT teacher_id FROM lectures GROUP BY teacher_id ORDER BY COUNT(*) DESC LIMIT 1", 0),
+        "subject": scalar("SELECT subject_name FROM notifications GROUP BY subject_name ORDER BY COUNT(*) DESC LIMIT 1", ""),
+        "assignment_id": scalar("SELECT assignment_id FROM assignment_submissions ORDER BY id DESC LIMIT 1", 0),
+        "student_id": scalar("SELECT student_id FROM assignment_submissions ORDER BY id DESC LIMIT 1", 0),
+        "quiz_id": scalar("SELECT quiz_id FROM student_attempts ORDER BY id DESC LIMIT 1", 0),
+        "user_id": scalar("SELECT userId FROM users WHERE role = 'student' ORDER BY id DESC LIMIT 1", ""),
+    }
+
+
+def migration_indexes(cursor):
+    """{table: [idx_* index names]} created by the migration"""
+    cursor.execute("""
+        SELECT DISTINCT table_name, index_name
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE() AND index_name LIKE 'idx\\_%'
+    """)
+    indexes = {}
+    for table, index in cursor.fetchall():
+        indexes.setdefault(table, []).append(index)
+    return indexes
+
+
+def render(template, indexes, hide):
+    tables = {}
+    for table in ("lectures", "assignments", "notifications", "assignment_submissions",
+                  "student_attempts", "options", "questions", "users"):
+        names = indexes.get(table)
+        tables[table] = f"{table} IGNORE INDEX ({', '.join(names)})" if hide and names else table
+    return template.format(**tables)
+
+
+def explain(cursor, sql, params):
+    cursor.execute(f"EXPLAIN {sql}", params)
+    columns = [c[0] for c in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    return " | ".join(
+        f"{row['table']}:{row['type']}/{row['key'] or '-'}/{row['rows']}" for row in rows
+    )
+
+
+def median_ms(cursor, sql, params, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        cursor.execute(sql, params)
+        cursor.fetchall()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=20, help="executions per query and mode")
+    args = parser.parse_args()
+
+    conn = mysql.connector.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    params = sample_params(cursor)
+    indexes = migration_indexes(cursor)
+    if not indexes:
+        print("No idx_* indexes found: apply the schema migrations first (POST /admin/schema/migrate).")
+
+    print(f"{'query':<36} {'mode':<9} {'plan (table:type/key/rows)':<70} {'median ms':>9}")
+    for label, template in QUERIES:
+        for mode, hide in (("without", True), ("with", False)):
+            sql = render(template, indexes, hide)
+            try:
+                plan = explain(cursor, sql, params)
+                ms = median_ms(cursor, sql, params, args.repeat)
+                print(f"{label:<36} {mode:<9} {plan:<70} {ms:>9.2f}")
+            except mysql.connector.Error as e:
+                print(f"{label:<36} {mode:<9} error: {e}")
+
+    cursor.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()